@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+"""Offline benchmarks of the chutie capture pipeline"""
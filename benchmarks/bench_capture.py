@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark ``get_screenshots`` against a local synthetic site
+
+Runs the capture pipeline at several url x viewport scales and writes
+captures/sec, p50/p95 capture latency and peak RSS as JSON; optionally
+compares them with a saved baseline::
+
+    python -m benchmarks.bench_capture -o baseline.json
+    python -m benchmarks.bench_capture -o current.json --baseline baseline.json
+"""
+
+import collections
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import click
+from syncer import sync
+
+from benchmarks import synthetic_site
+from chutie import chutie
+from chutie import metrics
+
+VIEWPORTS = ["1024x768", "320x568 mobile", "1920x1080", "800x600"]
+DEFAULT_SCALES = "1x1,4x2,16x2"
+
+# stages that make up the latency of one screenshot
+LATENCY_STAGES = ("navigate", "resize", "screenshot", "write")
+
+
+def parse_scales(scales):
+    """
+    Args:
+        scales (str): comma separated ``URLSxVIEWPORTS`` pairs, e.g.
+            ``1x1,4x2``
+    Returns:
+        list[tuple]: ``(urls, viewports)`` int pairs
+    """
+    pairs = []
+    for scale in scales.split(","):
+        urls, viewports = scale.strip().lower().split("x")
+        pairs.append((int(urls), int(viewports)))
+    return pairs
+
+
+def _peak_rss_kb():
+    """
+    Returns:
+        dict: peak resident set size in KiB of this process and of its
+            waited-for child processes (e.g. closed browsers)
+    """
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    scale = 1024 if sys.platform == "darwin" else 1
+    return dict(
+        self=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        children=resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def run_scenario(base_url, n_urls, n_viewports, page=None, concurrency=1,
+                 **capture_options):
+    """Take screenshots of ``n_urls`` synthetic pages in ``n_viewports``
+    viewports
+
+    Returns:
+        dict: ``captures``, ``seconds``, ``captures_per_sec``,
+            ``p50``/``p95`` screenshot latency (seconds), ``failed``,
+            ``peak_rss_kb`` and the ``stages`` summary
+    """
+    urls = synthetic_site.page_urls(base_url, n_urls, **(page or {}))
+    viewports = (VIEWPORTS * (n_viewports // len(VIEWPORTS) + 1))[
+        :n_viewports]
+    recorder = metrics.Recorder()
+    with tempfile.TemporaryDirectory() as dest_path:
+        started = time.monotonic()
+        context = sync(chutie.get_screenshots(
+            urls, viewports, dest_path, concurrency=concurrency,
+            metrics=recorder, **capture_options))
+        seconds = time.monotonic() - started
+    datas = [data for datas in context["pages"].values() for data in datas]
+    latencies = [
+        sum(data["timings"].get(stage, 0) for stage in LATENCY_STAGES)
+        for data in datas if "timings" in data]
+    latency = metrics.summarize(latencies)
+    captures = len(latencies)
+    return collections.OrderedDict([
+        ("name", f"{n_urls}x{n_viewports}"),
+        ("urls", n_urls),
+        ("viewports", n_viewports),
+        ("concurrency", concurrency),
+        ("captures", captures),
+        ("failed", len(datas) - captures),
+        ("seconds", seconds),
+        ("captures_per_sec", captures / seconds if seconds else 0.0),
+        ("p50", latency["p50"]),
+        ("p95", latency["p95"]),
+        ("peak_rss_kb", _peak_rss_kb()),
+        ("stages", recorder.summary()),
+    ])
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results with a baseline, scenario by scenario
+
+    Args:
+        results (dict): as written by ``main``
+        baseline (dict): as written by ``main``
+    Kwargs:
+        tolerance (float): relative slowdown allowed before a scenario
+            counts as a regression (default: 0.1)
+    Returns:
+        list[dict]: ``name``, ``metric``, ``baseline``, ``current``,
+            ``change`` (relative; positive is worse) and ``regression``
+            for each metric of each scenario in both
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    rows = []
+    for result in results["results"]:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        for metric, higher_is_better in (("captures_per_sec", True),
+                                         ("p50", False), ("p95", False)):
+            before, after = old[metric], result[metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            if higher_is_better:
+                change = -change
+            rows.append(collections.OrderedDict([
+                ("name", result["name"]),
+                ("metric", metric),
+                ("baseline", before),
+                ("current", after),
+                ("change", change),
+                ("regression", change > tolerance),
+            ]))
+    return rows
+
+
+@click.command()
+@click.option("--scales", default=DEFAULT_SCALES, show_default=True,
+              help="Comma separated URLSxVIEWPORTS scenarios.")
+@click.option("--size", default=50, show_default=True,
+              help="HTML size of each page in KiB.")
+@click.option("--depth", default=10, show_default=True,
+              help="DOM depth of each page.")
+@click.option("--images", default=5, show_default=True,
+              help="Number of images on each page.")
+@click.option("--image-kb", default=20, show_default=True,
+              help="Size of each image in KiB.")
+@click.option("--height", default=3000, show_default=True,
+              help="Minimum page height in pixels.")
+@click.option("--latency", default=20, show_default=True,
+              help="Milliseconds of latency per request.")
+@click.option("-j", "--concurrency", default=1, show_default=True,
+              help="Number of tabs to take screenshots in at once.")
+@click.option("--single-capture", is_flag=True, default=False,
+              help="Crop viewport screenshots from full page screenshots.")
+@click.option("-o", "--output", default=None,
+              help="Write results as JSON to this file (default: stdout).")
+@click.option("--baseline", default=None,
+              help="Compare with the results in this JSON file.")
+@click.option("--tolerance", default=0.1, show_default=True,
+              help="Relative slowdown allowed before failing.")
+def main(scales, size, depth, images, image_kb, height, latency,
+         concurrency, single_capture, output, baseline, tolerance):
+    """Benchmark taking screenshots of a local synthetic site"""
+    page = dict(size=size, depth=depth, images=images, image_kb=image_kb,
+                height=height, latency=latency)
+    results = collections.OrderedDict([
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("page", page),
+        ("results", []),
+    ])
+    with synthetic_site.running_site() as base_url:
+        for n_urls, n_viewports in parse_scales(scales):
+            result = run_scenario(
+                base_url, n_urls, n_viewports, page=page,
+                concurrency=concurrency, single_capture=single_capture)
+            results["results"].append(result)
+            click.echo(
+                f"{result['name']}: {result['captures_per_sec']:.2f}"
+                f" captures/sec, p50 {result['p50']:.3f}s,"
+                f" p95 {result['p95']:.3f}s", err=True)
+
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as _file:
+            _file.write(text)
+    else:
+        click.echo(text)
+
+    if baseline:
+        with open(baseline) as _file:
+            rows = compare(results, json.load(_file), tolerance=tolerance)
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            click.echo(
+                f"{row['name']} {row['metric']}: {row['baseline']:.3f}"
+                f" -> {row['current']:.3f} ({row['change']:+.1%} worse)"
+                f" {flag}", err=True)
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
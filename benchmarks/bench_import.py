@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the startup time of each ``chutie`` subcommand
+
+Runs ``chutie <command> --help`` for every subcommand in a fresh
+interpreter, and records the time taken to import ``chutie.cli`` and run
+the command, and which heavy dependencies (the browser, YAML and jinja2)
+were imported. None of them are needed to start any command::
+
+    python -m benchmarks.bench_import -o baseline.json
+    python -m benchmarks.bench_import -o current.json --baseline baseline.json
+"""
+
+import collections
+import json
+import platform
+import subprocess
+import sys
+
+import click
+
+# top-level packages that only the commands that use them may import
+HEAVY_MODULES = ("pyppeteer", "websockets", "syncer", "jinja2", "yaml", "PIL",
+                 "asyncio")
+
+# run in a fresh interpreter: import chutie.cli, run a command, and print
+# the time taken and the heavy modules that were imported
+_PROBE = """
+import contextlib, io, json, sys, time
+started = time.perf_counter()
+from chutie import cli
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        cli.main.main(sys.argv[1:], prog_name="chutie")
+    except SystemExit:
+        pass
+seconds = time.perf_counter() - started
+heavy = sorted({name.split(".")[0] for name in sys.modules} & set(%r))
+print(json.dumps(dict(seconds=seconds, modules=heavy)))
+""" % (HEAVY_MODULES,)
+
+
+def commands():
+    """
+    Returns:
+        list[str]: the names of the ``chutie`` subcommands
+    """
+    from chutie import cli
+
+    return sorted(cli.main.commands)
+
+
+def measure(args, repeat=5):
+    """Run ``chutie <args>`` in ``repeat`` fresh interpreters
+
+    Args:
+        args (list[str]): command line arguments
+    Kwargs:
+        repeat (int): number of runs (the fastest one is kept)
+    Returns:
+        dict: ``name``, ``seconds`` (the fastest run) and the heavy
+            ``modules`` that were imported
+    """
+    runs = []
+    for _ in range(max(1, repeat)):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE] + list(args),
+            stdout=subprocess.PIPE, check=True).stdout
+        runs.append(json.loads(output.decode("utf-8").splitlines()[-1]))
+    return collections.OrderedDict([
+        ("name", " ".join(args)),
+        ("seconds", min(run["seconds"] for run in runs)),
+        ("modules", runs[0]["modules"]),
+    ])
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Compare results with a baseline, command by command
+
+    Args:
+        results (dict): as written by ``main``
+        baseline (dict): as written by ``main``
+    Kwargs:
+        tolerance (float): relative slowdown allowed before a command
+            counts as a regression (default: 0.25)
+    Returns:
+        list[dict]: ``name``, ``baseline``, ``current``, ``change``
+            (relative; positive is slower) and ``regression`` (also set if
+            a command imports a heavy module) for each command in both
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    rows = []
+    for result in results["results"]:
+        old = previous.get(result["name"])
+        if old is None or not old["seconds"]:
+            continue
+        change = (result["seconds"] - old["seconds"]) / old["seconds"]
+        rows.append(collections.OrderedDict([
+            ("name", result["name"]),
+            ("baseline", old["seconds"]),
+            ("current", result["seconds"]),
+            ("change", change),
+            ("regression", change > tolerance or bool(result["modules"])),
+        ]))
+    return rows
+
+
+@click.command()
+@click.option("--repeat", default=5, show_default=True,
+              help="Number of runs of each command (the fastest is kept).")
+@click.option("-o", "--output", default=None,
+              help="Write results as JSON to this file (default: stdout).")
+@click.option("--baseline", default=None,
+              help="Compare with the results in this JSON file.")
+@click.option("--tolerance", default=0.25, show_default=True,
+              help="Relative slowdown allowed before failing.")
+def main(repeat, output, baseline, tolerance):
+    """Benchmark the startup time of each chutie subcommand"""
+    results = collections.OrderedDict([
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("results", []),
+    ])
+    for args in [["--help"]] + [[name, "--help"] for name in commands()]:
+        result = measure(args, repeat=repeat)
+        results["results"].append(result)
+        click.echo(
+            f"chutie {result['name']}: {result['seconds'] * 1000:.1f} ms"
+            + (f" (imports {', '.join(result['modules'])})"
+               if result["modules"] else ""), err=True)
+
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as _file:
+            _file.write(text)
+    else:
+        click.echo(text)
+
+    heavy = [result for result in results["results"] if result["modules"]]
+    if baseline:
+        with open(baseline) as _file:
+            rows = compare(results, json.load(_file), tolerance=tolerance)
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            click.echo(
+                f"chutie {row['name']}: {row['baseline'] * 1000:.1f}"
+                f" -> {row['current'] * 1000:.1f} ms"
+                f" ({row['change']:+.1%} slower) {flag}", err=True)
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+    if heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""A local HTTP server of synthetic pages with a controlled size, DOM depth,
+image weight, page height and latency
+
+Pages are at ``/page/<n>`` and take these query parameters:
+
+* ``size``: approximate HTML size in KiB (default: 10)
+* ``depth``: depth of nested ``div`` elements (default: 5)
+* ``images``: number of images (default: 0)
+* ``image_kb``: approximate size of each (incompressible) image in KiB
+  (default: 10)
+* ``height``: minimum page height in pixels (default: 2000)
+* ``latency``: milliseconds to wait before answering each request,
+  including image requests (default: 0)
+"""
+
+import contextlib
+import http.server
+import os
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from chutie import png
+
+DEFAULT_PAGE = dict(size=10, depth=5, images=0, image_kb=10, height=2000,
+                    latency=0)
+
+_FILLER = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do"
+           " eiusmod tempor incididunt ut labore et dolore magna aliqua. ")
+
+
+def make_page(number=0, size=10, depth=5, images=0, image_kb=10,
+              height=2000, latency=0):
+    """
+    Kwargs:
+        number (int): page number (makes image urls unique per page)
+        see the module docstring for the others
+    Returns:
+        str: HTML
+    """
+    image_query = urlencode(dict(image_kb=image_kb, latency=latency))
+    imgs = "".join(
+        f'<img src="/image/{number}-{n}.png?{image_query}" width="256">'
+        for n in range(images))
+    head = (
+        "<!doctype html><html><head><meta charset=\"utf-8\">"
+        f"<title>Synthetic page {number}</title>"
+        "<style>div { padding: 2px; border-left: 1px solid #ccc; }</style>"
+        f"</head><body style=\"min-height: {height}px\">")
+    opening = "<div>" * depth
+    closing = "</div>" * depth + "</body></html>"
+    used = len(head) + len(opening) + len(imgs) + len(closing)
+    filler_chars = max(0, size * 1024 - used)
+    paragraphs = []
+    while filler_chars > 0:
+        text = _FILLER[:max(0, filler_chars - 7)]
+        paragraphs.append(f"<p>{text}</p>")
+        filler_chars -= len(text) + 7
+    return head + opening + imgs + "".join(paragraphs) + closing
+
+
+_IMAGES = {}
+_IMAGES_LOCK = threading.Lock()
+
+
+def make_image(kb=10, width=256):
+    """
+    Kwargs:
+        kb (int): approximate size in KiB
+        width (int): width in pixels
+    Returns:
+        bytes: an RGBA PNG of random pixels (which don't compress)
+    """
+    with _IMAGES_LOCK:
+        if kb not in _IMAGES:
+            height = max(1, (kb * 1024) // (width * 4))
+            _IMAGES[kb] = png.encode(
+                (os.urandom(width * 4) for _ in range(height)), width, height,
+                level=1)
+        return _IMAGES[kb]
+
+
+def _int_params(query, defaults):
+    params = dict(defaults)
+    for key, values in parse_qs(query).items():
+        if key in params:
+            params[key] = int(values[0])
+    return params
+
+
+class SyntheticSiteHandler(http.server.BaseHTTPRequestHandler):
+    """Serve ``/page/<n>`` and ``/image/<name>.png``"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = _int_params(url.query, DEFAULT_PAGE)
+        if params["latency"]:
+            time.sleep(params["latency"] / 1000)
+        if url.path.startswith("/page/"):
+            number = url.path[len("/page/"):] or "0"
+            body = make_page(number=number, **params).encode("utf-8")
+            content_type = "text/html; charset=utf-8"
+        elif url.path.startswith("/image/"):
+            body = make_image(params["image_kb"])
+            content_type = "image/png"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyntheticSiteServer(socketserver.ThreadingMixIn,
+                          http.server.HTTPServer):
+    daemon_threads = True
+
+
+@contextlib.contextmanager
+def running_site(host="127.0.0.1", port=0):
+    """Run a synthetic site in a background thread
+
+    Kwargs:
+        host (str): address to listen on
+        port (int): port to listen on (default: 0, any free port)
+    Yields:
+        str: the site's base url, e.g. ``http://127.0.0.1:41234``
+    """
+    server = SyntheticSiteServer((host, port), SyntheticSiteHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def page_urls(base_url, count, **params):
+    """
+    Args:
+        base_url (str): as yielded by ``running_site``
+        count (int): number of pages
+    Kwargs:
+        params: page parameters (see the module docstring)
+    Returns:
+        list[str]: urls of ``count`` distinct pages
+    """
+    query = urlencode(dict(DEFAULT_PAGE, **params))
+    return [f"{base_url}/page/{n}?{query}" for n in range(count)]
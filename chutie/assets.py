@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+"""Warm HTTP caches shared by captures: a persistent browser profile
+(user data and disk cache directory) and an in-process cache of
+subresources (stylesheets, scripts, fonts, images) served through request
+interception
+
+Chromium disables its own cache for a page with request interception on
+(which blocking profiles need), so the asset cache is what keeps shared
+bundles and fonts from being fetched again for each page and viewport in
+that case. Without interception, the persistent profile's disk cache does
+the same across runs.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import shutil
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from chutie import cache as capture_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_DISK_CACHE_SIZE = 512 * 1024 ** 2
+DEFAULT_ASSET_CACHE_SIZE = 256 * 1024 ** 2
+
+# resource types worth keeping: shared between pages and rarely personalized
+CACHEABLE_TYPES = ("stylesheet", "script", "font", "image")
+
+# response headers that must not be replayed to another page
+_UNSAFE_HEADERS = ("set-cookie", "content-length", "content-encoding",
+                   "transfer-encoding", "connection")
+
+
+def default_profile_dir():
+    """
+    Returns:
+        str: ``$XDG_CACHE_HOME/chutie-browser``, next to (not inside) the
+            capture cache, whose eviction would remove it
+    """
+    return capture_cache.default_cache_dir() + "-browser"
+
+
+def hit_ratio(hits, total):
+    return round(hits / total, 4) if total else None
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(str(path)):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class BrowserProfile(object):
+    """A persistent directory of browser profiles
+
+    A profile directory can only be used by one browser at a time, so it
+    holds numbered slots (``slot-0``, ``slot-1``, ...), each with its own
+    ``user-data`` and ``disk-cache`` directories; each browser launched
+    with this profile locks a free slot, and concurrent runs (or the
+    processes of a sharded run) each warm up their own.
+    """
+
+    def __init__(self, path=None, disk_cache_size=DEFAULT_DISK_CACHE_SIZE):
+        """
+        Kwargs:
+            path (str or None): profile directory
+                (default: ``default_profile_dir()``)
+            disk_cache_size (int): size limit of each slot's disk cache,
+                which the browser enforces itself; ``evict`` also empties
+                the disk cache of a slot that outgrew it
+        """
+        self.path = Path(path or default_profile_dir())
+        self.disk_cache_size = disk_cache_size
+        self.stats = {"responses": 0, "from_cache": 0}
+        self._locks = {}
+
+    def __getstate__(self):
+        # slot locks stay in the process that holds them
+        state = dict(self.__dict__)
+        state["_locks"] = {}
+        return state
+
+    def _lock(self, slot):
+        """
+        Returns:
+            file or None: the open lock file of a slot (None if another
+                browser holds it)
+        """
+        lockfile = open(str(slot) + ".lock", "a")
+        if fcntl is None:
+            return lockfile
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lockfile.close()
+            return None
+        return lockfile
+
+    def acquire(self):
+        """Lock a free slot
+
+        Returns:
+            Path: the slot directory (created if needed)
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            # no locking: one slot per process
+            slot = self.path / f"slot-{os.getpid()}"
+            self._locks[slot] = self._lock(slot)
+            slot.mkdir(exist_ok=True)
+            return slot
+        n = 0
+        while True:
+            slot = self.path / f"slot-{n}"
+            if slot not in self._locks:
+                lockfile = self._lock(slot)
+                if lockfile is not None:
+                    self._locks[slot] = lockfile
+                    slot.mkdir(exist_ok=True)
+                    return slot
+            n += 1
+
+    def release(self, slot):
+        """Unlock a slot locked by ``acquire``"""
+        lockfile = self._locks.pop(slot, None)
+        if lockfile is not None:
+            lockfile.close()
+
+    def launch_options(self, slot):
+        """
+        Args:
+            slot (Path): as returned by ``acquire``
+        Returns:
+            dict: ``pyppeteer.launch`` options to use the slot
+        """
+        return {
+            "userDataDir": str(slot / "user-data"),
+            "args": [
+                f"--disk-cache-dir={slot / 'disk-cache'}",
+                f"--disk-cache-size={int(self.disk_cache_size)}",
+            ],
+        }
+
+    def watch(self, page):
+        """Count the responses of a page that the browser cache served"""
+
+        def on_response(response):
+            self.stats["responses"] += 1
+            if response.fromCache:
+                self.stats["from_cache"] += 1
+
+        page.on("response", on_response)
+
+    def merge(self, stats):
+        """Add the counts of another process's copy
+
+        Args:
+            stats (dict): ``BrowserProfile.stats``
+        """
+        for key in self.stats:
+            self.stats[key] += stats[key]
+
+    def evict(self):
+        """Empty the disk cache of each unlocked slot that is larger than
+        ``disk_cache_size`` (e.g. after the limit was lowered)
+
+        Returns:
+            int: number of disk caches emptied
+        """
+        if not self.path.exists():
+            return 0
+        removed = 0
+        for slot in sorted(self.path.glob("slot-*")):
+            if not slot.is_dir() or slot in self._locks:
+                continue
+            lockfile = self._lock(slot)
+            if lockfile is None:
+                continue
+            try:
+                disk_cache = slot / "disk-cache"
+                if _dir_size(disk_cache) > self.disk_cache_size:
+                    shutil.rmtree(str(disk_cache), ignore_errors=True)
+                    removed += 1
+            finally:
+                lockfile.close()
+        return removed
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: ``path``, response counts and the browser cache hit ratio,
+                for run metadata
+        """
+        return dict(
+            path=str(self.path), **self.stats,
+            hit_ratio=hit_ratio(self.stats["from_cache"],
+                                self.stats["responses"]))
+
+
+def new_stats():
+    """
+    Returns:
+        dict: empty asset cache counts
+    """
+    return {
+        "requests": 0,
+        "hits": 0,
+        "stored": 0,
+        "evicted": 0,
+        "bytes_served": 0,
+    }
+
+
+class AssetCache(object):
+    """An in-memory, least recently used cache of subresource responses,
+    shared by all of the tabs of a process
+
+    Only ``GET`` requests of ``resource_types`` are served from it, and only
+    complete (``200``) responses that may be stored (no ``no-store``,
+    ``private`` or ``Set-Cookie``) are added to it.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_ASSET_CACHE_SIZE,
+                 max_entry_bytes=None, resource_types=CACHEABLE_TYPES):
+        """
+        Kwargs:
+            max_bytes (int): evict least recently used responses when the
+                cached bodies add up to more than this
+            max_entry_bytes (int or None): don't cache larger responses
+                (default: an eighth of ``max_bytes``)
+            resource_types (iterable[str]): request resource types to cache
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = (
+            max_bytes // 8 if max_entry_bytes is None else max_entry_bytes)
+        self.resource_types = tuple(resource_types)
+        self.stats = new_stats()
+        self.bytes = 0
+        self._entries = collections.OrderedDict()
+
+    def __getstate__(self):
+        # each process fills its own cache
+        state = dict(self.__dict__)
+        state["_entries"] = collections.OrderedDict()
+        state["bytes"] = 0
+        return state
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    def cacheable(self, url, resource_type, method="GET"):
+        """
+        Returns:
+            bool: True if a request may be served from the cache
+        """
+        return (method == "GET" and resource_type in self.resource_types
+                and urlsplit(url).scheme in ("http", "https"))
+
+    def lookup(self, url, resource_type, method="GET"):
+        """Look up (and count) a request
+
+        Args:
+            url (str): request url
+            resource_type (str): e.g. ``script``, ``image``
+        Kwargs:
+            method (str): request method
+        Returns:
+            dict or None: the ``pyppeteer.network_manager.Request.respond``
+                response to serve, or None to let the request through
+        """
+        if not self.cacheable(url, resource_type, method):
+            return None
+        self.stats["requests"] += 1
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        self._entries.move_to_end(url)
+        self.stats["hits"] += 1
+        self.stats["bytes_served"] += len(entry["body"])
+        return entry
+
+    def put(self, url, status, headers, body):
+        """Add a response, if it may be stored
+
+        Args:
+            url (str): request url
+            status (int): response status
+            headers (dict): response headers
+            body (bytes): response body
+        Returns:
+            bool: True if it was added
+        """
+        headers = {key.lower(): value for key, value in headers.items()}
+        cache_control = headers.get("cache-control", "").lower()
+        if (status != 200 or "set-cookie" in headers
+                or "no-store" in cache_control or "private" in cache_control
+                or len(body) > self.max_entry_bytes):
+            return False
+        previous = self._entries.pop(url, None)
+        if previous is not None:
+            self.bytes -= len(previous["body"])
+        self._entries[url] = {
+            "status": status,
+            "headers": {key: value for key, value in headers.items()
+                        if key not in _UNSAFE_HEADERS},
+            "body": body,
+        }
+        self.bytes += len(body)
+        self.stats["stored"] += 1
+        self._evict()
+        return True
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            url, entry = self._entries.popitem(last=False)
+            self.bytes -= len(entry["body"])
+            self.stats["evicted"] += 1
+
+    async def _store(self, response):
+        request = response.request
+        if (response.fromCache or request.url in self._entries
+                or not self.cacheable(
+                    request.url, request.resourceType, request.method)):
+            return
+        try:
+            body = await response.buffer()
+        except Exception as e:  # redirects, closed tabs, evicted bodies
+            logging.getLogger().debug(
+                "could not cache %s: %s", request.url, e)
+            return
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.put(request.url, response.status, response.headers, body)
+
+    def watch(self, page):
+        """Add the cacheable responses of a page to the cache"""
+
+        def on_response(response):
+            asyncio.ensure_future(self._store(response))
+
+        page.on("response", on_response)
+
+    def merge(self, stats):
+        """Add the counts of another process's cache
+
+        Args:
+            stats (dict): ``AssetCache.stats``
+        """
+        for key in self.stats:
+            self.stats[key] += stats[key]
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: counts and the hit ratio, for run metadata
+        """
+        return dict(
+            self.stats, max_bytes=self.max_bytes,
+            hit_ratio=hit_ratio(self.stats["hits"], self.stats["requests"]))
+
+
+def open_profile(profile):
+    """
+    Args:
+        profile (BrowserProfile or str or bool or None): a profile, the
+            path to one, True for the default one, or None/False for none
+    Returns:
+        BrowserProfile or None
+    """
+    if profile is None or profile is False or isinstance(
+            profile, BrowserProfile):
+        return profile or None
+    return BrowserProfile(None if profile is True else profile)
+
+
+def open_asset_cache(assets):
+    """
+    Args:
+        assets (AssetCache or int or bool or None): a cache, a size limit in
+            bytes, True for the default size, or None/False/0 for none
+    Returns:
+        AssetCache or None
+    """
+    if isinstance(assets, AssetCache):
+        return assets
+    if not assets:
+        return None
+    if assets is True:
+        return AssetCache()
+    return AssetCache(max_bytes=int(assets))
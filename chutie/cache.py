@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent on-disk cache of screenshots, keyed by url, viewport and a
+fingerprint of the loaded page"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def default_cache_dir():
+    """
+    Returns:
+        str: ``$XDG_CACHE_HOME/chutie`` (default: ``~/.cache/chutie``)
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "chutie")
+
+
+def _tiles(data):
+    """
+    Returns:
+        list[dict]: the tile files of a tiled screenshot (see
+            ``chutie.tiles.write_tiles``)
+    """
+    return list((data.get("tiled") or {}).get("tiles") or [])
+
+
+async def page_fingerprint(page, response=None):
+    """Fingerprint a loaded page for use in a cache key
+
+    Args:
+        page (pyppeteer.page.Page): a page that has been navigated to a url
+    Kwargs:
+        response (pyppeteer.network_manager.Response or None): the response
+            returned by ``page.goto``
+    Returns:
+        str: the response ETag or Last-Modified header if there is one,
+            else a hash of the serialized DOM
+    """
+    headers = {}
+    if response is not None:
+        headers = {
+            key.lower(): value for key, value in response.headers.items()}
+    for header in ("etag", "last-modified"):
+        if headers.get(header):
+            return f"{header}:{headers[header]}"
+    content = await page.content()
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return f"dom:{digest}"
+
+
+class CaptureCache(object):
+    """A directory of cached screenshots and their metadata
+
+    Each entry is a directory named by its key containing a ``meta.json``
+    (the list of metadata dicts for the screenshots of one url x viewport)
+    and a copy of each screenshot. The mtime of ``meta.json`` is the last
+    time the entry was used.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        """
+        Kwargs:
+            path (str or None): cache directory
+                (default: ``default_cache_dir()``)
+            max_bytes (int or None): evict least recently used entries
+                when the cache is larger than this
+            max_age (float or None): evict entries not used for this many
+                seconds
+        """
+        self.path = Path(path or default_cache_dir())
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(self, url, viewport, fingerprint, options=None):
+        """
+        Args:
+            url (str): page url
+            viewport (dict): viewport dict
+            fingerprint (str): as returned by ``page_fingerprint``
+        Kwargs:
+            options (dict or None): capture options that change the output
+        Returns:
+            str: hex digest cache key
+        """
+        keydata = json.dumps(
+            [url, viewport, fingerprint, options or {}],
+            sort_keys=True, default=str)
+        return hashlib.sha256(keydata.encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return self.path / key[:2] / key
+
+    def restore(self, key, dest):
+        """Copy a cached entry's screenshots into ``dest``
+
+        Args:
+            key (str): cache key
+            dest (Path): directory to copy screenshots into
+        Returns:
+            list[dict] or None: the cached metadata dicts (with ``path``
+                pointing into ``dest`` and ``cached`` set), or None on a
+                cache miss
+        """
+        entry = self._entry(key)
+        metapath = entry / "meta.json"
+        try:
+            with open(metapath) as _file:
+                datas = json.load(_file)
+            for data in datas:
+                for item in [data] + _tiles(data):
+                    destpath = Path(dest) / item["filename"]
+                    if destpath.exists():
+                        # don't write through a hardlink to a duplicate
+                        destpath.unlink()
+                    shutil.copyfile(
+                        str(entry / item["filename"]), str(destpath))
+                    item["path"] = str(destpath)
+                data["cached"] = True
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(str(metapath))
+        return datas
+
+    def store(self, key, datas):
+        """Add screenshots to the cache
+
+        Args:
+            key (str): cache key
+            datas (list[dict]): metadata dicts whose ``path`` screenshots
+                should be cached
+        """
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmpdir = Path(tempfile.mkdtemp(dir=str(entry.parent), prefix=".tmp"))
+        try:
+            for data in datas:
+                for item in [data] + _tiles(data):
+                    shutil.copyfile(
+                        item["path"], str(tmpdir / item["filename"]))
+            with open(tmpdir / "meta.json", "w") as _file:
+                json.dump(datas, _file)
+            if entry.exists():
+                shutil.rmtree(str(entry), ignore_errors=True)
+            os.replace(str(tmpdir), str(entry))
+        except OSError:
+            logging.getLogger().warning(
+                "could not store cache entry %s", key, exc_info=True)
+            shutil.rmtree(str(tmpdir), ignore_errors=True)
+
+    def _entries(self):
+        if not self.path.exists():
+            return
+        for prefix in self.path.iterdir():
+            if not prefix.is_dir():
+                continue
+            for entry in prefix.iterdir():
+                if entry.name.startswith(".tmp"):
+                    continue
+                try:
+                    mtime = (entry / "meta.json").stat().st_mtime
+                    size = sum(
+                        _path.stat().st_size for _path in entry.iterdir())
+                except OSError:
+                    continue
+                yield entry, mtime, size
+
+    def evict(self, now=None):
+        """Remove entries older than ``max_age`` and then the least
+        recently used entries until the cache is under ``max_bytes``
+
+        Kwargs:
+            now (float or None): current time (default: ``time.time()``)
+        Returns:
+            int: number of entries removed
+        """
+        now = time.time() if now is None else now
+        entries = sorted(self._entries(), key=lambda item: item[1])
+        total = sum(size for entry, mtime, size in entries)
+        removed = 0
+        for entry, mtime, size in entries:
+            expired = (self.max_age is not None
+                       and now - mtime > self.max_age)
+            oversize = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or oversize):
+                continue
+            shutil.rmtree(str(entry), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
@@ -2,14 +2,36 @@
 
 """Main module."""
 
+import asyncio
+import collections
 import datetime
+import functools
+import io
 import logging
 import os
+import time
 from pathlib import Path
 
-from pyppeteer import launch
+from pyppeteer import connect, launch
+from pyppeteer.errors import PyppeteerError
 
+from chutie import assets as capture_assets
+from chutie import cache as capture_cache
+from chutie import encode as capture_encode
+from chutie import intercept as capture_intercept
+from chutie import journal as capture_journal
+from chutie import metrics as capture_metrics
 from chutie import monkeypatches
+from chutie import readiness as capture_readiness
+from chutie import recovery as capture_recovery
+from chutie import scheduler as capture_scheduler
+from chutie import store as capture_store
+from chutie import tiles as capture_tiles
+from chutie.options import build_viewports as _build_viewports
+from chutie.options import clean_screenshot_options as _screenshot_options
+from chutie.options import viewportstr_to_dict  # noqa: F401 (re-exported)
+from chutie.render import (  # noqa: F401 (re-exported)
+    paginate, render_paginated, render_template)
 
 
 async def _get_browser():
@@ -27,133 +49,1121 @@ def url_to_filename(url):
     return path
 
 
-def viewportstr_to_dict(viewportstr):
+def _iter_jobs(urls, viewports, reload_per_viewport=False):
     """
     Args:
-        viewportstr (str): viewport string (e.g. ``1024x768 mobile landscape``)
+        urls (iterable[str]): urls to take screenshots of
+        viewports (dict): ``{pathstr: viewport dict}`` as built by
+            ``get_screenshots``
+    Kwargs:
+        reload_per_viewport (bool): if True, yield one job (and so one
+            page load) per url x viewport instead of one job per url
+    Yields:
+        tuple: ``(url, [pathstr, ...])`` capture jobs, in url x viewport order
+    """
+    for url in urls:
+        if reload_per_viewport:
+            for respathstr in viewports:
+                yield (url, [respathstr])
+        else:
+            yield (url, list(viewports))
+
+
+async def _run_pool(jobs, worker, concurrency=1):
+    """Run ``worker(job)`` for each job with at most ``concurrency``
+    workers in flight at once
+
+    Args:
+        jobs (iterable or async iterable): jobs to run (consumed lazily)
+        worker (coroutine function): ``await worker(job)`` returns a result
+    Kwargs:
+        concurrency (int): maximum number of concurrent workers (default: 1)
     Returns:
-        dict: dict suitable for use with pyppeteer page.emulate options=
+        list: ``worker`` results, in the same order as ``jobs``
     """
-    _viewportstr = viewportstr.lower()
-    terms = _viewportstr.split(" ")
-    width, height = map(int, terms[0].split("x", 1))
-    isMobile = True if "mobile" in terms else False
-    isLandscape = True if "landscape" in terms else False
-    return dict(
-        width=width,
-        height=height,
-        isMobile=isMobile,
-        isLandscape=isLandscape,
-        pathstr=_viewportstr.replace(" ", "-"),
-    )
+    concurrency = max(1, int(concurrency))
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    results = {}
+
+    async def producer():
+        if hasattr(jobs, "__aiter__"):
+            index = 0
+            async for job in jobs:
+                await queue.put((index, job))
+                index += 1
+        else:
+            for item in enumerate(jobs):
+                await queue.put(item)
+        for _ in range(concurrency):
+            await queue.put(None)
 
+    async def consumer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, job = item
+            results[index] = await worker(job)
 
-async def get_screenshots(urls, viewports, dest_path="."):
+    tasks = [asyncio.ensure_future(producer())]
+    tasks.extend(
+        asyncio.ensure_future(consumer()) for _ in range(concurrency))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [results[index] for index in sorted(results)]
+
+
+# Wait for two animation frames so that layout and paint have caught up
+# with a viewport change before taking a screenshot
+_SETTLE_LAYOUT_JS = """() => new Promise(resolve =>
+    requestAnimationFrame(() => requestAnimationFrame(resolve)))"""
+
+
+def _failed_data(url, page_options, error):
     """
-    Args:
-        urls (list[str]): list of urls to retrieve and take screenshots of
-        viewports (list[str]): list of width x height viewports to take screenshots in
+    Returns:
+        dict: metadata for a viewport of a url that could not be loaded
+    """
+    data = {
+        "url": url,
+        "date": datetime.datetime.now().isoformat(),
+        "failed": True,
+        "error": str(error) or type(error).__name__,
+    }
+    data.update(page_options)
+    return data
+
+
+async def _screenshot_viewport(page, dest, url, respathstr, page_options,
+                               single_capture=False, metrics=None,
+                               timings=None, store=None,
+                               **screenshot_options):
+    """Take the viewport and full page screenshots of a loaded page
+
+    The browser only takes the screenshots; cropping, encoding and writing
+    them to disk happen in the event loop's default executor.
+
     Kwargs:
-        dest_path (str): path to store screenshots and metadata in (default: '.')
+        single_capture (bool): if True, take only the full page screenshot
+            and crop the viewport screenshot from it
+        metrics (chutie.metrics.Recorder or None): time the screenshot and
+            write stages
+        timings (dict or None): stage timings so far (e.g. ``navigate``) to
+            include in each screenshot's ``timings``
+        store (chutie.store.ScreenshotStore or None): add the screenshots
+            to this store instead of writing files into ``dest``
+        screenshot_options: ``image_format``, ``quality``, ``clip``,
+            ``element``, ``optimize``, ``tiles`` and ``max_height``, which
+            ``page_options["screenshot"]`` overrides (see
+            ``chutie.encode.screenshot_options``). ``clip`` or ``element``
+            replace the viewport screenshot with that region; ``tiles``
+            takes the full page screenshot one viewport at a time.
     Returns:
-        dict: result object TODO
+        list[dict]: one metadata dict per screenshot
     """
-    logging.basicConfig()  # TODO
     log = logging.getLogger()
-    log.setLevel(logging.DEBUG)
+    loop = asyncio.get_event_loop()
+    metrics = metrics or capture_metrics.NULL_RECORDER
+    options = capture_encode.screenshot_options(
+        screenshot_options, page_options)
+    image_format = options["image_format"]
+    region = options["clip"] or options["element"]
+    tiles = options["tiles"]
+    if tiles and store is not None:
+        # a store holds one image per screenshot
+        tiles = "stitch"
+    single_capture = single_capture and not region and not tiles
+    path_filename_prefix = url_to_filename(url)
+    fullpage_image = None
+    shared_timings = dict(timings or {}) if metrics.enabled else None
+    if single_capture:
+        with metrics.stage("screenshot", shared_timings, url=url):
+            fullpage_image = await page.screenshot({
+                "fullPage": True,
+                "type": capture_encode.browser_type(image_format, crop=True),
+            })
+    datas = []
+    for fullPage in (False, True):
+        fullpagestr = "__full" if fullPage else ""
+        extension = capture_encode.EXTENSIONS[image_format]
+        if fullPage and tiles == "stitch":
+            extension = ".png"
+        if store is not None:
+            path_filename = capture_store.shot_name(
+                url, respathstr, fullPage, extension)
+        else:
+            path_filename = (
+                f"{path_filename_prefix}__{respathstr}{fullpagestr}"
+                f"{extension}")
+        data = {
+            "url": url,
+            "date": datetime.datetime.now().isoformat(),
+            "filename": path_filename,
+        }
+        if store is not None:
+            screenshot_options = {"store": store.path, "fullPage": fullPage}
+            write = functools.partial(
+                store.write_screenshot, name=path_filename,
+                url=url, pathstr=respathstr, fullPage=fullPage)
+        else:
+            screenshot_options = {
+                "path": str(dest / path_filename),
+                "fullPage": fullPage,
+            }
+            write = functools.partial(
+                capture_encode.write_screenshot,
+                path=screenshot_options["path"])
+        data_timings = None
+        if shared_timings is not None:
+            data_timings = dict(shared_timings)
+        crop_height = None
+        if fullPage and tiles:
+            with metrics.stage("screenshot", data_timings, url=url):
+                data["tiled"] = await _take_tiles(
+                    page, tiles, options, screenshot_options.get("path"),
+                    write=write if store is not None else None)
+            if tiles == "files":
+                first = data["tiled"]["tiles"][0]
+                data["filename"] = first["filename"]
+                screenshot_options["path"] = first["path"]
+        elif fullpage_image is None:
+            with metrics.stage("screenshot", data_timings, url=url):
+                image = await _take_screenshot(
+                    page, fullPage, options, crop=False)
+        else:
+            image = fullpage_image
+            if not fullPage:
+                scale = page_options.get("deviceScaleFactor") or 1
+                crop_height = int(page_options["height"] * scale)
+        if not (fullPage and tiles):
+            with metrics.stage("write", data_timings, url=url):
+                await loop.run_in_executor(None, functools.partial(
+                    write, data=image, image_format=image_format,
+                    quality=options["quality"], optimize=options["optimize"],
+                    crop_height=crop_height))
+        data.update(screenshot_options)
+        if region and not fullPage:
+            data["region"] = region
+        data.update(page_options)
+        page_data = dict(
+            url=page.url,
+            title=await page.title(),
+            viewport=page.viewport,
+        )
+        data["page"] = page_data
+        if data_timings is not None:
+            data["timings"] = data_timings
+        datas.append(data)
+        log.debug((url, data))
+    return datas
 
-    browser = await launch()  # _get_browser()
 
-    _viewports = {}
-    for viewport in viewports:
-        resdict = viewportstr_to_dict(viewport)
-        _viewports[resdict["pathstr"]] = resdict
+async def _take_tiles(page, mode, options, path=None, write=None):
+    """Take a tiled full page screenshot (see ``chutie.tiles``)
+
+    Args:
+        page (pyppeteer.page.Page): a loaded page
+        mode (str): ``files`` or ``stitch``
+        options (dict): as returned by ``chutie.encode.screenshot_options``
+    Kwargs:
+        path (str or None): path of the full page screenshot
+        write (callable or None): add the stitched PNG with this (e.g.
+            ``chutie.store.ScreenshotStore.write_screenshot``) instead of
+            writing it to ``path``
+    Returns:
+        dict: the tile manifest
+    """
+    viewport_options = dict(options, clip=None, element=None)
+    screenshot = functools.partial(
+        _take_screenshot, page, False, viewport_options,
+        crop=mode == "stitch")
+    if mode == "files":
+        return await capture_tiles.write_tiles(
+            page, screenshot, path, max_height=options["max_height"],
+            image_format=options["image_format"],
+            quality=options["quality"], optimize=options["optimize"])
+    level = 9 if options["optimize"] else 6
+    if write is not None:
+        # the compressed PNG, not its pixels
+        buffer = io.BytesIO()
+        manifest = await capture_tiles.stitch_tiles(
+            page, screenshot, buffer, max_height=options["max_height"],
+            level=level)
+        await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(write, data=buffer.getvalue()))
+        return manifest
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as _file:
+        return await capture_tiles.stitch_tiles(
+            page, screenshot, _file, max_height=options["max_height"],
+            level=level)
+
+
+async def _take_screenshot(page, fullPage, options, crop=False):
+    """
+    Args:
+        page (pyppeteer.page.Page): a loaded page
+        fullPage (bool): take a full page screenshot
+        options (dict): as returned by ``chutie.encode.screenshot_options``
+    Returns:
+        bytes: a PNG or JPEG screenshot of the page, or (if not
+            ``fullPage``) of the ``clip`` region or ``element``
+    """
+    browser_options = {
+        "fullPage": fullPage,
+        "type": capture_encode.browser_type(options["image_format"], crop),
+    }
+    if browser_options["type"] == "jpeg":
+        browser_options["quality"] = (
+            options["quality"] or capture_encode.DEFAULT_QUALITY["jpeg"])
+    if not fullPage and options["element"]:
+        handle = await page.querySelector(options["element"])
+        if handle is not None:
+            return await handle.screenshot(browser_options)
+        logging.getLogger().warning(
+            "no element matches %r on %s; taking a viewport screenshot",
+            options["element"], page.url)
+    elif not fullPage and options["clip"]:
+        browser_options["clip"] = options["clip"]
+    return await page.screenshot(browser_options)
 
-    metadata = {
+
+async def _capture_job(browser, dest, viewports, job, cache=None,
+                       refresh_cache=False, journal=None, intercept=None,
+                       readiness=None, url_readiness=None, deadline=None,
+                       metrics=None, assets=None, profile=None,
+                       scheduler=None, journal_failures=True,
+                       **capture_options):
+    """Take the screenshots for one capture job in a single tab:
+    load the url once, then resize the tab to each viewport in turn
+
+    Args:
+        browser (pyppeteer.browser.Browser): browser to open a tab in
+        dest (Path): directory to write screenshots into
+        viewports (dict): ``{pathstr: viewport dict}``
+        job (tuple): ``(url, [pathstr, ...])`` as yielded by ``_iter_jobs``
+    Kwargs:
+        cache (chutie.cache.CaptureCache or None): reuse screenshots of
+            unchanged pages from this cache
+        refresh_cache (bool): if True, take new screenshots even when they
+            are cached (and update the cache)
+        journal (chutie.journal.Journal or None): append each viewport's
+            screenshot metadata to this journal as soon as it is taken
+        intercept (chutie.intercept.Interceptor or None): block the
+            tab's requests that its profiles block
+        readiness (dict or None): readiness strategy, as returned by
+            ``chutie.readiness.make_strategy``
+        url_readiness (dict or None): ``{url: strategy}`` overrides
+        deadline (float or None): ``time.time()`` by which the run must be
+            done
+        metrics (chutie.metrics.Recorder or None): time each stage and add
+            ``timings`` to each screenshot's metadata
+        assets (chutie.assets.AssetCache or None): serve the tab's
+            cacheable subresources from this cache (and fill it)
+        profile (chutie.assets.BrowserProfile or None): count the tab's
+            responses served by the browser cache
+        scheduler (chutie.scheduler.HostScheduler or None): back off the
+            url's host (and fail the job) if it throttles the page load
+        journal_failures (bool): if False, don't write the ``failed``
+            dicts of a url that does not load to ``journal`` (the caller
+            writes the final outcome of a retried job)
+        capture_options: passed through to ``_screenshot_viewport``
+    Returns:
+        list[dict]: one metadata dict per screenshot, in ``job`` order; if
+            the url does not load in time, one ``failed`` dict per viewport
+    """
+    url, respathstrs = job
+    # switching between mobile and desktop emulation reloads the page,
+    # so take all of the screenshots of one kind before the other
+    order = sorted(
+        range(len(respathstrs)),
+        key=lambda i: bool(viewports[respathstrs[i]].get("isMobile")))
+    strategy = (url_readiness or {}).get(url) or readiness
+    if strategy is None:
+        strategy = capture_readiness.make_strategy()
+    metrics = metrics or capture_metrics.NULL_RECORDER
+    job_timings = {} if metrics.enabled else None
+    results = {}
+    key_options = dict(capture_options)
+    if intercept is not None and intercept.profiles:
+        key_options["intercept"] = intercept.profiles
+    if strategy != capture_readiness.DEFAULT_STRATEGY:
+        key_options["readiness"] = strategy
+    page = await browser.newPage()
+    try:
+        await capture_intercept.attach(
+            page, url, intercept=intercept, assets=assets)
+        if profile is not None:
+            profile.watch(page)
+        await page.setViewport(viewport=viewports[respathstrs[order[0]]])
+        try:
+            with metrics.stage("navigate", job_timings, url=url):
+                response = await capture_readiness.wait_ready(
+                    page, url, strategy, deadline=deadline)
+            if scheduler is not None:
+                scheduler.observe(url, response)
+        except (PyppeteerError, asyncio.TimeoutError,
+                capture_scheduler.Throttled) as e:
+            logging.getLogger().warning("could not load %s: %s", url, e)
+            failed = [_failed_data(url, viewports[respathstr], e)
+                      for respathstr in respathstrs]
+            if journal is not None and journal_failures:
+                journal.write(failed)
+            return failed
+        fingerprint = None
+        if cache is not None:
+            fingerprint = await capture_cache.page_fingerprint(page, response)
+        for n, i in enumerate(order):
+            respathstr = respathstrs[i]
+            page_options = viewports[respathstr]
+            cache_key = datas = None
+            timings = None if job_timings is None else dict(job_timings)
+            if cache is not None:
+                cache_key = cache.key(
+                    url, page_options, fingerprint, key_options)
+                if not refresh_cache:
+                    with metrics.stage("cache", timings, url=url):
+                        datas = cache.restore(cache_key, dest)
+            if datas is None:
+                if n > 0:
+                    with metrics.stage("resize", timings, url=url):
+                        await page.setViewport(viewport=page_options)
+                        await page.evaluate(_SETTLE_LAYOUT_JS)
+                datas = await _screenshot_viewport(
+                    page, dest, url, respathstr, page_options,
+                    metrics=metrics, timings=timings, **capture_options)
+                if cache_key is not None:
+                    cache.store(cache_key, datas)
+            if journal is not None:
+                journal.write(datas)
+            results[i] = datas
+    finally:
+        await page.close()
+    return [data for i in sorted(results) for data in results[i]]
+
+
+async def _capture_with_retry(browser, dest, viewports, job, retry=None,
+                              **capture_options):
+    """Take the screenshots for one capture job, retrying it with backoff
+    if it fails (and relaunching a crashed ``SupervisedBrowser``)
+
+    Args:
+        browser (chutie.recovery.SupervisedBrowser or
+            pyppeteer.browser.Browser): browser to open tabs in
+        dest (Path): directory to write screenshots into
+        viewports (dict): ``{pathstr: viewport dict}``
+        job (tuple): ``(url, [pathstr, ...])``
+    Kwargs:
+        retry (chutie.recovery.RetryPolicy or None): how often to retry
+            (default: None, take the screenshots once, as ``_capture_job``)
+        capture_options: passed through to ``_capture_job``
+    Returns:
+        list[dict]: as returned by ``_capture_job``; the dicts of a job
+            that was retried get a ``retries`` count
+    """
+    if retry is None:
+        return await _capture_job(
+            browser, dest, viewports, job, **capture_options)
+    log = logging.getLogger()
+    url, respathstrs = job
+    capture = functools.partial(
+        _capture_job, dest=dest, viewports=viewports, job=job,
+        journal_failures=False, **capture_options)
+    attempt = 0
+    while True:
+        generation = getattr(browser, "generation", 0)
+        try:
+            datas = await capture_recovery.run_attempt(
+                browser, capture, timeout=retry.timeout)
+        except Exception as e:
+            log.warning("could not capture %s: %s", url, e,
+                        exc_info=not capture_recovery.is_crash(e))
+            datas = [_failed_data(url, viewports[respathstr], e)
+                     for respathstr in respathstrs]
+            if isinstance(browser, capture_recovery.SupervisedBrowser):
+                await browser.recover(e, generation)
+        if not any(data.get("failed") for data in datas):
+            break
+        delay = retry.allow(attempt, deadline=capture_options.get("deadline"))
+        if delay is None:
+            retry.stats["failed"] += 1
+            break
+        log.info("retrying %s in %.1fs", url, delay)
+        await asyncio.sleep(delay)
+        scheduler = capture_options.get("scheduler")
+        if scheduler is not None:
+            # a throttled host may have asked for a longer wait
+            await scheduler.wait(url)
+        attempt += 1
+    if attempt:
+        for data in datas:
+            data["retries"] = attempt
+    journal = capture_options.get("journal")
+    if journal is not None and any(data.get("failed") for data in datas):
+        # only the final outcome, not one failure per attempt
+        journal.write(datas)
+    return datas
+
+
+def _new_metadata(urls, _viewports):
+    return {
         "date": datetime.datetime.now().isoformat(),
         "urls": urls,
         "viewports": _viewports,
         "pages": {},
     }
+
+
+def _add_results(metadata, results):
+    """Add ``(url, [data, ...])`` job results to ``metadata["pages"]``"""
     pages = metadata["pages"]
-    log.debug(metadata)
+    for url, datas in results:
+        pages.setdefault(url, []).extend(datas)
+    return metadata
+
 
+def _deadline_at(deadline):
+    """
+    Args:
+        deadline (float or None): seconds from now
+    Returns:
+        float or None: ``time.time()`` of the deadline
+    """
+    return None if deadline is None else time.time() + deadline
+
+
+def _open_store(store, cache=None, metadata=None):
+    """
+    Args:
+        store (chutie.store.ScreenshotStore or str or None): a store or the
+            path to one
+    Kwargs:
+        cache: the run's capture cache, which needs screenshot files
+        metadata (dict or None): add the store's path to this
+    Returns:
+        chutie.store.ScreenshotStore or None
+    Raises:
+        ValueError: if both a store and a cache are given
+    """
+    if store is None:
+        return None
+    if cache is not None:
+        raise ValueError(
+            "the capture cache needs screenshot files: use either a"
+            " screenshot store or a cache")
+    if not isinstance(store, capture_store.ScreenshotStore):
+        store = capture_store.ScreenshotStore(store)
+    if metadata is not None:
+        metadata["store"] = store.path
+    return store
+
+
+def _open_cache(cache):
+    if cache is None or isinstance(cache, capture_cache.CaptureCache):
+        return cache
+    return capture_cache.CaptureCache(cache)
+
+
+def _finish_cache(metadata, cache):
+    """Evict old cache entries and add cache hit counts to ``metadata``"""
+    if cache is None:
+        return metadata
+    cache.evict()
+    datas = [data for datas in metadata["pages"].values() for data in datas]
+    hits = sum(1 for data in datas if data.get("cached"))
+    metadata["cache"] = {
+        "path": str(cache.path),
+        "hits": hits,
+        "misses": len(datas) - hits,
+    }
+    return metadata
+
+
+def _open_intercept(intercept):
+    """
+    Args:
+        intercept (chutie.intercept.Interceptor or list[str] or None):
+            an interceptor or a list of interception profile names
+    Returns:
+        chutie.intercept.Interceptor or None
+    """
+    if intercept is None or isinstance(
+            intercept, capture_intercept.Interceptor):
+        return intercept
+    if not intercept:
+        return None
+    return capture_intercept.Interceptor(intercept)
+
+
+def _finish_intercept(metadata, intercept):
+    """Add blocked request counts to ``metadata``"""
+    if intercept is not None:
+        metadata["intercept"] = intercept.to_dict()
+    return metadata
+
+
+def _finish_metrics(metadata, metrics):
+    """Add a summary of stage timings to ``metadata``"""
+    if metrics.enabled:
+        metadata["metrics"] = {"stages": metrics.summary()}
+    return metadata
+
+
+def _finish_assets(metadata, assets, profile):
+    """Add asset and browser cache hit ratios to ``metadata``, and trim
+    the profile's disk caches"""
+    if assets is not None:
+        metadata["asset_cache"] = assets.to_dict()
+    if profile is not None:
+        profile.evict()
+        metadata["browser_cache"] = profile.to_dict()
+    return metadata
+
+
+def _finish_scheduler(metadata, scheduler):
+    if scheduler is not None:
+        metadata["scheduler"] = scheduler.to_dict()
+    return metadata
+
+
+def _finish_recovery(metadata, retry):
+    """Add retry and restart counts to ``metadata``"""
+    if retry is not None:
+        metadata["recovery"] = dict(retry.stats)
+    return metadata
+
+
+def _open_journal(journal, metadata, resume=False):
+    """Open a journal, read the screenshots already in it if resuming
+    (else empty it), and append this run's header
+
+    Returns:
+        tuple: ``(journal, done)`` (``(None, None)`` if ``journal`` is None)
+    """
+    if journal is None:
+        return None, None
+    if not isinstance(journal, capture_journal.Journal):
+        journal = capture_journal.Journal(journal)
+    done = None
+    if resume:
+        done = journal.completed()
+    else:
+        journal.truncate()
+    journal.write_header(metadata)
+    metadata["journal"] = journal.path
+    return journal, done
+
+
+def _ensure_dest(dest_path):
     dest = Path(dest_path)  # .resolve()
     if not dest.exists():
-        dest.mkdir(parents=True)
+        dest.mkdir(parents=True, exist_ok=True)
+    return dest
+
+
+def _split_resumed(job, done):
+    """
+    Args:
+        job (tuple): ``(url, [pathstr, ...])`` capture job
+        done (dict): ``{(url, pathstr, fullPage): data}`` as returned by
+            ``chutie.journal.Journal.completed``
+    Returns:
+        tuple: ``(todo, previous)``: the pathstrs that still need to be
+            captured, and ``{pathstr: [data, ...]}`` for those that are done
+    """
+    url, respathstrs = job
+    todo, previous = [], {}
+    for respathstr in respathstrs:
+        keys = [(url, respathstr, fullPage) for fullPage in (False, True)]
+        if all(key in done for key in keys):
+            previous[respathstr] = [done[key] for key in keys]
+        else:
+            todo.append(respathstr)
+    return todo, previous
+
+
+async def _capture_jobs(jobs, _viewports, dest, concurrency=1, done=None,
+                        browser=None, browser_endpoint=None, on_result=None,
+                        prewarm=None, **capture_options):
+    """Launch (or connect to) a browser and run capture jobs in it
+
+    Args:
+        jobs (iterable[tuple] or async iterable[tuple]):
+            ``(url, [pathstr, ...])`` capture jobs
+        _viewports (dict): ``{pathstr: viewport dict}``
+        dest (Path): directory to write screenshots into
+    Kwargs:
+        concurrency (int): number of tabs to take screenshots in at once
+        done (dict or None): ``{(url, pathstr, fullPage): data}`` of
+            screenshots that are already done (when resuming a run); a
+            viewport is skipped when both of its screenshots are done
+        browser (pyppeteer.browser.Browser or None): a running browser to
+            open tabs in (it is left running)
+        browser_endpoint (str or None): the ``ws://`` DevTools endpoint of
+            a running browser to connect to (and disconnect from when done)
+        on_result (callable or None): called with ``(url, [data, ...])`` as
+            each job is done, instead of returning the results (so that a
+            long run does not keep them in memory)
+        prewarm (list[str] or None): urls to load once (without taking
+            screenshots) before the jobs, to fill the browser and asset
+            caches
+        capture_options: passed through to ``_capture_with_retry``; with a
+            ``retry`` policy, a browser that is launched (or connected to)
+            here is relaunched (or reconnected to) if it crashes; a browser
+            launched here with a ``profile`` uses one of its slots
+    Returns:
+        list[tuple]: ``(url, [data, ...])`` results, in job order (None
+            for each job if ``on_result`` is set)
+    """
+    if browser is not None:
+        return await _run_capture_jobs(
+            browser, jobs, _viewports, dest, concurrency, done,
+            capture_options, on_result, prewarm)
+    metrics = capture_options.get("metrics") or capture_metrics.NULL_RECORDER
+    retry = capture_options.get("retry")
+    profile = capture_options.get("profile")
+    slot = None
+    if browser_endpoint:
+        launcher = functools.partial(
+            connect, browserWSEndpoint=browser_endpoint)
+
+        async def closer(browser):
+            await browser.disconnect()
+    else:
+        launcher = launch  # _get_browser()
+        if profile is not None:
+            slot = profile.acquire()
+            launcher = functools.partial(
+                launch, **profile.launch_options(slot))
+
+        async def closer(browser):
+            await browser.close()
+    try:
+        with metrics.stage("launch"):
+            if retry is not None:
+                browser = await capture_recovery.SupervisedBrowser(
+                    launcher, closer, stats=retry.stats).start()
+            else:
+                browser = await launcher()
+        try:
+            return await _run_capture_jobs(
+                browser, jobs, _viewports, dest, concurrency, done,
+                capture_options, on_result, prewarm)
+        finally:
+            if retry is not None:
+                await browser.close()
+            else:
+                await closer(browser)
+    finally:
+        if slot is not None:
+            profile.release(slot)
+
+
+async def _prewarm(browser, urls, _viewports, capture_options):
+    """Load urls once, one after the other, to fill the caches that the
+    capture jobs then read from (failures are logged and ignored)"""
+    log = logging.getLogger()
+    viewport = next(iter(_viewports.values()), None)
+    strategy = (capture_options.get("readiness")
+                or capture_readiness.make_strategy())
     for url in urls:
-        path_filename_prefix = url_to_filename(url)
-        for respathstr, resdict in _viewports.items():
-            page_options = resdict
-            page = await browser.newPage()
-            await page.setViewport(
-                viewport=page_options
-            )  # TODO: is newPage necessary for each viewport?
-            await page.goto(url)
-            for fullPage in (False, True):
-                fullpagestr = "__full" if fullPage else ""
-                path_filename = (
-                    f"{path_filename_prefix}__{respathstr}{fullpagestr}.png"
-                )
-                data = {
-                    "url": url,
-                    "date": datetime.datetime.now().isoformat(),
-                    "filename": path_filename,
-                }
-                screenshot_options = {
-                    "path": str(dest / path_filename),
-                    "fullPage": fullPage,
-                }
-                await page.screenshot(screenshot_options)
-                data.update(screenshot_options)
-                data.update(page_options)
-                page_data = dict(
-                    url=page.url,
-                    title=await page.title(),
-                    viewport=page.viewport,
-                )
-                data["page"] = page_data
-                pages.setdefault(url, []).append(data)
-                log.debug((url, data))
-                #print((url, data))
-    return metadata
+        page = await browser.newPage()
+        try:
+            await capture_intercept.attach(
+                page, url, intercept=capture_options.get("intercept"),
+                assets=capture_options.get("assets"))
+            if viewport is not None:
+                await page.setViewport(viewport=viewport)
+            await capture_readiness.wait_ready(
+                page, url, strategy, deadline=capture_options.get("deadline"))
+        except Exception as e:
+            log.warning("could not prewarm %s: %s", url, e)
+        finally:
+            await page.close()
+
+
+async def _run_capture_jobs(browser, jobs, _viewports, dest, concurrency,
+                            done, capture_options, on_result=None,
+                            prewarm=None):
+    """Run capture jobs in a browser (see ``_capture_jobs``)"""
+    if prewarm:
+        metrics = (capture_options.get("metrics")
+                   or capture_metrics.NULL_RECORDER)
+        with metrics.stage("prewarm"):
+            await _prewarm(browser, prewarm, _viewports, capture_options)
 
+    async def capture(job):
+        url, respathstrs = job
+        if not done:
+            return url, await _capture_with_retry(
+                browser, dest, _viewports, job, **capture_options)
+        todo, previous = _split_resumed(job, done)
+        datas = []
+        if todo:
+            datas = await _capture_with_retry(
+                browser, dest, _viewports, (url, todo), **capture_options)
+        for data in datas:
+            previous.setdefault(data["pathstr"], []).append(data)
+        return url, [
+            data for respathstr in respathstrs
+            for data in previous.get(respathstr, [])]
 
-def render_template(
-    context,
-    template_dir=None,
-    template_name=None,
-    default_template="screenshots.j2",
-    write_to_path=None,
-):
-    """Generate output from a context and a jinja2 template (e.g. HTML)
+    async def worker(job):
+        result = await capture(job)
+        if on_result is None:
+            return result
+        on_result(*result)
+
+    scheduler = capture_options.get("scheduler")
+    if scheduler is not None:
+        return await scheduler.run(jobs, worker, concurrency=concurrency)
+    return await _run_pool(jobs, worker, concurrency=concurrency)
+
+
+async def get_screenshots(urls, viewports, dest_path=".", concurrency=1,
+                          reload_per_viewport=False, single_capture=False,
+                          cache=None, refresh_cache=False, journal=None,
+                          resume=False, intercept=None, readiness=None,
+                          deadline=None, metrics=None, browser=None,
+                          browser_endpoint=None, image_format=None,
+                          quality=None, clip=None, element=None,
+                          optimize=False, tiles=None, max_height=None,
+                          retry=None, store=None,
+                          profile=None, assets=None, prewarm=None,
+                          scheduler=None):
+    """
     Args:
-        context (dict): context dict as generated by `get_screenshots()`
+        urls (list[str or dict] or iterable): list of urls to retrieve and
+            take screenshots of; a url may be a dict with a ``url`` key and
+            readiness strategy overrides for that url. Any other iterable
+            (e.g. ``chutie.sources.iter_urls``) is consumed lazily and
+            ``metadata["urls"]`` is then filled in from the results.
+        viewports (list[str]): list of width x height viewports to take
+            screenshots in
     Kwargs:
-        template_dir (str): path to a directory of templates
-        template_name (str or None): name of a template in template_dir,
-            or a path to a template
-        default_template (str): default template in chutie/ source directory
-        write_to_path (str or None): if specified, write the template to
-            the given path
+        dest_path (str): path to store screenshots and metadata in
+            (default: '.')
+        concurrency (int): number of tabs to take screenshots in at once
+            (default: 1). ``metadata["pages"]`` is in the same order
+            regardless of concurrency.
+        reload_per_viewport (bool): if True, load each url in a new tab for
+            each viewport instead of loading it once and resizing the tab
+            (for sites whose CSS breaks on resize) (default: False)
+        single_capture (bool): if True, take one full page screenshot per
+            viewport and crop the viewport screenshot from it instead of
+            taking two screenshots (default: False)
+        cache (chutie.cache.CaptureCache or str or None): a capture cache
+            (or a path to one) to reuse screenshots of unchanged pages from
+            (default: None, no cache)
+        refresh_cache (bool): if True, take new screenshots even when they
+            are cached (default: False)
+        journal (chutie.journal.Journal or str or None): a JSON Lines file
+            to append each screenshot's metadata to as soon as it is taken
+            (default: None)
+        resume (bool): if True, skip the screenshots that are already in
+            ``journal`` and include them in the result (default: False)
+        intercept (list[str] or chutie.intercept.Interceptor or None):
+            names of request interception profiles (see
+            ``chutie.intercept.PROFILES``) to block requests with; blocked
+            request counts are added to ``metadata["intercept"]``
+            (default: None, block nothing)
+        readiness (dict or None): readiness strategy options (see
+            ``chutie.readiness.DEFAULT_STRATEGY``): what to wait for after
+            navigating, and for how long. A url that is not ready in time is
+            recorded as ``failed`` entries instead of screenshots.
+        deadline (float or None): number of seconds the whole run may take;
+            urls still loading (or not yet started) then fail
+            (default: None, no deadline)
+        metrics (chutie.metrics.Recorder or bool or callable or None): if
+            set, time each stage of each capture: each screenshot gets a
+            ``timings`` dict and ``metadata["metrics"]`` a summary with
+            percentiles. A callable is used as the recorder's hook
+            (default: None, no timings)
+        browser (pyppeteer.browser.Browser or None): take screenshots in
+            this running browser instead of launching one (it is not
+            closed)
+        browser_endpoint (str or None): connect to the running browser at
+            this ``ws://`` DevTools endpoint instead of launching one
+        image_format (str or None): ``png`` (default), ``jpeg`` or ``webp``
+        quality (int or None): JPEG/WebP quality (1-100, default: 80)
+        clip (dict or None): ``{x, y, width, height}`` region to take
+            instead of the viewport screenshot
+        element (str or None): CSS selector of an element to take instead
+            of the viewport screenshot
+        optimize (bool): recompress PNGs as small as possible (slower)
+        tiles (str or None): take full page screenshots one viewport at a
+            time, scrolling down the page, instead of as one bitmap (see
+            ``chutie.tiles``): ``files`` writes each tile to its own file
+            (the screenshot's ``filename`` is the first one and its
+            ``tiled`` manifest lists them all), ``stitch`` stitches them
+            into one PNG as they are taken (requires Pillow; always with a
+            ``store``) (default: None, one bitmap)
+        max_height (int or None): with ``tiles``, capture at most this many
+            CSS pixels of each page; ``tiled["truncated"]`` is set on the
+            screenshots of taller pages (default: None, no limit)
+        retry (chutie.recovery.RetryPolicy or int or dict or None): retry
+            urls that fail (to load, or because the tab or browser crashed)
+            with exponential backoff, and relaunch a crashed browser; the
+            screenshots of a retried url get a ``retries`` count and
+            ``metadata["recovery"]`` counts retries, restarts and urls that
+            still failed (default: None, try each url once)
+        store (chutie.store.ScreenshotStore or str or None): add the
+            screenshots to this packed store (or the store at this path)
+            instead of writing a file each; their ``filename`` is their
+            name in the store (default: None, write files). Not compatible
+            with ``cache``.
+        profile (chutie.assets.BrowserProfile or str or bool or None): launch
+            the browser with a persistent user data and disk cache directory
+            (in a slot of this profile, the profile at this path, or the
+            default one if True) instead of a throwaway one;
+            ``metadata["browser_cache"]`` gets the ratio of responses the
+            browser cache served (default: None)
+        assets (chutie.assets.AssetCache or int or bool or None): serve
+            repeated stylesheets, scripts, fonts and images from this
+            in-process cache (or a new one of this many bytes) through
+            request interception; ``metadata["asset_cache"]`` gets its hit
+            ratio (default: None, no asset cache)
+        prewarm (list[str] or None): urls to load once before capturing,
+            to fill the browser and asset caches (default: None)
+        scheduler (chutie.scheduler.HostScheduler or dict or bool or None):
+            hand the jobs to the tabs host by host, round-robin, with
+            per-host concurrency caps and rate limits, and back off a host
+            that answers ``429`` (the page fails; see ``retry``);
+            ``metadata["scheduler"]`` gets the throttling counts
+            (default: None, jobs in list order)
     Returns:
-        str: template rendered with `context` by jinja2
+        dict: result object TODO
     """
-    import jinja2
+    logging.basicConfig()  # TODO
+    log = logging.getLogger()
+    log.setLevel(logging.DEBUG)
 
-    if template_dir is None:
-        if template_name is None:
-            template_dir = Path(__file__).parent
-            template_name = default_template
-        else:
-            template_dir = Path(template_name).parent
-            template_name = Path(template_name).name
-    env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader([str(template_dir)]), autoescape=True
-    )
-    tmpl = env.get_template(template_name)
-    html = tmpl.render(context)
-    if write_to_path:
-        with open(write_to_path, "w") as _file:
-            _file.write(html)
-    return html
+    readiness = capture_readiness.make_strategy(readiness)
+    streaming = not isinstance(urls, (list, tuple))
+    if streaming:
+        # consumed as the workers take jobs, never held as a whole
+        url_readiness = {}
+        urls = capture_readiness.iter_split_urls(
+            urls, url_readiness, base=readiness)
+    else:
+        urls, url_readiness = capture_readiness.split_urls(
+            urls, base=readiness)
+    deadline = _deadline_at(deadline)
+    screenshot_options = _screenshot_options(
+        image_format=image_format, quality=quality, clip=clip,
+        element=element, optimize=optimize, tiles=tiles,
+        max_height=max_height)
+    _viewports = _build_viewports(viewports)
+    metadata = _new_metadata([] if streaming else urls, _viewports)
+    log.debug(metadata)
+
+    store = _open_store(store, cache, metadata)
+    cache = _open_cache(cache)
+    intercept = _open_intercept(intercept)
+    metrics = capture_metrics.open_recorder(metrics)
+    retry = capture_recovery.open_policy(retry)
+    profile = capture_assets.open_profile(profile)
+    assets = capture_assets.open_asset_cache(assets)
+    scheduler = capture_scheduler.open_scheduler(scheduler)
+    journal, done = _open_journal(journal, metadata, resume)
+    dest = _ensure_dest(dest_path)
+    results = await _capture_jobs(
+        _iter_jobs(urls, _viewports, reload_per_viewport=reload_per_viewport),
+        _viewports, dest,
+        concurrency=concurrency, done=done, single_capture=single_capture,
+        cache=cache, refresh_cache=refresh_cache, journal=journal,
+        intercept=intercept, readiness=readiness, url_readiness=url_readiness,
+        deadline=deadline, metrics=metrics, retry=retry, store=store,
+        profile=profile, assets=assets, prewarm=prewarm, scheduler=scheduler,
+        browser=browser, browser_endpoint=browser_endpoint,
+        **screenshot_options)
+    _add_results(metadata, results)
+    if streaming:
+        metadata["urls"] = list(metadata["pages"])
+    _finish_intercept(metadata, intercept)
+    _finish_metrics(metadata, metrics)
+    _finish_recovery(metadata, retry)
+    _finish_assets(metadata, assets, profile)
+    _finish_scheduler(metadata, scheduler)
+    return _finish_cache(metadata, cache)
+
+
+def _split_shards(jobs, shards, by_host=False):
+    """
+    Args:
+        jobs (list): capture jobs
+        shards (int): number of shards to split ``jobs`` into
+    Kwargs:
+        by_host (bool): if True, put all of the jobs of a host in the same
+            shard (so that one process's scheduler limits apply to it),
+            balancing the number of jobs per shard
+    Returns:
+        list[list[tuple]]: non-empty lists of ``(index, job)``, dealt
+            round-robin so that each shard gets a mix of urls and viewports
+    """
+    indexed = list(enumerate(jobs))
+    if by_host:
+        hosts = collections.OrderedDict()
+        for item in indexed:
+            hosts.setdefault(
+                capture_scheduler.host_of(item[1][0]), []).append(item)
+        split = [[] for _ in range(max(1, shards))]
+        for items in sorted(hosts.values(), key=len, reverse=True):
+            min(split, key=len).extend(items)
+        return [sorted(shard) for shard in split if shard]
+    return [
+        shard for shard in
+        (indexed[n::shards] for n in range(max(1, shards)))
+        if shard]
+
+
+def _screenshot_shard(shard, _viewports, dest_path, concurrency=1,
+                      done=None, capture_options=None):
+    """Take the screenshots for one shard in its own event loop and browser
+    (run in a worker process by ``get_screenshots_sharded``)
+
+    Returns:
+        tuple: ``(results, stats)``: a list of
+            ``(index, (url, [data, ...]))`` and a dict of this process's
+            ``intercept`` counts, ``metrics`` samples, ``recovery``
+            counts, ``asset_cache`` and ``browser_cache`` counts and
+            ``scheduler`` counts (or None)
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(_capture_jobs(
+            (job for index, job in shard), _viewports, Path(dest_path),
+            concurrency=concurrency, done=done, **(capture_options or {})))
+    finally:
+        loop.close()
+    intercept = (capture_options or {}).get("intercept")
+    metrics = (capture_options or {}).get("metrics")
+    retry = (capture_options or {}).get("retry")
+    assets = (capture_options or {}).get("assets")
+    profile = (capture_options or {}).get("profile")
+    scheduler = (capture_options or {}).get("scheduler")
+    stats = dict(
+        intercept=intercept.stats if intercept is not None else None,
+        metrics=metrics.samples if metrics and metrics.enabled else None,
+        recovery=retry.stats if retry is not None else None,
+        asset_cache=assets.stats if assets is not None else None,
+        browser_cache=profile.stats if profile is not None else None,
+        scheduler=scheduler.stats if scheduler is not None else None)
+    return list(zip((index for index, job in shard), results)), stats
+
+
+def get_screenshots_sharded(urls, viewports, dest_path=".", processes=None,
+                            concurrency=1, reload_per_viewport=False,
+                            journal=None, resume=False, **capture_options):
+    """Take screenshots with the url x viewport matrix split across a pool of
+    processes, each of which runs its own browser
+
+    Args:
+        urls (list[str or dict]): see ``get_screenshots``
+        viewports (list[str]): list of width x height viewports to take
+            screenshots in
+    Kwargs:
+        dest_path (str): path to store screenshots and metadata in
+            (default: '.')
+        processes (int or None): number of worker processes
+            (default: ``os.cpu_count()``)
+        concurrency (int): number of tabs per worker process (default: 1)
+        reload_per_viewport (bool): see ``get_screenshots``
+        journal (chutie.journal.Journal or str or None): see
+            ``get_screenshots``; every worker appends to the same journal
+        resume (bool): see ``get_screenshots``
+        capture_options: ``single_capture``, ``cache``, ``refresh_cache``,
+            ``intercept``, ``readiness``, ``deadline``, ``metrics``,
+            ``retry``, ``store``, ``profile``, ``assets`` (each worker
+            process has its own asset cache and profile slot),
+            ``scheduler`` (all of the jobs of a host go to the same worker
+            process, whose scheduler limits it), ``prewarm``
+            (which each worker process loads), ``browser_endpoint`` (which
+            every worker process connects to) and the screenshot options;
+            see ``get_screenshots``
+    Returns:
+        dict: result object in the same shape and order as
+            ``get_screenshots``
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    log = logging.getLogger()
+    processes = processes or os.cpu_count() or 1
+
+    readiness = capture_options["readiness"] = capture_readiness.make_strategy(
+        capture_options.get("readiness"))
+    urls, capture_options["url_readiness"] = capture_readiness.split_urls(
+        urls, base=readiness)
+    capture_options["deadline"] = _deadline_at(capture_options.get("deadline"))
+    capture_options.update(_screenshot_options(**{
+        key: capture_options.pop(key, None)
+        for key in capture_encode.SCREENSHOT_OPTIONS}))
+    _viewports = _build_viewports(viewports)
+    metadata = _new_metadata(urls, _viewports)
+    log.debug(metadata)
+
+    _ensure_dest(dest_path)
+    jobs = _iter_jobs(
+        urls, _viewports, reload_per_viewport=reload_per_viewport)
+    scheduler = capture_options["scheduler"] = (
+        capture_scheduler.open_scheduler(capture_options.get("scheduler")))
+    shards = _split_shards(
+        list(jobs), processes, by_host=scheduler is not None)
+    capture_options["store"] = _open_store(
+        capture_options.get("store"), capture_options.get("cache"), metadata)
+    cache = capture_options["cache"] = _open_cache(
+        capture_options.get("cache"))
+    journal, done = _open_journal(journal, metadata, resume)
+    capture_options["journal"] = journal
+    intercept = capture_options["intercept"] = _open_intercept(
+        capture_options.get("intercept"))
+    metrics = capture_options["metrics"] = capture_metrics.open_recorder(
+        capture_options.get("metrics"))
+    retry = capture_options["retry"] = capture_recovery.open_policy(
+        capture_options.get("retry"))
+    profile = capture_options["profile"] = capture_assets.open_profile(
+        capture_options.get("profile"))
+    assets = capture_options["assets"] = capture_assets.open_asset_cache(
+        capture_options.get("assets"))
+    totals = None
+    if intercept is not None:
+        # each worker process counts into its own copy
+        totals = capture_intercept.Interceptor(intercept.profiles)
+    indexed_results = []
+    with ProcessPoolExecutor(max_workers=len(shards) or 1) as executor:
+        futures = [
+            executor.submit(_screenshot_shard, shard, _viewports,
+                            str(dest_path), concurrency, done,
+                            capture_options)
+            for shard in shards]
+        for future in futures:
+            results, stats = future.result()
+            indexed_results.extend(results)
+            if totals is not None:
+                totals.merge(stats["intercept"])
+            if metrics.enabled:
+                metrics.merge(stats["metrics"])
+            if retry is not None:
+                retry.merge(stats["recovery"])
+            if assets is not None:
+                assets.merge(stats["asset_cache"])
+            if profile is not None:
+                profile.merge(stats["browser_cache"])
+            if scheduler is not None:
+                scheduler.merge(stats["scheduler"])
+    indexed_results.sort(key=lambda item: item[0])
+    _add_results(metadata, (result for index, result in indexed_results))
+    _finish_intercept(metadata, totals)
+    _finish_metrics(metadata, metrics)
+    _finish_recovery(metadata, retry)
+    _finish_assets(metadata, assets, profile)
+    _finish_scheduler(metadata, scheduler)
+    return _finish_cache(metadata, cache)
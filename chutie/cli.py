@@ -9,9 +9,48 @@ import sys
 from pathlib import Path
 
 import click
-from syncer import sync
 
-from chutie import chutie
+from chutie import cache as capture_cache
+from chutie import intercept as capture_intercept
+from chutie import readiness as capture_readiness
+from chutie import options as capture_options
+
+
+def _ensure_dir(path):
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def _load_context(jsonpath):
+    """
+    Args:
+        jsonpath (str): path to a chutie.json or a chutie.jsonl journal
+    Returns:
+        dict: template context
+    """
+    if str(jsonpath).endswith('.jsonl'):
+        from chutie import journal
+        return journal.compact(jsonpath)
+    with open(jsonpath) as _file:
+        return json.load(_file, object_pairs_hook=collections.OrderedDict)
+
+
+def _load_config(config):
+    """
+    Args:
+        config (str): path to a .json, .yaml or .yml config file
+    Returns:
+        dict: the config
+    """
+    if config.endswith('.json'):
+        with open(config) as _file:
+            return json.load(_file)
+    elif config.endswith('.yaml') or config.endswith('.yml'):
+        import yaml
+        with open(config) as _file:
+            return yaml.safe_load(_file)
+    raise click.BadParameter(
+        "The config file must end in one of "
+        ".json, .yaml, or .yml")
 
 
 @click.group()
@@ -21,6 +60,85 @@ def main(args=None):
     return 0
 
 
+def _capture_in_daemon(urls, viewports, dest_path, socket_path, kwargs):
+    """Take screenshots in a `chutie serve` daemon's browsers"""
+    from chutie import daemon
+
+    options = dict(kwargs)
+    cache, intercept = options.pop("cache"), options.pop("intercept")
+    if cache is not None:
+        options["cache"] = dict(path=str(cache.path),
+                                max_bytes=cache.max_bytes,
+                                max_age=cache.max_age)
+    if intercept is not None:
+        options["intercept"] = intercept.profiles
+    if options.get("retry") is not None:
+        options["retry"] = options["retry"].to_dict()
+    if options.get("scheduler") is not None:
+        options["scheduler"] = options["scheduler"].settings()
+    # the daemon's browsers stay warm: they don't take a profile
+    options.pop("profile", None)
+    if socket_path == "serve":
+        socket_path = None
+    try:
+        return daemon.capture(urls, viewports, dest_path,
+                              socket_path=socket_path, **options)
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(f"chutie serve: {e}")
+
+
+def _echo_cache_ratios(context):
+    """Echo the asset and browser cache hit ratios of a run"""
+    stats = context.get("asset_cache")
+    if stats and stats["requests"]:
+        click.echo(
+            f"Served {stats['hits']} of {stats['requests']} cacheable"
+            f" requests from the asset cache"
+            f" ({stats['bytes_served'] // 1024} KiB).")
+    stats = context.get("browser_cache")
+    if stats and stats["responses"]:
+        click.echo(
+            f"The browser cache served {stats['from_cache']} of"
+            f" {stats['responses']} responses.")
+
+
+def _render(context, output, template_name=None, per_page=None,
+            bytecode_cache=None):
+    """Render the HTML report, paginated if ``per_page`` is set"""
+    from chutie import render
+
+    if per_page:
+        render.render_paginated(context, write_to_path=output,
+                                per_page=per_page,
+                                template_name=template_name,
+                                bytecode_cache=bytecode_cache)
+    else:
+        render.render_template(context, template_name=template_name,
+                               write_to_path=output,
+                               bytecode_cache=bytecode_cache)
+
+
+def _render_sites(context, output, template_name=None, per_page=None,
+                  bytecode_cache=None, processes=1):
+    """Render one HTML report per site, as ``<output stem>-<host>.html``
+
+    Returns:
+        list[str]: the paths written
+    """
+    from chutie import render
+
+    template_dir, template_name = render.resolve_template(
+        template_name=template_name)
+    renderer = render.get_renderer(template_dir, bytecode_cache)
+    output = Path(output)
+    reports = [
+        (site_context, output.parent / f"{output.stem}-{host}{output.suffix}")
+        for host, site_context in render.split_sites(context).items()]
+    return renderer.render_many(
+        reports, processes=processes, template_name=template_name,
+        per_page=per_page)
+
+
 @click.command()
 @click.option(
     "-u",
@@ -32,6 +150,27 @@ def main(args=None):
     ),
     multiple=True,
 )
+@click.option(
+    "--urls-file",
+    "url_sources",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    help=(
+        "File of URLs to retrieve screenshots of, read as it is needed:"
+        " one URL per line, a sitemap or sitemap index (.xml or .xml.gz),"
+        " or - for stdin. This can be specified multiple times."
+    ),
+    multiple=True,
+)
+@click.option(
+    "--bloom-capacity",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Deduplicate URLs with a Bloom filter sized for this many URLs"
+        " (about 2.4 bytes per URL, with a 1 in 10000 chance of skipping a"
+        " new URL) instead of an exact set of URL hashes."
+    ),
+)
 @click.option(
     "-r",
     "--viewports",
@@ -74,58 +213,636 @@ def main(args=None):
     "-t",
     "--template",
     "template_name",
-    default=None, # == "chutie/screenshots.j2",
+    default=None,  # == "chutie/screenshots.j2",
     help=(
         "Path to a jinja2 template."
         " Default: chutie/screenshots.j2"
     ),
 )
-def screenshots(urls, viewports, dest_path, output, configs, template_name):
+@click.option(
+    "-j",
+    "--concurrency",
+    default=1,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of browser tabs to take screenshots in at once."
+        " Default: 1"
+    ),
+)
+@click.option(
+    "-p",
+    "--processes",
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of processes (each with its own browser) to split the"
+        " url x viewport screenshots across. 0 means one per CPU."
+        " Default: 1"
+    ),
+)
+@click.option(
+    "--reload-per-viewport",
+    is_flag=True,
+    default=False,
+    help=(
+        "Load each URL again in a new tab for every viewport instead of"
+        " loading it once and resizing the tab"
+        " (for sites whose CSS breaks on resize)."
+    ),
+)
+@click.option(
+    "--single-capture",
+    is_flag=True,
+    default=False,
+    help=(
+        "Take one full page screenshot per viewport and crop the viewport"
+        " screenshot from it."
+    ),
+)
+@click.option(
+    "--format",
+    "image_format",
+    type=click.Choice(["png", "jpeg", "webp"]),
+    default=None,
+    help=(
+        "Screenshot image format (webp, and jpeg with --single-capture,"
+        " require chutie[encode]). Default: png"
+    ),
+)
+@click.option(
+    "--quality",
+    type=click.IntRange(min=1, max=100),
+    default=None,
+    help="JPEG/WebP quality. Default: 80",
+)
+@click.option(
+    "--clip",
+    default=None,
+    help=(
+        "Take this X,Y,WIDTH,HEIGHT region instead of the viewport"
+        " screenshot."
+    ),
+)
+@click.option(
+    "--element",
+    default=None,
+    help=(
+        "Take the element matching this CSS selector instead of the"
+        " viewport screenshot."
+    ),
+)
+@click.option(
+    "--optimize",
+    is_flag=True,
+    default=False,
+    help=(
+        "Recompress PNG screenshots as small as possible (slower;"
+        " requires chutie[encode])."
+    ),
+)
+@click.option(
+    "--tiles",
+    type=click.Choice(["files", "stitch"]),
+    default=None,
+    help=(
+        "Take full page screenshots one viewport at a time instead of as"
+        " one bitmap, and write each tile to a file (files) or stitch them"
+        " into one PNG (stitch, requires chutie[stitch])."
+    ),
+)
+@click.option(
+    "--max-height",
+    type=click.IntRange(min=1),
+    default=None,
+    help="With --tiles, capture at most this many pixels of each page.",
+)
+@click.option(
+    "--browser-endpoint",
+    default=None,
+    help=(
+        "Take screenshots in a running browser instead of launching one:"
+        " a ws:// DevTools endpoint, or the path of a `chutie serve` socket"
+        " (\"serve\" for the default socket)."
+    ),
+)
+@click.option(
+    "--wait-until",
+    type=click.Choice(capture_readiness.WAIT_UNTIL),
+    default=None,
+    help=(
+        "Navigation event to wait for before taking screenshots."
+        " Default: load"
+    ),
+)
+@click.option(
+    "--wait-for-selector",
+    default=None,
+    help="Wait until an element matching this CSS selector exists.",
+)
+@click.option(
+    "--settle",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Seconds to wait after the page is otherwise ready. Default: 0",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0),
+    default=None,
+    help=(
+        "Seconds to wait for each url to be ready before recording it as"
+        " failed (0 for no limit). Default: 30"
+    ),
+)
+@click.option(
+    "--deadline",
+    type=click.FloatRange(min=0),
+    default=None,
+    help=(
+        "Seconds the whole run may take; urls that are not done by then"
+        " are recorded as failed."
+    ),
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=2,
+    help=(
+        "Retry a url that fails to load (or whose tab or browser crashes)"
+        " this many times, and relaunch a crashed browser."
+        " Default: 2"
+    ),
+)
+@click.option(
+    "--retry-backoff",
+    type=click.FloatRange(min=0),
+    default=1.0,
+    help=(
+        "Seconds to wait before the first retry of a url;"
+        " the wait doubles after each retry (up to 30s)."
+        " Default: 1"
+    ),
+)
+@click.option(
+    "--retry-budget",
+    type=click.IntRange(min=0),
+    default=None,
+    help=(
+        "Retry at most this many times in the whole run"
+        " (per worker process)."
+    ),
+)
+@click.option(
+    "--max-per-host",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Load at most this many pages of one host at once.",
+)
+@click.option(
+    "--host-rate",
+    type=click.FloatRange(min=0),
+    default=None,
+    help=(
+        "Start at most this many page loads per second on one host."
+        " Hosts that answer 429 are backed off (use --retries to retry"
+        " their pages)."
+    ),
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    help=(
+        "Directory to cache screenshots of unchanged pages in (implies"
+        " --cache). Default: $XDG_CACHE_HOME/chutie"
+    ),
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=False,
+    help=(
+        "Reuse screenshots of unchanged pages from a persistent cache (of"
+        " up to --cache-max-size MB). Default: --no-cache"
+    ),
+)
+@click.option(
+    "--refresh",
+    "refresh_cache",
+    is_flag=True,
+    default=False,
+    help=(
+        "Take new screenshots even if they are cached (and update the"
+        " cache)."
+    ),
+)
+@click.option(
+    "--cache-max-size",
+    default=capture_cache.DEFAULT_MAX_BYTES // 1024 ** 2,
+    type=click.IntRange(min=0),
+    help=(
+        "Evict the least recently used cache entries when the cache is"
+        " larger than this many MB."
+        " Default: 2048"
+    ),
+)
+@click.option(
+    "--cache-max-age",
+    default=capture_cache.DEFAULT_MAX_AGE / 3600,
+    type=click.FloatRange(min=0),
+    help=(
+        "Evict cache entries that have not been used for this many hours."
+        " Default: 168"
+    ),
+)
+@click.option(
+    "--profile",
+    "browser_profile",
+    is_flag=True,
+    default=False,
+    help=(
+        "Launch the browser with a persistent profile (user data and disk"
+        " cache) that is kept warm across runs instead of a throwaway one."
+        " Default directory: $XDG_CACHE_HOME/chutie-browser"
+    ),
+)
+@click.option(
+    "--profile-dir",
+    default=None,
+    help="Directory of the persistent browser profile (implies --profile).",
+)
+@click.option(
+    "--disk-cache-size",
+    default=512,
+    type=click.IntRange(min=1),
+    help=(
+        "Size limit of the browser disk cache of a persistent profile, in MB."
+        " Default: 512"
+    ),
+)
+@click.option(
+    "--asset-cache",
+    "asset_cache_size",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Serve repeated stylesheets, scripts, fonts and images from an"
+        " in-process cache of this many MB (per worker process)."
+        " Default: 0 (no asset cache)"
+    ),
+)
+@click.option(
+    "--prewarm",
+    multiple=True,
+    help=(
+        "Load this url once before taking screenshots to fill the browser"
+        " and asset caches. This can be specified multiple times."
+    ),
+)
+@click.option(
+    "--journal",
+    default="chutie.jsonl",
+    help=(
+        "Name of the JSON Lines file in dest-path to append each"
+        " screenshot's metadata to as soon as it is taken."
+        " Default: chutie.jsonl"
+    ),
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help=(
+        "Skip the screenshots that are already in the journal"
+        " (e.g. after a crash)."
+    ),
+)
+@click.option(
+    "--store",
+    "store_path",
+    default=None,
+    help=(
+        "Add screenshots to this SQLite file (e.g. chutie.shots.sqlite in"
+        " dest-path) instead of writing one file each; see `chutie view`"
+        " and `chutie extract`. Implies --no-cache."
+    ),
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    default=None,
+    help=(
+        "Time each stage of each capture and write a summary with"
+        " percentiles to this file: Prometheus text format if it ends with"
+        " .prom or .txt, else JSON."
+    ),
+)
+@click.option(
+    "--block",
+    "block",
+    type=click.Choice(list(capture_intercept.PROFILES)),
+    multiple=True,
+    help=(
+        "Block the requests that this interception profile matches"
+        " (third-party hosts, cross-origin requests, media, or web fonts)."
+        " This can be specified multiple times."
+    ),
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    default=False,
+    help=(
+        "Hash every screenshot into a chutie.hashes.json index"
+        " and hardlink screenshots with identical pixels."
+    ),
+)
+@click.option(
+    "--thumbnails",
+    "thumbnail_format",
+    flag_value="webp",
+    default=None,
+    help=(
+        "Make downscaled WebP thumbnails for the HTML report to show"
+        " (linked to the full screenshots)."
+    ),
+)
+@click.option(
+    "--thumbnail-format",
+    "thumbnail_format",
+    type=click.Choice(["webp", "jpeg", "png"]),
+    help="Make thumbnails in this format (implies --thumbnails).",
+)
+@click.option(
+    "--per-page",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Split the HTML report into an index page and pages of this many"
+        " screenshots each."
+    ),
+)
+def screenshots(urls, url_sources, bloom_capacity, viewports, dest_path,
+                output, configs, template_name,
+                concurrency, processes, reload_per_viewport, single_capture,
+                image_format, quality, clip, element, optimize, tiles,
+                max_height, browser_endpoint, wait_until, wait_for_selector,
+                settle, timeout, deadline, retries, retry_backoff,
+                retry_budget, max_per_host, host_rate, cache_dir, use_cache,
+                refresh_cache, cache_max_size, cache_max_age, browser_profile,
+                profile_dir, disk_cache_size, asset_cache_size, prewarm,
+                journal, resume, store_path, metrics_path, block, dedupe,
+                thumbnail_format, per_page):
     """Take screenshots of the URLs with the given resolution strings,
     save them to dest-path,
     and write a chutie.json and a chutie.html
     """
-    if not ((bool(urls) and bool(viewports)) or bool(configs)):
+    if not (((bool(urls) or bool(url_sources)) and bool(viewports))
+            or bool(configs)):
         raise click.UsageError(
             "You must specify urls, viewports, or a config file."
             " See: --help")
 
     _urls = []
+    _url_sources = []
+    _prewarm = []
     _viewports = []
+    scheduler = {}
+    readiness = {
+        key: value for key, value in (
+            ("wait_until", wait_until),
+            ("selector", wait_for_selector),
+            ("settle", settle),
+            ("timeout", timeout))
+        if value is not None}
 
     if bool(configs):
         for config in configs:
-            if config.endswith('.json'):
-                with open(config) as _file:
-                    cfg = json.load(_file)
-            elif config.endswith('.yaml') or config.endswith('.yml'):
-                import yaml
-                with open(config) as _file:
-                    cfg = yaml.safe_load(_file)
-            else:
-                raise click.BadParameter(
-                    "The config file must end in one of "
-                    ".json, .yaml, or .yml")
+            cfg = _load_config(config)
 
             _urls.extend(cfg.get('urls', []))
+            _url_sources.extend(cfg.get('url_sources', []))
+            bloom_capacity = cfg.get('bloom_capacity', bloom_capacity)
             _viewports.extend(cfg.get('viewports', []))
             dest_path = cfg.get('dest_path', dest_path)
             output = cfg.get('output', output)
+            concurrency = cfg.get('concurrency', concurrency)
+            processes = cfg.get('processes', processes)
+            reload_per_viewport = cfg.get(
+                'reload_per_viewport', reload_per_viewport)
+            single_capture = cfg.get('single_capture', single_capture)
+            cache_dir = cfg.get('cache_dir', cache_dir)
+            use_cache = cfg.get('cache', use_cache)
+            block = cfg.get('intercept', block)
+            readiness.update(cfg.get('readiness', {}))
+            deadline = cfg.get('deadline', deadline)
+            retries = cfg.get('retries', retries)
+            retry_backoff = cfg.get('retry_backoff', retry_backoff)
+            retry_budget = cfg.get('retry_budget', retry_budget)
+            metrics_path = cfg.get('metrics', metrics_path)
+            browser_endpoint = cfg.get('browser_endpoint', browser_endpoint)
+            image_format = cfg.get('image_format', image_format)
+            quality = cfg.get('quality', quality)
+            clip = cfg.get('clip', clip)
+            element = cfg.get('element', element)
+            optimize = cfg.get('optimize', optimize)
+            tiles = cfg.get('tiles', tiles)
+            max_height = cfg.get('max_height', max_height)
+            dedupe = cfg.get('dedupe', dedupe)
+            thumbnail_format = cfg.get('thumbnails', thumbnail_format)
+            per_page = cfg.get('per_page', per_page)
+            store_path = cfg.get('store', store_path)
+            browser_profile = cfg.get('profile', browser_profile)
+            disk_cache_size = cfg.get('disk_cache_size', disk_cache_size)
+            asset_cache_size = cfg.get('asset_cache', asset_cache_size)
+            _prewarm.extend(cfg.get('prewarm', []))
+            scheduler.update(cfg.get('scheduler', {}))
 
     _urls.extend(urls)
+    _url_sources.extend(url_sources)
     _viewports.extend(viewports)
 
-    cfg = dict(urls=_urls, viewports=_viewports, dest_path=dest_path, output=output)
+    formats = {image_format or "png"} | {
+        viewport.get("image_format") or image_format or "png"
+        for viewport in _viewports if isinstance(viewport, dict)}
+    if formats != {"png"} and (dedupe or thumbnail_format):
+        raise click.UsageError(
+            "--dedupe and --thumbnails need PNG screenshots:"
+            " use --format png (the default) with them.")
+    from chutie import encode as capture_encode
+    # a store holds stitched tiles
+    run_options = dict(image_format=image_format, optimize=optimize,
+                       tiles="stitch" if store_path and tiles else tiles)
+    viewport_options = [run_options] + [
+        dict(run_options, **{key: value for key, value in viewport.items()
+                             if value is not None})
+        for viewport in _viewports if isinstance(viewport, dict)]
+    needs_pillow = any(
+        capture_encode.needs_pillow(options, crop=single_capture)
+        for options in viewport_options)
+    if needs_pillow and not capture_encode.have_pillow():
+        raise click.UsageError(
+            "--format webp, --optimize, --tiles stitch and --format jpeg"
+            " with --single-capture require Pillow:"
+            " pip install chutie[encode]")
+    if store_path:
+        if dedupe or thumbnail_format:
+            raise click.UsageError(
+                "--dedupe and --thumbnails need screenshot files:"
+                " run `chutie extract` and then `chutie dupes` or"
+                " `chutie thumbnails` instead of using --store.")
+        if use_cache or cache_dir:
+            click.echo("Not using the screenshot cache with --store.")
+        use_cache, cache_dir = False, None
+    use_cache = bool(use_cache or cache_dir)
+
+    cfg = dict(urls=_urls, url_sources=_url_sources, viewports=_viewports,
+               dest_path=dest_path, output=output,
+               concurrency=concurrency, processes=processes,
+               reload_per_viewport=reload_per_viewport,
+               single_capture=single_capture,
+               cache_dir=cache_dir if use_cache else None)
     click.echo(cfg)
 
-    context = sync(chutie.get_screenshots(_urls, _viewports, dest_path))
+    cache = None
+    if use_cache:
+        cache = capture_cache.CaptureCache(
+            cache_dir,
+            max_bytes=cache_max_size * 1024 ** 2,
+            max_age=cache_max_age * 3600)
+
+    from chutie import scheduler as capture_scheduler
+
+    if isinstance(block, str):
+        block = [block]
+    try:
+        intercept = capture_intercept.Interceptor(block) if block else None
+        readiness = capture_readiness.make_strategy(readiness)
+        capture_readiness.split_urls(_urls, base=readiness)
+        capture_options.build_viewports(_viewports)
+        for source in _url_sources:
+            if source != "-" and not Path(source).is_file():
+                raise ValueError(f"no such urls file: {source}")
+        if isinstance(clip, str):
+            x, y, width, height = map(int, clip.split(","))
+            clip = dict(x=x, y=y, width=width, height=height)
+        if max_per_host:
+            scheduler["max_per_host"] = max_per_host
+        if host_rate:
+            scheduler["rate"] = host_rate
+        scheduler = capture_scheduler.open_scheduler(scheduler or None)
+    except (ValueError, KeyError) as e:
+        raise click.UsageError(f"Invalid config: {e}")
+
+    from syncer import sync
+
+    from chutie import chutie
+    from chutie import sources
+    seen = None
+    if bloom_capacity:
+        seen = sources.BloomFilter(bloom_capacity)
+    # read lazily (and deduplicated) as the capture workers need them
+    _urls = sources.iter_urls(_urls, _url_sources, seen=seen)
+
+    retry = None
+    if retries:
+        from chutie import recovery as capture_recovery
+        retry = capture_recovery.RetryPolicy(
+            retries=retries, backoff=retry_backoff, budget=retry_budget)
+
+    profile = None
+    if profile_dir or browser_profile:
+        if isinstance(browser_profile, str):
+            # a profile directory in a config file
+            profile_dir = profile_dir or browser_profile
+        from chutie import assets as capture_assets
+        profile = capture_assets.BrowserProfile(
+            profile_dir, disk_cache_size=disk_cache_size * 1024 ** 2)
+
+    _ensure_dir(dest_path)
+    kwargs = dict(
+        journal=str(Path(dest_path) / journal),
+        resume=resume,
+        concurrency=concurrency,
+        reload_per_viewport=reload_per_viewport,
+        single_capture=single_capture,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        intercept=intercept,
+        readiness=readiness,
+        deadline=deadline,
+        metrics=bool(metrics_path),
+        retry=retry,
+        store=store_path,
+        profile=profile,
+        assets=asset_cache_size * 1024 ** 2,
+        prewarm=list(_prewarm) + list(prewarm),
+        scheduler=scheduler,
+        image_format=image_format,
+        quality=quality,
+        clip=clip,
+        element=element,
+        optimize=optimize,
+        tiles=tiles,
+        max_height=max_height,
+    )
+    if browser_endpoint and not browser_endpoint.startswith(
+            ("ws://", "wss://")):
+        context = _capture_in_daemon(
+            list(_urls), _viewports, dest_path, browser_endpoint, kwargs)
+    elif processes == 1:
+        context = sync(chutie.get_screenshots(
+            _urls, _viewports, dest_path, browser_endpoint=browser_endpoint,
+            **kwargs))
+    else:
+        context = chutie.get_screenshots_sharded(
+            _urls, _viewports, dest_path, processes=processes or None,
+            browser_endpoint=browser_endpoint, **kwargs)
+
+    failed = [data for datas in context["pages"].values()
+              for data in datas if data.get("failed")]
+    if failed:
+        click.echo(f"{len(failed)} viewports failed to load"
+                   f" (see chutie.json).")
+
+    if metrics_path:
+        from chutie import metrics
+        metrics.write_metrics(context["metrics"]["stages"], metrics_path)
+        click.echo(f"Wrote stage timings to {metrics_path}.")
+
+    recovery = context.get("recovery")
+    if recovery and (recovery["retries"] or recovery["restarts"]):
+        click.echo(
+            f"Retried {recovery['retries']} times"
+            f" ({recovery['restarts']} browser restarts,"
+            f" {recovery['failed']} urls still failed).")
+
+    if intercept is not None:
+        stats = context["intercept"]
+        click.echo(
+            f"Blocked {stats['blocked']} of {stats['requests']} requests"
+            f" (~{stats['bytes_saved_estimate'] // 1024} KiB saved).")
+
+    _echo_cache_ratios(context)
+
+    if dedupe:
+        from chutie import hashindex
+        index = hashindex.index_screenshots(context, dest_path)
+        click.echo(
+            f"Indexed {len(index.entries)} screenshots"
+            f" ({len(index.duplicates())} groups of duplicates).")
+
+    if thumbnail_format:
+        from chutie import thumbnails
+        thumbnails.generate_thumbnails(
+            context, dest_path, format=thumbnail_format,
+            processes=processes or None)
 
     jsonpath = Path(dest_path) / "chutie.json"
     with open(jsonpath, "w") as _file:
         json.dump(context, _file, indent=2)
 
-    chutie.render_template(context,
-                           template_name=template_name, write_to_path=output)
+    _render(context, output, template_name=template_name,
+            per_page=per_page)
     click.echo(f"Successfully rendered to {output}.")
     return 0
 
@@ -136,7 +853,7 @@ def screenshots(urls, viewports, dest_path, output, configs, template_name):
     "--jsonpath",
     default="chutie.json",
     help=(
-        "Path to a chutie.json file to template"
+        "Path to a chutie.json (or chutie.jsonl journal) file to template"
         " Default: chutie.json"
     )
 )
@@ -144,7 +861,7 @@ def screenshots(urls, viewports, dest_path, output, configs, template_name):
     "-t",
     "--template",
     "template_name",
-    default=None, # == "chutie/screenshots.j2",
+    default=None,  # == "chutie/screenshots.j2",
     help=(
         "Name of a jinja2 template in ./chutie/ (TODO FileSystemLoader)"
         " Default: chutie/screenshots.j2"
@@ -159,17 +876,661 @@ def screenshots(urls, viewports, dest_path, output, configs, template_name):
         " Default: chutie.html"
     ),
 )
-def template(jsonpath, template_name, output):
-    """Generate a chutie.html from a chutie.json and a jinja2 template"""
-    with open(jsonpath) as _file:
-        ctxt = json.load(_file, object_pairs_hook=collections.OrderedDict)
-    chutie.render_template(ctxt,
-                           template_name=template_name, write_to_path=output)
+@click.option(
+    "--per-page",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Split the HTML report into an index page and pages of this many"
+        " screenshots each."
+    ),
+)
+@click.option(
+    "--per-site",
+    is_flag=True,
+    default=False,
+    help=(
+        "Write one report per site (host) instead,"
+        " named <output>-<host>.html."
+    ),
+)
+@click.option(
+    "-j",
+    "--processes",
+    type=click.IntRange(min=0),
+    default=1,
+    help=(
+        "Number of processes to render --per-site reports in"
+        " (0 for one per CPU). Default: 1"
+    ),
+)
+@click.option(
+    "--bytecode-cache/--no-bytecode-cache",
+    default=True,
+    help=(
+        "Keep compiled templates in $XDG_CACHE_HOME/chutie-templates,"
+        " so that the next run does not compile them again."
+        " Default: on"
+    ),
+)
+def template(jsonpath, template_name, output, per_page, per_site, processes,
+             bytecode_cache):
+    """Generate a chutie.html from a chutie.json (or a chutie.jsonl journal)
+    and a jinja2 template"""
+    ctxt = _load_context(jsonpath)
+    if per_site:
+        paths = _render_sites(
+            ctxt, output, template_name=template_name, per_page=per_page,
+            bytecode_cache=bytecode_cache, processes=processes or None)
+        click.echo(f"Rendered {len(paths)} reports.")
+    else:
+        _render(ctxt, output, template_name=template_name,
+                per_page=per_page, bytecode_cache=bytecode_cache)
     click.echo(pprint.pformat(locals()))
     return 0
 
+
+@click.command()
+@click.option(
+    "-f",
+    "--journal",
+    "journal_path",
+    default="chutie.jsonl",
+    help=(
+        "Path to a chutie.jsonl journal to compact"
+        " Default: chutie.jsonl"
+    )
+)
+@click.option(
+    "-o",
+    "--output",
+    default="chutie.json",
+    help=(
+        "Path to write the chutie.json to."
+        " Default: chutie.json"
+    ),
+)
+def compact(journal_path, output):
+    """Fold a chutie.jsonl journal into a chutie.json"""
+    from chutie import journal
+    context = journal.compact(journal_path, json_path=output)
+    count = sum(len(pageset) for pageset in context["pages"].values())
+    click.echo(f"Wrote {count} screenshots to {output}.")
+    return 0
+
+
+@click.command()
+@click.argument("jsonpath_a")
+@click.argument("jsonpath_b")
+@click.option(
+    "-o",
+    "--output-dir",
+    default="chutie-diff",
+    help=(
+        "Directory to write diff mask images and diff.json into."
+        " Default: chutie-diff"
+    ),
+)
+@click.option(
+    "--threshold",
+    default=0.1,
+    type=click.FloatRange(min=0, max=1),
+    help=(
+        "Per-channel color difference (0-1) above which pixels differ."
+        " Default: 0.1"
+    ),
+)
+@click.option(
+    "--aa-tolerance",
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Don't count a pixel as different if the other screenshot has a"
+        " matching pixel within this many pixels (anti-aliasing)."
+        " Default: 1"
+    ),
+)
+@click.option(
+    "-p",
+    "--processes",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of processes to diff screenshots in. 0 means one per CPU."
+        " Default: 0"
+    ),
+)
+@click.option(
+    "--max-score",
+    default=None,
+    type=click.FloatRange(min=0, max=1),
+    help=(
+        "Exit with status 1 if any pair of screenshots has a higher score"
+        " (fraction of differing pixels)."
+    ),
+)
+def diff(jsonpath_a, jsonpath_b, output_dir, threshold, aa_tolerance,
+         processes, max_score):
+    """Compare the screenshots of two runs (JSONPATH_A and JSONPATH_B are
+    chutie.json files) and write diff masks and a diff.json"""
+    from chutie import diff as chutie_diff
+    result = chutie_diff.diff_runs(
+        jsonpath_a, jsonpath_b, output_dir=output_dir, threshold=threshold,
+        aa_tolerance=aa_tolerance, processes=processes or None)
+    failed = 0
+    for pair in result["pairs"]:
+        score = pair.get("score")
+        click.echo(
+            f"{score if score is not None else 'error':<10.6} "
+            f"{pair['url']} {pair['pathstr']}"
+            f"{' full' if pair['fullPage'] else ''}")
+        if (max_score is not None
+                and (score is None or score > max_score)):
+            failed += 1
+    click.echo(
+        f"{len(result['pairs'])} pairs, {len(result['only_a'])} only in A,"
+        f" {len(result['only_b'])} only in B."
+        f" Wrote {Path(output_dir) / 'diff.json'}.")
+    if failed:
+        raise click.ClickException(
+            f"{failed} pairs have a score over {max_score}")
+    return 0
+
+
+@click.command()
+@click.option(
+    "-f",
+    "--jsonpath",
+    default="chutie.json",
+    help=(
+        "Path to a chutie.json whose screenshots to find duplicates of."
+        " Default: chutie.json"
+    )
+)
+@click.option(
+    "-k",
+    "--distance",
+    default=4,
+    type=click.IntRange(min=0, max=64),
+    help=(
+        "Maximum perceptual hash Hamming distance of near-duplicates."
+        " Default: 4"
+    ),
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="Rehash the screenshots even if there is a chutie.hashes.json.",
+)
+def dupes(jsonpath, distance, rebuild):
+    """List duplicate and near-duplicate screenshots of a run"""
+    from chutie import hashindex
+    indexpath = Path(jsonpath).parent / hashindex.INDEX_FILENAME
+    if rebuild or not indexpath.exists():
+        context = _load_context(jsonpath)
+        index = hashindex.index_screenshots(
+            context, Path(jsonpath).parent, link=False)
+    else:
+        index = hashindex.HashIndex.load(str(indexpath))
+    for dist, entry_a, entry_b in index.near_duplicates(k=distance):
+        click.echo(f"{dist:2d} {entry_a['filename']} {entry_b['filename']}")
+    return 0
+
+
+@click.command()
+@click.option(
+    "-f",
+    "--jsonpath",
+    default="chutie.json",
+    help=(
+        "Path to a chutie.json to make thumbnails for (it is updated with"
+        " the thumbnail paths)."
+        " Default: chutie.json"
+    )
+)
+@click.option(
+    "--format",
+    "thumbnail_format",
+    default="webp",
+    type=click.Choice(["webp", "jpeg", "png"]),
+    help="Thumbnail image format. Default: webp",
+)
+@click.option(
+    "--width",
+    default=320,
+    type=click.IntRange(min=1),
+    help="Thumbnail width in pixels. Default: 320",
+)
+@click.option(
+    "-p",
+    "--processes",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of processes to make thumbnails in. 0 means one per CPU."
+        " Default: 0"
+    ),
+)
+def thumbnails(jsonpath, thumbnail_format, width, processes):
+    """Make thumbnails of the screenshots in a chutie.json"""
+    from chutie import thumbnails as chutie_thumbnails
+    if str(jsonpath).endswith('.jsonl'):
+        raise click.BadParameter(
+            "Run 'chutie compact' first: thumbnails updates a chutie.json")
+    context = _load_context(jsonpath)
+    chutie_thumbnails.generate_thumbnails(
+        context, Path(jsonpath).parent, width=width, format=thumbnail_format,
+        processes=processes or None)
+    with open(jsonpath, "w") as _file:
+        json.dump(context, _file, indent=2)
+    click.echo(f"Added thumbnails to {jsonpath}.")
+    return 0
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    help=(
+        "Path of the Unix socket to listen on."
+        " Default: $XDG_RUNTIME_DIR/chutie.sock or /tmp/chutie-<uid>.sock"
+    ),
+)
+@click.option(
+    "-b",
+    "--browsers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of browsers to keep running. Default: 1",
+)
+@click.option(
+    "--recycle-after",
+    default=500,
+    type=click.IntRange(min=0),
+    help=(
+        "Replace a browser with a new one after it has opened this many"
+        " pages (0: never). Default: 500"
+    ),
+)
+def serve(socket_path, browsers, recycle_after):
+    """Keep browsers running and take screenshots for
+    `chutie screenshots --browser-endpoint SOCKET`"""
+    from chutie import daemon
+
+    socket_path = socket_path or daemon.default_socket_path()
+    click.echo(f"Listening on {socket_path}")
+    daemon.serve(socket_path, browsers=browsers,
+                 recycle_after=recycle_after or None)
+    return 0
+
+
+@click.command()
+@click.option(
+    "-q",
+    "--queue",
+    "queue_path",
+    default="chutie.queue.sqlite",
+    help=(
+        "Path of the SQLite work queue file (on storage shared by the"
+        " workers). Default: chutie.queue.sqlite"
+    ),
+)
+@click.option(
+    "-u",
+    "--url",
+    "urls",
+    help=(
+        "URL to retrieve screenshots of."
+        " This can be specified multiple times."
+    ),
+    multiple=True,
+)
+@click.option(
+    "--urls-file",
+    "url_sources",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    help=(
+        "File of URLs to retrieve screenshots of: one URL per line,"
+        " a sitemap or sitemap index (.xml or .xml.gz), or - for stdin."
+        " This can be specified multiple times."
+    ),
+    multiple=True,
+)
+@click.option(
+    "-r",
+    "--viewports",
+    help=(
+        'Viewport config string (e.g. "1024x768 mobile landscape devname7").'
+        " This can be specified multiple times"
+    ),
+    multiple=True,
+)
+@click.option(
+    '-c',
+    '--config',
+    'configs',
+    help=(
+        "Path to a JSON or YAML config file with urls, url_sources,"
+        " viewports and screenshot options."
+        " This can be specified multiple times."
+    ),
+    multiple=True,
+)
+@click.option(
+    "--single-capture",
+    is_flag=True,
+    default=False,
+    help=(
+        "Take one full page screenshot per viewport and crop the viewport"
+        " screenshot from it."
+    ),
+)
+@click.option(
+    "--reload-per-viewport",
+    is_flag=True,
+    default=False,
+    help="Load each url in a new tab for each viewport.",
+)
+@click.option(
+    "--format",
+    "image_format",
+    type=click.Choice(["png", "jpeg", "webp"]),
+    default=None,
+    help="Screenshot image format. Default: png",
+)
+@click.option(
+    "--block",
+    "block",
+    type=click.Choice(list(capture_intercept.PROFILES)),
+    multiple=True,
+    help=(
+        "Block the requests that this interception profile matches."
+        " This can be specified multiple times."
+    ),
+)
+def enqueue(queue_path, urls, url_sources, viewports, configs,
+            single_capture, reload_per_viewport, image_format, block):
+    """Add url x viewport tasks to a work queue for `chutie worker`s"""
+    from chutie import scheduler as capture_scheduler
+    from chutie import sources
+    from chutie import workqueue
+
+    _urls = list(urls)
+    _url_sources = list(url_sources)
+    _viewports = list(viewports)
+    options = dict(
+        single_capture=single_capture,
+        reload_per_viewport=reload_per_viewport,
+        image_format=image_format,
+        intercept=list(block))
+    for config in configs:
+        cfg = _load_config(config)
+        _urls.extend(cfg.get('urls', []))
+        _url_sources.extend(cfg.get('url_sources', []))
+        _viewports.extend(cfg.get('viewports', []))
+        options.update({
+            key: cfg[key] for key in workqueue.RUN_OPTIONS if key in cfg})
+    if not ((_urls or _url_sources) and _viewports):
+        raise click.UsageError(
+            "You must specify urls and viewports, or a config file."
+            " See: --help")
+    options = {key: value for key, value in options.items() if value}
+    try:
+        capture_readiness.make_strategy(options.get("readiness"))
+        capture_intercept.Interceptor(options.get("intercept") or [])
+        capture_scheduler.open_scheduler(options.get("scheduler"))
+        _viewports = capture_options.build_viewports(_viewports)
+        capture_options.clean_screenshot_options(**{
+            key: options.get(key) for key in (
+                "image_format", "quality", "clip", "element", "optimize",
+                "tiles", "max_height")})
+    except (ValueError, KeyError) as e:
+        raise click.UsageError(f"Invalid config: {e}")
+
+    queue = workqueue.WorkQueue(queue_path)
+    added = queue.enqueue(
+        sources.iter_urls(_urls, _url_sources), _viewports, options=options)
+    counts = queue.counts()
+    queue.close()
+    click.echo(f"Added {added} tasks to {queue_path} ({counts}).")
+    return 0
+
+
+@click.command()
+@click.option(
+    "-q",
+    "--queue",
+    "queue_path",
+    default="chutie.queue.sqlite",
+    help="Path of the SQLite work queue file. Default: chutie.queue.sqlite",
+)
+@click.option(
+    "-o",
+    "--dest-path",
+    default=".",
+    help=(
+        "Directory to write screenshots into (shared by the workers)."
+        " Default: ."
+    ),
+)
+@click.option(
+    "-j",
+    "--concurrency",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of tabs to take screenshots in at once. Default: 1",
+)
+@click.option(
+    "--worker-id",
+    default=None,
+    help="Name of this worker in the queue. Default: <hostname>-<pid>-...",
+)
+@click.option(
+    "--lease",
+    default=120,
+    type=click.FloatRange(min=1),
+    help=(
+        "Seconds after which the tasks of a worker that stopped sending"
+        " heartbeats are given to other workers. Default: 120"
+    ),
+)
+@click.option(
+    "--wait/--no-wait",
+    default=True,
+    help=(
+        "When there is nothing to claim, wait for other workers' tasks to"
+        " be done (or their leases to expire) instead of stopping."
+        " Default: --wait"
+    ),
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=2,
+    help=(
+        "Retry a url that fails to load (or whose tab or browser crashes)"
+        " this many times. Default: 2"
+    ),
+)
+@click.option(
+    "--browser-endpoint",
+    default=None,
+    help="Take screenshots in the running browser at this ws:// endpoint.",
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    help="Directory to cache screenshots of unchanged pages in.",
+)
+@click.option(
+    "--profile-dir",
+    default=None,
+    help=(
+        "Launch the browser with the persistent profile in this directory"
+        " (see `chutie screenshots --profile`)."
+    ),
+)
+@click.option(
+    "--asset-cache",
+    "asset_cache_size",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Serve repeated stylesheets, scripts, fonts and images from an"
+        " in-process cache of this many MB. Default: 0 (no asset cache)"
+    ),
+)
+def worker(queue_path, dest_path, concurrency, worker_id, lease, wait,
+           retries, browser_endpoint, cache_dir, profile_dir,
+           asset_cache_size):
+    """Take the screenshots of the tasks in a work queue"""
+    from syncer import sync
+
+    from chutie import workqueue
+
+    retry = None
+    if retries:
+        from chutie import recovery as capture_recovery
+        retry = capture_recovery.RetryPolicy(retries=retries)
+
+    queue = workqueue.WorkQueue(queue_path, lease=lease)
+    stats = sync(workqueue.run_worker(
+        queue, dest_path, worker=worker_id, concurrency=concurrency,
+        wait=wait, browser_endpoint=browser_endpoint, cache=cache_dir,
+        retry=retry, profile=profile_dir,
+        assets=asset_cache_size * 1024 ** 2))
+    counts = queue.counts()
+    queue.close()
+    click.echo(
+        f"Worker {stats['worker']} took {stats['screenshots']} screenshots"
+        f" of {stats['urls']} urls ({stats['failed']} failed); queue:"
+        f" {counts}.")
+    _echo_cache_ratios(stats)
+    return 0
+
+
+@click.command()
+@click.option(
+    "-q",
+    "--queue",
+    "queue_path",
+    default="chutie.queue.sqlite",
+    help="Path of the SQLite work queue file. Default: chutie.queue.sqlite",
+)
+@click.option(
+    "-o",
+    "--output",
+    default="chutie.json",
+    help=(
+        "Path to write the chutie.json to (in the directory the workers"
+        " wrote screenshots into). Default: chutie.json"
+    ),
+)
+def assemble(queue_path, output):
+    """Build a chutie.json from the finished tasks of a work queue"""
+    from chutie import workqueue
+
+    queue = workqueue.WorkQueue(queue_path)
+    context = queue.assemble(dest_path=Path(output).parent)
+    queue.close()
+    with open(output, "w") as _file:
+        json.dump(context, _file, indent=2)
+    counts = context["queue"]
+    click.echo(f"Wrote {counts['done']} done and {counts['failed']} failed"
+               f" tasks to {output}.")
+    unfinished = counts["pending"] + counts["leased"]
+    if unfinished:
+        click.echo(f"{unfinished} tasks are not done yet.")
+    return 0
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--store",
+    "store_path",
+    default="chutie.shots.sqlite",
+    help="Path of the screenshot store. Default: chutie.shots.sqlite",
+)
+@click.option(
+    "-d",
+    "--report-dir",
+    default=".",
+    help="Directory of the HTML report. Default: .",
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    help="Address to listen on. Default: 127.0.0.1",
+)
+@click.option(
+    "--port",
+    default=8000,
+    type=click.IntRange(min=0),
+    help="Port to listen on. Default: 8000",
+)
+def view(store_path, report_dir, host, port):
+    """Serve an HTML report with its screenshots read from a --store"""
+    from chutie import store
+
+    if not Path(store_path).is_file():
+        raise click.BadParameter(f"no such store: {store_path}")
+    server = store.report_server(store_path, report_dir, host=host, port=port)
+    host, port = server.server_address[:2]
+    click.echo(f"Serving {report_dir} on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--store",
+    "store_path",
+    default="chutie.shots.sqlite",
+    help="Path of the screenshot store. Default: chutie.shots.sqlite",
+)
+@click.option(
+    "-o",
+    "--dest-path",
+    default=".",
+    help=(
+        "Directory to write the screenshots into (next to the chutie.json,"
+        " so that their filenames resolve). Default: ."
+    ),
+)
+def extract(store_path, dest_path):
+    """Write the screenshots in a --store out as files"""
+    from chutie import store
+
+    if not Path(store_path).is_file():
+        raise click.BadParameter(f"no such store: {store_path}")
+    shots = store.ScreenshotStore(store_path)
+    count = shots.extract(dest_path)
+    shots.close()
+    click.echo(f"Extracted {count} screenshots into {dest_path}.")
+    return 0
+
+
 main.add_command(screenshots)
 main.add_command(template)
+main.add_command(compact)
+main.add_command(diff)
+main.add_command(dupes)
+main.add_command(thumbnails)
+main.add_command(serve)
+main.add_command(enqueue)
+main.add_command(worker)
+main.add_command(assemble)
+main.add_command(view)
+main.add_command(extract)
 
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
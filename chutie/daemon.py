@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+"""A daemon that keeps a pool of warm browsers and takes screenshots for
+clients over a Unix socket
+
+The protocol is one JSON object per line in each direction. Requests have
+an ``op``:
+
+* ``{"op": "capture", "urls": [...], "viewports": [...], "dest_path": ...,
+  "options": {...}}`` takes screenshots with ``get_screenshots`` in a pooled
+  browser and returns ``{"ok": true, "result": metadata}``
+* ``{"op": "endpoint"}`` returns the ``ws://`` DevTools endpoint of a pooled
+  browser, which stays leased to the client (and is not recycled or used
+  for captures) until it closes its connection (see ``lease_endpoint``)
+* ``{"op": "status"}`` returns browser and page counts
+* ``{"op": "shutdown"}`` closes the browsers and stops the daemon
+
+Errors are returned as ``{"ok": false, "error": "..."}``.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import socket
+
+from chutie import cache as capture_cache
+
+DEFAULT_BROWSERS = 1
+DEFAULT_RECYCLE_AFTER = 500
+
+# options of a capture request that are passed to get_screenshots
+CAPTURE_OPTIONS = (
+    "concurrency", "reload_per_viewport", "single_capture", "refresh_cache",
+    "journal", "resume", "intercept", "readiness", "deadline", "metrics",
+    "image_format", "quality", "clip", "element", "optimize", "retry",
+    "store", "assets", "prewarm", "tiles", "max_height", "scheduler",
+)
+
+_READ_LIMIT = 2 ** 26
+
+
+def default_socket_path():
+    """
+    Returns:
+        str: ``$XDG_RUNTIME_DIR/chutie.sock`` (default:
+            ``/tmp/chutie-<uid>.sock``)
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "chutie.sock")
+    return f"/tmp/chutie-{os.getuid()}.sock"
+
+
+class LeasedBrowser(object):
+    """A pooled browser that counts the pages opened in it, and that its
+    pool replaces with a new browser once it is due, even in the middle of
+    a capture request"""
+
+    def __init__(self, browser, pool=None):
+        """
+        Args:
+            browser (pyppeteer.browser.Browser): a running browser
+        Kwargs:
+            pool (BrowserPool or None): the pool that recycles it
+        """
+        self.browser = browser
+        self.pool = pool
+        self.pages = 0
+        # browser => number of its pages that are open
+        self._open = {}
+        self._lock = None
+
+    async def newPage(self):
+        if self.pool is not None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self.pool.due(self):
+                    await self.pool.recycle(self)
+        browser = self.browser
+        page = await browser.newPage()
+        self.pages += 1
+        self._open[browser] = self._open.get(browser, 0) + 1
+        close = page.close
+
+        async def _close(*args, **kwargs):
+            try:
+                return await close(*args, **kwargs)
+            finally:
+                await self._closed(browser)
+
+        page.close = _close
+        return page
+
+    async def _closed(self, browser):
+        self._open[browser] -= 1
+        if not self._open[browser]:
+            del self._open[browser]
+            if browser is not self.browser and self.pool is not None:
+                # the last page of a recycled browser
+                await self.pool.retire(browser)
+
+    def is_open(self, browser):
+        """
+        Returns:
+            bool: whether any page opened in ``browser`` is still open
+        """
+        return bool(self._open.get(browser))
+
+
+class BrowserPool(object):
+    """A fixed number of browsers, each replaced with a new one once it has
+    opened ``recycle_after`` pages"""
+
+    def __init__(self, size=DEFAULT_BROWSERS,
+                 recycle_after=DEFAULT_RECYCLE_AFTER, launcher=None,
+                 launch_options=None):
+        """
+        Kwargs:
+            size (int): number of browsers
+            recycle_after (int or None): close a browser and launch a new
+                one after it has opened this many pages
+            launcher (coroutine function or None): launches a browser
+                (default: ``pyppeteer.launch``)
+            launch_options (dict or None): passed to ``launcher``
+        """
+        self.size = size
+        self.recycle_after = recycle_after
+        self.launcher = launcher
+        self.launch_options = launch_options or {}
+        self.launched = 0
+        self.recycled = 0
+        self._browsers = []
+        self._retiring = []
+        self._idle = None
+
+    async def _launch(self):
+        launcher = self.launcher
+        if launcher is None:
+            from pyppeteer import launch as launcher
+        self.launched += 1
+        return await launcher(**self.launch_options)
+
+    async def start(self):
+        """Launch the browsers"""
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            leased = LeasedBrowser(await self._launch(), pool=self)
+            self._browsers.append(leased)
+            self._idle.put_nowait(leased)
+
+    async def acquire(self):
+        """
+        Returns:
+            LeasedBrowser: an idle browser (waiting for one if needed)
+        """
+        return await self._idle.get()
+
+    async def release(self, leased):
+        """Return a browser to the pool"""
+        self._idle.put_nowait(leased)
+
+    def due(self, leased):
+        """
+        Returns:
+            bool: whether ``leased`` has opened ``recycle_after`` pages
+        """
+        return (self.recycle_after is not None
+                and leased.pages >= self.recycle_after)
+
+    async def recycle(self, leased):
+        """Launch a new browser for ``leased`` to open pages in, and close
+        the old one once its last open page is closed"""
+        browser = leased.browser
+        leased.browser = await self._launch()
+        leased.pages = 0
+        self.recycled += 1
+        if leased.is_open(browser):
+            self._retiring.append(browser)
+        else:
+            await self._close_browser(browser)
+
+    async def retire(self, browser):
+        """Close a recycled browser whose pages have all been closed"""
+        if browser in self._retiring:
+            self._retiring.remove(browser)
+            await self._close_browser(browser)
+
+    async def _close_browser(self, browser):
+        try:
+            await browser.close()
+        except Exception:
+            logging.getLogger().warning(
+                "could not close a recycled browser", exc_info=True)
+
+    def status(self):
+        return dict(
+            browsers=len(self._browsers),
+            idle=self._idle.qsize() if self._idle is not None else 0,
+            pages=[leased.pages for leased in self._browsers],
+            launched=self.launched,
+            recycled=self.recycled,
+            recycle_after=self.recycle_after,
+        )
+
+    async def close(self):
+        """Close every browser"""
+        browsers, self._browsers = self._browsers, []
+        retiring, self._retiring = self._retiring, []
+        for browser in retiring:
+            await self._close_browser(browser)
+        for leased in browsers:
+            await leased.browser.close()
+
+
+def _capture_options(options):
+    """
+    Args:
+        options (dict): capture request options
+    Returns:
+        dict: ``get_screenshots`` kwargs
+    Raises:
+        ValueError: on an unknown option
+    """
+    options = dict(options or {})
+    unknown = set(options) - set(CAPTURE_OPTIONS) - {"cache"}
+    if unknown:
+        raise ValueError(f"unknown capture options: {', '.join(unknown)}")
+    cache = options.pop("cache", None)
+    if cache is not None:
+        # a dict of CaptureCache arguments
+        options["cache"] = capture_cache.CaptureCache(**cache)
+    return options
+
+
+class Daemon(object):
+    """Serve capture requests on a Unix socket with a ``BrowserPool``"""
+
+    def __init__(self, socket_path=None, pool=None):
+        """
+        Kwargs:
+            socket_path (str or None): (default: ``default_socket_path()``)
+            pool (BrowserPool or None): (default: ``BrowserPool()``)
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.pool = pool or BrowserPool()
+        self.server = None
+        self._stopped = None
+
+    async def start(self):
+        """Launch the browsers and listen on the socket"""
+        self._stopped = asyncio.Event()
+        await self.pool.start()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(
+            self._handle, path=self.socket_path, limit=_READ_LIMIT)
+        os.chmod(self.socket_path, 0o600)
+
+    async def wait_closed(self):
+        """Wait for a shutdown request, then close the browsers"""
+        await self._stopped.wait()
+        self.server.close()
+        await self.server.wait_closed()
+        await self.pool.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        # browsers leased to this client by endpoint requests
+        leases = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.dispatch(
+                        json.loads(line), leases=leases)
+                except Exception as e:
+                    logging.getLogger().warning(
+                        "chutie serve: request failed", exc_info=True)
+                    response = {
+                        "ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+            for leased in leases:
+                await self.pool.release(leased)
+
+    async def dispatch(self, request, leases=None):
+        """
+        Args:
+            request (dict): a request (see the module docstring)
+        Kwargs:
+            leases (list or None): browsers leased by ``endpoint`` requests
+                are appended to this list, to be released when the client
+                disconnects (default: None, release them right away)
+        Returns:
+            dict: the response
+        """
+        from chutie import chutie
+
+        op = request.get("op")
+        if op == "capture":
+            options = _capture_options(request.get("options"))
+            leased = await self.pool.acquire()
+            try:
+                result = await chutie.get_screenshots(
+                    request["urls"], request["viewports"],
+                    request.get("dest_path", "."), browser=leased, **options)
+            finally:
+                await self.pool.release(leased)
+            return {"ok": True, "result": result}
+        if op == "endpoint":
+            leased = await self.pool.acquire()
+            if leases is None:
+                await self.pool.release(leased)
+            else:
+                leases.append(leased)
+            return {"ok": True, "endpoint": leased.browser.wsEndpoint}
+        if op == "status":
+            return dict(self.pool.status(), ok=True)
+        if op == "shutdown":
+            self.stop()
+            return {"ok": True}
+        raise ValueError(f"unknown op: {op!r}")
+
+
+def serve(socket_path=None, browsers=DEFAULT_BROWSERS,
+          recycle_after=DEFAULT_RECYCLE_AFTER):
+    """Run a daemon until it gets a shutdown request
+
+    Kwargs:
+        socket_path (str or None): (default: ``default_socket_path()``)
+        browsers (int): number of browsers to keep running
+        recycle_after (int or None): replace a browser after it has opened
+            this many pages
+    """
+    daemon = Daemon(socket_path, BrowserPool(browsers, recycle_after))
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(daemon.start())
+    try:
+        loop.run_until_complete(daemon.wait_closed())
+    except KeyboardInterrupt:
+        loop.run_until_complete(daemon.pool.close())
+
+
+def _request(sock, message):
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+    with sock.makefile("rb") as _file:
+        line = _file.readline()
+    if not line:
+        raise RuntimeError("the chutie daemon closed the connection")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error"))
+    return response
+
+
+def request(message, socket_path=None, timeout=None):
+    """Send a request to a daemon and wait for the response
+
+    Args:
+        message (dict): a request (see the module docstring)
+    Kwargs:
+        socket_path (str or None): (default: ``default_socket_path()``)
+        timeout (float or None): socket timeout in seconds
+    Returns:
+        dict: the response
+    Raises:
+        OSError: if the daemon is not running
+        RuntimeError: if the daemon returned an error
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        return _request(sock, message)
+
+
+@contextlib.contextmanager
+def lease_endpoint(socket_path=None, timeout=None):
+    """Lease one of a daemon's browsers for the duration of a ``with``
+    block (e.g. to ``pyppeteer.connect`` to it)
+
+    Kwargs:
+        socket_path (str or None): (default: ``default_socket_path()``)
+        timeout (float or None): socket timeout in seconds
+    Yields:
+        str: the ``ws://`` DevTools endpoint of the browser
+    Raises:
+        OSError: if the daemon is not running
+        RuntimeError: if the daemon returned an error
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        yield _request(sock, {"op": "endpoint"})["endpoint"]
+
+
+def capture(urls, viewports, dest_path=".", socket_path=None, **options):
+    """Take screenshots in a daemon's browsers
+
+    Args:
+        urls (list[str or dict]): see ``get_screenshots``
+        viewports (list[str]): see ``get_screenshots``
+    Kwargs:
+        dest_path (str): directory to write screenshots into (relative to
+            the current directory, not the daemon's)
+        socket_path (str or None): (default: ``default_socket_path()``)
+        options: ``CAPTURE_OPTIONS`` and ``cache``, a dict of
+            ``CaptureCache`` arguments (``retry`` is a dict of
+            ``RetryPolicy`` arguments; a pooled browser is not restarted)
+    Returns:
+        dict: metadata as returned by ``get_screenshots``
+    """
+    for key in ("journal", "store"):
+        if options.get(key):
+            options[key] = os.path.abspath(str(options[key]))
+    metadata = request(dict(
+        op="capture", urls=urls, viewports=viewports,
+        dest_path=os.path.abspath(str(dest_path)), options=options),
+        socket_path=socket_path)["result"]
+    # paths relative to dest_path as given, as get_screenshots makes them
+    for datas in metadata["pages"].values():
+        for data in datas:
+            if data.get("filename") and not data.get("store"):
+                data["path"] = os.path.join(str(dest_path), data["filename"])
+    return metadata
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+"""Visual diffs between the screenshots of two chutie runs
+
+Requires numpy and Pillow (``pip install chutie[diff]``).
+"""
+
+import collections
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+
+from chutie import png
+from chutie import tiles as capture_tiles
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_AA_TOLERANCE = 1
+DEFAULT_BAND_ROWS = 256
+
+# (r, g, b, a) of differing pixels in diff masks
+DIFF_COLOR = (255, 0, 0, 255)
+
+
+def screenshot_key(data):
+    """
+    Args:
+        data (dict): a screenshot metadata dict from a chutie.json
+    Returns:
+        tuple: ``(url, pathstr, fullPage)``
+    """
+    return (data["url"], data.get("pathstr"), bool(data.get("fullPage")))
+
+
+def screenshot_path(data, jsonpath):
+    """
+    Args:
+        data (dict): a screenshot metadata dict from a chutie.json
+        jsonpath (str): path of the chutie.json
+    Returns:
+        Path: the screenshot file, next to the chutie.json
+    """
+    return Path(jsonpath).parent / data["filename"]
+
+
+def mask_name(filename):
+    """
+    Args:
+        filename (str): name of the first run's screenshot
+    Returns:
+        str: name of its diff mask (a PNG, whatever the screenshot format)
+    """
+    return "diff__" + os.path.splitext(filename)[0] + ".png"
+
+
+def pair_screenshots(context_a, context_b):
+    """Pair the screenshots of two runs by url, viewport and fullPage
+
+    Args:
+        context_a (dict): chutie.json metadata of the first run
+        context_b (dict): chutie.json metadata of the second run
+    Returns:
+        tuple: ``(pairs, only_a, only_b)``: a list of ``(data_a, data_b)``
+            pairs in the order of ``context_a``, and lists of the
+            screenshots that are only in one of the runs
+    """
+    def index(context):
+        return collections.OrderedDict(
+            (screenshot_key(data), data)
+            for datas in context["pages"].values()
+            for data in datas
+            if data.get("filename"))
+
+    index_a, index_b = index(context_a), index(context_b)
+    pairs = [(data, index_b[key]) for key, data in index_a.items()
+             if key in index_b]
+    only_a = [data for key, data in index_a.items() if key not in index_b]
+    only_b = [data for key, data in index_b.items() if key not in index_a]
+    return pairs, only_a, only_b
+
+
+def pair_files(data_a, data_b):
+    """Pair the image files of a pair of screenshots: the screenshots
+    themselves, or their tiles in order if either was taken with
+    ``tiles="files"``
+
+    Args:
+        data_a (dict): a screenshot metadata dict of the first run
+        data_b (dict): the same screenshot in the second run
+    Returns:
+        list[tuple]: ``(file_a, file_b, tile)``: metadata dicts with a
+            ``filename`` (None if the other screenshot has more tiles) and
+            the tile number (from 1), or None if neither is tiled
+    """
+    files_a = capture_tiles.screenshot_files(data_a)
+    files_b = capture_tiles.screenshot_files(data_b)
+    if files_a == [data_a] and files_b == [data_b]:
+        return [(data_a, data_b, None)]
+    return [(file_a, file_b, n) for n, (file_a, file_b) in enumerate(
+        itertools.zip_longest(files_a, files_b), 1)]
+
+
+def _rgba_bands(path, rows):
+    """Yield ``(h, w, 4)`` int16 arrays of a PNG's pixels, band by band"""
+    import numpy as np
+    for band in png.iter_bands(str(path), rows=rows):
+        yield np.asarray(band.convert("RGBA"), dtype=np.int16)
+
+
+def _with_context(bands, radius):
+    """
+    Yields:
+        tuple: ``(context, above, height)`` for each band: the band's
+            pixels with up to ``radius`` rows of the previous and next bands
+            above and below it, how many rows were added above, and the
+            band's own height
+    """
+    import numpy as np
+    previous = None
+    iterator = iter(bands)
+    current = next(iterator, None)
+    while current is not None:
+        following = next(iterator, None)
+        parts, above = [], 0
+        if previous is not None and radius:
+            parts.append(previous[-radius:])
+            above = parts[0].shape[0]
+        parts.append(current)
+        if following is not None and radius:
+            parts.append(following[:radius])
+        yield np.concatenate(parts), above, current.shape[0]
+        previous, current = current, following
+
+
+def _unmatched(band, context, above, radius, tolerance):
+    """
+    Args:
+        band (numpy.ndarray): ``(h, w, 4)`` pixels of one image
+        context (numpy.ndarray): ``(>= h, w, 4)`` pixels of the other image
+            (with ``above`` extra rows above ``band``)
+    Returns:
+        numpy.ndarray: ``(h, w)`` boolean mask of the pixels in ``band``
+            with no matching pixel within ``radius`` in ``context``
+    """
+    import numpy as np
+    height, width = band.shape[:2]
+    padded = np.full(
+        (height + 2 * radius, width + 2 * radius, 4), -1024, dtype=np.int16)
+    top = radius - above
+    rows = min(context.shape[0], padded.shape[0] - top)
+    padded[top:top + rows, radius:radius + width] = context[:rows, :width]
+    unmatched = np.ones((height, width), dtype=bool)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            shifted = padded[radius + dy:radius + dy + height,
+                             radius + dx:radius + dx + width]
+            unmatched &= np.abs(band - shifted).max(axis=2) > tolerance
+            if not unmatched.any():
+                return unmatched
+    return unmatched
+
+
+def _band_diff(band_a, band_b, radius, tolerance):
+    """
+    Args:
+        band_a (tuple): ``(context, above, height)`` for a band of the
+            first image, as yielded by ``_with_context``
+        band_b (tuple): the same for the second image (which may have
+            fewer or more rows)
+        radius (int): anti-aliasing tolerance in pixels: a pixel is not
+            counted as different if each image has a matching pixel within
+            this distance of it in the other
+        tolerance (float): maximum per-channel difference (0-255) for two
+            pixels to match
+    Returns:
+        numpy.ndarray: ``(h, w)`` boolean mask of differing pixels, where
+            ``h`` is the taller band's height and ``w`` the narrower width;
+            rows missing from either image are all different
+    """
+    import numpy as np
+    context_a, above_a, height = band_a
+    context_b, above_b, height_b = band_b
+    width = min(context_a.shape[1], context_b.shape[1])
+    pixels_a = context_a[above_a:above_a + height, :width]
+    pixels_b = context_b[above_b:above_b + height_b, :width]
+
+    rows = min(height, height_b)
+    pixels_a, pixels_b = pixels_a[:rows], pixels_b[:rows]
+
+    diff = np.ones((max(height, height_b), width), dtype=bool)
+    common = diff[:rows]
+    common[:] = np.abs(pixels_a - pixels_b).max(axis=2) > tolerance
+    if radius and common.any():
+        common &= (
+            _unmatched(pixels_a, context_b[:, :width], above_b,
+                       radius, tolerance)
+            | _unmatched(pixels_b, context_a[:, :width], above_a,
+                         radius, tolerance))
+    return diff
+
+
+def diff_images(path_a, path_b, mask_path=None,
+                threshold=DEFAULT_THRESHOLD, aa_tolerance=DEFAULT_AA_TOLERANCE,
+                band_rows=DEFAULT_BAND_ROWS):
+    """Compare two PNG screenshots band by band
+
+    Args:
+        path_a (str): path to the first PNG
+        path_b (str): path to the second PNG
+    Kwargs:
+        mask_path (str or None): if specified, write a PNG of the first
+            image (faded) with differing pixels in ``DIFF_COLOR`` here
+        threshold (float): per-channel color difference (0.0 - 1.0) above
+            which two pixels differ
+        aa_tolerance (int): anti-aliasing tolerance in pixels (0 disables)
+        band_rows (int): number of rows to decode at a time
+    Returns:
+        dict: ``width``, ``height``, ``different_pixels``,
+            ``total_pixels`` and ``score`` (the fraction of differing pixels;
+            pixels outside of the smaller image count as different)
+    """
+    import numpy as np
+
+    with open(path_a, "rb") as _file:
+        header_a = png.read_header(_file.read(33))
+    with open(path_b, "rb") as _file:
+        header_b = png.read_header(_file.read(33))
+    width = max(header_a["width"], header_b["width"])
+    height = max(header_a["height"], header_b["height"])
+    tolerance = threshold * 255
+    radius = int(aa_tolerance)
+
+    writer = mask_file = None
+    if mask_path:
+        mask_file = open(mask_path, "wb")
+        writer = png.PNGWriter(mask_file, width, height)
+
+    different = 0
+    rows_done = 0
+    try:
+        bands_a = _with_context(_rgba_bands(path_a, band_rows), radius)
+        bands_b = _with_context(_rgba_bands(path_b, band_rows), radius)
+        empty = (np.zeros((0, 0, 4), dtype=np.int16), 0, 0)
+        for band_a in bands_a:
+            band_b = next(bands_b, empty)
+            diff = _band_diff(band_a, band_b, radius, tolerance)
+            context_a, above_a, height_a = band_a
+            pixels_a = context_a[above_a:above_a + height_a]
+            # the second image's band may be taller than the first's last
+            band_height = diff.shape[0]
+            # pixels past the right edge of the narrower image
+            extra_width = width - diff.shape[1]
+            different += int(diff.sum()) + band_height * extra_width
+            if writer is not None:
+                mask = np.zeros((band_height, width, 4), dtype=np.uint8)
+                mask[:height_a, :pixels_a.shape[1]] = pixels_a // 4 + 191
+                mask[..., 3] = 255
+                mask[:, :diff.shape[1]][diff] = DIFF_COLOR
+                mask[:, diff.shape[1]:] = DIFF_COLOR
+                writer.write_rows(mask)
+            rows_done += band_height
+        # rows past the bottom of the first image
+        extra_rows = height - rows_done
+        different += extra_rows * width
+        if writer is not None and extra_rows:
+            row = np.tile(np.array(DIFF_COLOR, dtype=np.uint8), width)
+            writer.write_rows(row for _ in range(extra_rows))
+        if writer is not None:
+            writer.close()
+    finally:
+        if mask_file is not None:
+            mask_file.close()
+
+    total = width * height
+    return dict(
+        width=width,
+        height=height,
+        different_pixels=different,
+        total_pixels=total,
+        score=(different / total) if total else 0.0,
+    )
+
+
+def _diff_pair(args):
+    """Diff one pair of screenshots (run in a worker process)"""
+    path_a, path_b, mask_path, options = args
+    if path_a is None or path_b is None:
+        return {"error": "the screenshots have a different number of tiles"}
+    if not (path_a.endswith(".png") and path_b.endswith(".png")):
+        # e.g. a run taken with --format jpeg
+        return {"error": "only PNG screenshots can be diffed"}
+    try:
+        return diff_images(path_a, path_b, mask_path=mask_path, **options)
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning("could not diff %s %s: %s",
+                                    path_a, path_b, e)
+        return {"error": str(e)}
+
+
+def diff_runs(jsonpath_a, jsonpath_b, output_dir="chutie-diff",
+              threshold=DEFAULT_THRESHOLD, aa_tolerance=DEFAULT_AA_TOLERANCE,
+              band_rows=DEFAULT_BAND_ROWS, processes=None):
+    """Diff every screenshot that is in both of two chutie runs
+
+    Args:
+        jsonpath_a (str): path to the first run's chutie.json
+        jsonpath_b (str): path to the second run's chutie.json
+    Kwargs:
+        output_dir (str): directory to write diff masks and ``diff.json`` to
+        threshold (float): see ``diff_images``
+        aa_tolerance (int): see ``diff_images``
+        band_rows (int): see ``diff_images``
+        processes (int or None): number of worker processes
+            (default: ``os.cpu_count()``)
+    Returns:
+        dict: the ``diff.json`` result, with one entry per pair (or pair
+            of tiles, see ``pair_files``) in ``pairs`` and the unpaired
+            screenshots in ``only_a``/``only_b``
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with open(jsonpath_a) as _file:
+        context_a = json.load(_file)
+    with open(jsonpath_b) as _file:
+        context_b = json.load(_file)
+    pairs, only_a, only_b = pair_screenshots(context_a, context_b)
+
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    options = dict(threshold=threshold, aa_tolerance=aa_tolerance,
+                   band_rows=band_rows)
+    files = [(data_a, data_b, file_a, file_b, tile)
+             for data_a, data_b in pairs
+             for file_a, file_b, tile in pair_files(data_a, data_b)]
+    tasks = [
+        (str(screenshot_path(file_a, jsonpath_a)) if file_a else None,
+         str(screenshot_path(file_b, jsonpath_b)) if file_b else None,
+         str(output / mask_name((file_a or file_b)["filename"])),
+         options)
+        for data_a, data_b, file_a, file_b, tile in files]
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(tasks) <= 1:
+        scores = [_diff_pair(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            scores = list(executor.map(_diff_pair, tasks, chunksize=4))
+
+    results = []
+    for (data_a, data_b, file_a, file_b, tile), task, score in zip(
+            files, tasks, scores):
+        url, pathstr, fullPage = screenshot_key(data_a)
+        result = collections.OrderedDict([
+            ("url", url),
+            ("pathstr", pathstr),
+            ("fullPage", fullPage),
+            ("a", task[0]),
+            ("b", task[1]),
+        ])
+        if tile is not None:
+            result["tile"] = tile
+        if "error" not in score:
+            result["mask"] = task[2]
+        result.update(score)
+        results.append(result)
+
+    diff = collections.OrderedDict([
+        ("a", str(jsonpath_a)),
+        ("b", str(jsonpath_b)),
+        ("threshold", threshold),
+        ("aa_tolerance", aa_tolerance),
+        ("pairs", results),
+        ("only_a", [screenshot_key(data) for data in only_a]),
+        ("only_b", [screenshot_key(data) for data in only_b]),
+    ])
+    with open(output / "diff.json", "w") as _file:
+        json.dump(diff, _file, indent=2)
+    return diff
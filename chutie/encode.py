@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Encoding screenshots as PNG, JPEG or WebP and writing them to disk
+
+These functions are run in an executor with the raw screenshot bytes from
+the browser, so that encoding and disk writes don't block the event loop.
+Transcoding (WebP, or JPEG cropped from a full page PNG) and PNG
+optimization require Pillow (``pip install chutie[encode]``).
+"""
+
+import importlib.util
+import io
+import os
+
+IMAGE_FORMATS = ("png", "jpeg", "webp")
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+DEFAULT_QUALITY = {"jpeg": 80, "webp": 80}
+
+# keys of a viewport dict's "screenshot" dict and of get_screenshots kwargs
+SCREENSHOT_OPTIONS = ("image_format", "quality", "clip", "element", "optimize",
+                      "tiles", "max_height")
+
+# full page screenshot modes (see chutie.tiles)
+TILE_MODES = ("files", "stitch")
+
+
+def screenshot_options(run_options, viewport):
+    """
+    Args:
+        run_options (dict): the run's screenshot options
+        viewport (dict): a viewport dict, whose ``screenshot`` dict (if any)
+            overrides ``run_options``
+    Returns:
+        dict: ``image_format``, ``quality``, ``clip``, ``element``,
+            ``optimize``, ``tiles`` and ``max_height``
+    Raises:
+        ValueError: on an unknown option, image format or tile mode
+    """
+    options = dict(image_format="png", quality=None, clip=None,
+                   element=None, optimize=False, tiles=None, max_height=None)
+    for source in (run_options, viewport.get("screenshot") or {}):
+        for key, value in source.items():
+            if key not in SCREENSHOT_OPTIONS:
+                raise ValueError(f"unknown screenshot option: {key}")
+            if value is not None:
+                options[key] = value
+    if options["image_format"] not in IMAGE_FORMATS:
+        raise ValueError(
+            f"image_format must be one of {', '.join(IMAGE_FORMATS)}:"
+            f" {options['image_format']!r}")
+    if options["tiles"] is not None and options["tiles"] not in TILE_MODES:
+        raise ValueError(
+            f"tiles must be one of {', '.join(TILE_MODES)}:"
+            f" {options['tiles']!r}")
+    return options
+
+
+def needs_pillow(options, crop=False):
+    """
+    Args:
+        options (dict): screenshot options (see ``screenshot_options``)
+    Kwargs:
+        crop (bool): whether screenshots are cropped from a full page
+            screenshot (``single_capture``)
+    Returns:
+        bool: whether taking screenshots with ``options`` requires Pillow
+    """
+    image_format = options.get("image_format") or "png"
+    return bool(
+        image_format == "webp"
+        or (image_format == "jpeg" and crop)
+        or options.get("optimize")
+        or options.get("tiles") == "stitch")
+
+
+def have_pillow():
+    """
+    Returns:
+        bool: whether Pillow is installed
+    """
+    return importlib.util.find_spec("PIL") is not None
+
+
+def browser_type(image_format, crop=False):
+    """
+    Args:
+        image_format (str): the format to write
+    Kwargs:
+        crop (bool): whether the image will be cropped with
+            ``chutie.png.crop_top`` (which needs a PNG)
+    Returns:
+        str: the ``type`` to ask the browser for (``png`` or ``jpeg``)
+    """
+    return "jpeg" if image_format == "jpeg" and not crop else "png"
+
+
+def encode_screenshot(data, image_format="png", quality=None,
+                      optimize=False, crop_height=None):
+    """
+    Args:
+        data (bytes): a PNG or JPEG screenshot
+    Kwargs:
+        image_format (str): one of ``IMAGE_FORMATS``
+        quality (int or None): JPEG/WebP quality (1-100)
+        optimize (bool): recompress PNGs as small as possible
+        crop_height (int or None): crop a PNG to its top ``crop_height`` rows
+    Returns:
+        bytes: the encoded image
+    """
+    from chutie import png
+
+    is_png = data[:8] == png.PNG_SIGNATURE
+    if crop_height is not None:
+        data = png.crop_top(data, crop_height)
+    if image_format == "png" and not optimize:
+        return data
+    if image_format == "jpeg" and not is_png:
+        return data
+
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    output = io.BytesIO()
+    if image_format == "png":
+        image.save(output, "PNG", optimize=True)
+    else:
+        if image_format == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(output, image_format.upper(),
+                   quality=quality or DEFAULT_QUALITY[image_format])
+    return output.getvalue()
+
+
+def write_screenshot(data, path, **encode_options):
+    """Encode a screenshot and write it to ``path``
+
+    Args:
+        data (bytes): a PNG or JPEG screenshot
+        path (str): path to write to (an existing file is replaced, not
+            written through, in case it is a hardlink to a duplicate)
+    Kwargs:
+        encode_options: see ``encode_screenshot``
+    Returns:
+        int: number of bytes written
+    """
+    data = encode_screenshot(data, **encode_options)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as _file:
+        _file.write(data)
+    return len(data)
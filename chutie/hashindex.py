@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+"""Exact and perceptual hashes of screenshots, and an index of them for
+finding duplicate and near-duplicate screenshots
+
+Requires numpy and Pillow (``pip install chutie[dedupe]``).
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from chutie import png
+from chutie import tiles as capture_tiles
+
+INDEX_FILENAME = "chutie.hashes.json"
+
+# dHash grid: HASH_ROWS x (HASH_COLS + 1) cells => HASH_ROWS * HASH_COLS bits
+HASH_ROWS = 8
+HASH_COLS = 8
+
+
+def hamming(a, b):
+    """
+    Args:
+        a (int): hash
+        b (int): hash
+    Returns:
+        int: number of differing bits
+    """
+    return bin(a ^ b).count("1")
+
+
+def hash_image(path, band_rows=256):
+    """Compute the exact and perceptual hashes of a PNG in one banded pass
+
+    The exact hash is a sha256 of the image size and its RGBA pixels. The
+    perceptual hash is a 64-bit difference hash (dHash): the image is
+    averaged into an 8 x 9 grayscale grid and each bit records whether a
+    cell is darker than its right-hand neighbour.
+
+    Args:
+        path (str): path to a PNG
+    Kwargs:
+        band_rows (int): number of rows to decode at a time
+    Returns:
+        dict: ``sha256`` (hex str) and ``phash`` (hex str, 16 digits)
+    """
+    import numpy as np
+
+    with open(path, "rb") as _file:
+        header = png.read_header(_file.read(33))
+    width, height = header["width"], header["height"]
+    sha256 = hashlib.sha256(f"{width}x{height}".encode("ascii"))
+    ncols = HASH_COLS + 1
+    col_cells = (np.arange(width) * ncols) // max(width, 1)
+    sums = np.zeros(HASH_ROWS * ncols)
+    counts = np.zeros(HASH_ROWS * ncols)
+    y = 0
+    for band in png.iter_bands(str(path), rows=band_rows):
+        sha256.update(band.convert("RGBA").tobytes())
+        gray = np.asarray(band.convert("L"), dtype=np.float64)
+        row_cells = ((np.arange(y, y + gray.shape[0]) * HASH_ROWS)
+                     // max(height, 1))
+        cells = (row_cells[:, None] * ncols + col_cells[None, :]).ravel()
+        sums += np.bincount(cells, weights=gray.ravel(),
+                            minlength=sums.size)
+        counts += np.bincount(cells, minlength=counts.size)
+        y += gray.shape[0]
+
+    means = (sums / np.maximum(counts, 1)).reshape(HASH_ROWS, ncols)
+    bits = (means[:, :-1] < means[:, 1:]).ravel()
+    phash = 0
+    for bit in bits:
+        phash = (phash << 1) | int(bit)
+    return dict(sha256=sha256.hexdigest(), phash=f"{phash:016x}")
+
+
+class BKTree(object):
+    """A BK-tree of integer hashes under the Hamming distance
+
+    Queries for all items within distance ``k`` only visit subtrees whose
+    edge distance is within ``k`` of the query's distance to their parent
+    (by the triangle inequality), instead of comparing against every item.
+    """
+
+    def __init__(self, distance=hamming):
+        self.distance = distance
+        self.root = None
+        self.size = 0
+
+    def add(self, key, item):
+        """
+        Args:
+            key (int): hash
+            item (object): value to return from ``search``
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = (key, [item], {})
+            return
+        node = self.root
+        while True:
+            node_key, items, children = node
+            distance = self.distance(key, node_key)
+            if distance == 0:
+                items.append(item)
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (key, [item], {})
+                return
+            node = child
+
+    def search(self, key, k):
+        """
+        Args:
+            key (int): hash to search for
+            k (int): maximum distance
+        Returns:
+            list[tuple]: ``(distance, item)`` for every item within ``k``,
+                nearest first
+        """
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node_key, items, children = stack.pop()
+            distance = self.distance(key, node_key)
+            if distance <= k:
+                found.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - k <= edge <= distance + k:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class HashIndex(object):
+    """Exact and perceptual hashes of the screenshots of a run"""
+
+    def __init__(self, entries=None):
+        """
+        Kwargs:
+            entries (list[dict] or None): dicts with ``filename``, ``url``,
+                ``pathstr``, ``fullPage``, ``sha256`` and ``phash``
+        """
+        self.entries = []
+        self.by_sha256 = collections.OrderedDict()
+        self.tree = BKTree()
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.by_sha256.setdefault(entry["sha256"], []).append(entry)
+        self.tree.add(int(entry["phash"], 16), entry)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Args:
+            path (str): path to a ``chutie.hashes.json``
+        Returns:
+            HashIndex
+        """
+        with open(path) as _file:
+            return cls(json.load(_file)["entries"])
+
+    def save(self, path):
+        with open(path, "w") as _file:
+            json.dump({"entries": self.entries}, _file, indent=2)
+
+    def duplicates(self):
+        """
+        Returns:
+            list[list[dict]]: groups of entries with identical pixels
+        """
+        return [group for group in self.by_sha256.values() if len(group) > 1]
+
+    def near(self, phash, k=4):
+        """
+        Args:
+            phash (str or int): perceptual hash (hex str or int)
+        Kwargs:
+            k (int): maximum Hamming distance (default: 4)
+        Returns:
+            list[tuple]: ``(distance, entry)`` nearest first
+        """
+        if isinstance(phash, str):
+            phash = int(phash, 16)
+        return self.tree.search(phash, k)
+
+    def near_duplicates(self, k=4):
+        """
+        Kwargs:
+            k (int): maximum Hamming distance (default: 4)
+        Returns:
+            list[tuple]: ``(distance, entry_a, entry_b)`` for each pair of
+                entries within ``k`` of each other
+        """
+        position = {id(entry): n for n, entry in enumerate(self.entries)}
+        pairs = []
+        for n, entry in enumerate(self.entries):
+            for distance, other in self.near(entry["phash"], k):
+                if position[id(other)] > n:
+                    pairs.append((distance, entry, other))
+        pairs.sort(key=lambda pair: pair[0])
+        return pairs
+
+
+def _link_duplicate(original, duplicate):
+    """Replace ``duplicate`` with a hardlink to ``original``
+
+    Returns:
+        bool: True if the file was linked
+    """
+    tmppath = str(duplicate) + ".tmplink"
+    try:
+        os.link(str(original), tmppath)
+        os.replace(tmppath, str(duplicate))
+        return True
+    except OSError:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        return False
+
+
+def _hash_screenshot(path):
+    try:
+        return hash_image(path)
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning("could not hash %s: %s", path, e)
+        return None
+
+
+def index_screenshots(context, dest_path=".", link=True, processes=None):
+    """Hash every screenshot of a run, write ``chutie.hashes.json`` next
+    to them and store exact duplicates once
+
+    Each screenshot's metadata dict (or each tile's, for a screenshot
+    taken with ``tiles="files"``) gets ``sha256`` and ``phash`` keys;
+    exact duplicates also get ``duplicate_of`` (the filename of the first
+    screenshot with the same pixels) and, if ``link`` is True, their file
+    is replaced with a hardlink to it.
+
+    Args:
+        context (dict): metadata as returned by ``get_screenshots``
+    Kwargs:
+        dest_path (str): directory the screenshots are in
+        link (bool): hardlink exact duplicates (default: True)
+        processes (int or None): number of worker processes
+            (default: ``os.cpu_count()``)
+    Returns:
+        HashIndex
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    dest = Path(dest_path)
+    datas = [(data, item) for pageset in context["pages"].values()
+             for data in pageset if data.get("filename")
+             for item in capture_tiles.screenshot_files(data)]
+    paths = [str(dest / item["filename"]) for data, item in datas]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(paths) <= 1:
+        hashes = [_hash_screenshot(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            hashes = list(executor.map(_hash_screenshot, paths, chunksize=8))
+
+    index = HashIndex()
+    for (data, item), path, hashed in zip(datas, paths, hashes):
+        if hashed is None:
+            continue
+        item.update(hashed)
+        originals = index.by_sha256.get(hashed["sha256"])
+        if originals:
+            original = originals[0]["filename"]
+            item["duplicate_of"] = original
+            if link:
+                _link_duplicate(dest / original, path)
+        index.add(collections.OrderedDict([
+            ("filename", item["filename"]),
+            ("url", data["url"]),
+            ("pathstr", data.get("pathstr")),
+            ("fullPage", bool(data.get("fullPage"))),
+            ("sha256", hashed["sha256"]),
+            ("phash", hashed["phash"]),
+        ]))
+    index.save(str(dest / INDEX_FILENAME))
+    return index
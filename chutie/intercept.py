@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+"""Request interception profiles for blocking resources that don't matter
+for layout screenshots (third-party scripts, trackers, media, web fonts)"""
+
+import collections
+from urllib.parse import urlsplit
+
+# Rough average transfer sizes (bytes) of one response of each resource
+# type, used to estimate how many bytes blocking a request saved
+AVERAGE_BYTES = {
+    "document": 30000,
+    "stylesheet": 15000,
+    "script": 30000,
+    "image": 25000,
+    "media": 500000,
+    "font": 30000,
+    "xhr": 5000,
+    "fetch": 5000,
+    "other": 5000,
+}
+
+# schemes that never go to the network
+_LOCAL_SCHEMES = ("data", "blob", "about")
+
+
+# second-level labels under which country code TLDs register names
+# (``example.co.uk``, ``example.com.au``, ``example.ne.jp``)
+_SECOND_LEVEL_LABELS = frozenset((
+    "ac", "co", "com", "edu", "gob", "gov", "go", "ltd", "mil", "ne",
+    "net", "nic", "or", "org", "plc", "sch",
+))
+
+
+def _guess_site(host):
+    """
+    Returns:
+        str: the registrable domain of a host name, guessed without a
+            public suffix list: the last two labels (``www.example.com`` =>
+            ``example.com``), or three under a country code second-level
+            domain (``www.example.co.uk`` => ``example.co.uk``), or the host
+            itself if it is an IP address
+    """
+    labels = host.split(".")
+    if len(labels) <= 2 or labels[-1].isdigit():
+        return host
+    if len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL_LABELS:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _site(host):
+    """
+    Returns:
+        str: the registrable domain of a host name, from the public suffix
+            list if ``publicsuffix2`` is installed (``pip install
+            chutie[publicsuffix]``), else as guessed by ``_guess_site``
+    """
+    try:
+        from publicsuffix2 import get_sld
+    except ImportError:
+        return _guess_site(host)
+    if not host or host.replace(".", "").isdigit():
+        return host
+    return get_sld(host) or host
+
+
+def block_third_party(url, resource_type, page_url):
+    """Block requests to hosts outside of the page's site (registrable
+    domain, see ``_site``)
+
+    Without ``publicsuffix2``, the site is guessed from the host name:
+    private suffixes (``github.io``, ``herokuapp.com``) and public suffixes
+    that are not a common country code second-level domain are not
+    recognized, so e.g. every ``*.github.io`` host counts as first-party.
+    """
+    host = urlsplit(url).hostname or ""
+    site = _site(urlsplit(page_url).hostname or "")
+    return not (host == site or host.endswith("." + site))
+
+
+def block_cross_origin(url, resource_type, page_url):
+    """Block requests to any origin but the page's own"""
+    request, page = urlsplit(url), urlsplit(page_url)
+    return ((request.scheme, request.hostname, request.port)
+            != (page.scheme, page.hostname, page.port))
+
+
+def block_media(url, resource_type, page_url):
+    """Block audio and video"""
+    return resource_type == "media"
+
+
+def block_fonts(url, resource_type, page_url):
+    """Block web fonts"""
+    return resource_type == "font"
+
+
+# profile name => rule(url, resource_type, page_url) that returns True to
+# block a request
+PROFILES = collections.OrderedDict([
+    ("third-party", block_third_party),
+    ("same-origin", block_cross_origin),
+    ("media", block_media),
+    ("fonts", block_fonts),
+])
+
+
+def new_stats():
+    """
+    Returns:
+        dict: empty request counts
+    """
+    return {
+        "requests": 0,
+        "blocked": 0,
+        "bytes_saved_estimate": 0,
+        "blocked_by_type": {},
+    }
+
+
+class Interceptor(object):
+    """Block the requests of pages that any of a set of profiles blocks,
+    and count them"""
+
+    def __init__(self, profiles=()):
+        """
+        Kwargs:
+            profiles (iterable[str]): names of ``PROFILES`` to apply
+        Raises:
+            ValueError: if a profile name is not in ``PROFILES``
+        """
+        self.profiles = list(profiles)
+        unknown = [name for name in self.profiles if name not in PROFILES]
+        if unknown:
+            raise ValueError(
+                f"unknown interception profile(s): {', '.join(unknown)}"
+                f" (choose from: {', '.join(PROFILES)})")
+        self.rules = [PROFILES[name] for name in self.profiles]
+        self.stats = new_stats()
+
+    def should_block(self, url, resource_type, page_url):
+        """
+        Args:
+            url (str): request url
+            resource_type (str): e.g. ``script``, ``image``, ``media``
+            page_url (str): url of the page that made the request
+        Returns:
+            bool: True if any profile blocks the request
+        """
+        if urlsplit(url).scheme in _LOCAL_SCHEMES:
+            return False
+        return any(rule(url, resource_type, page_url) for rule in self.rules)
+
+    def count(self, resource_type, blocked):
+        self.stats["requests"] += 1
+        if not blocked:
+            return
+        self.stats["blocked"] += 1
+        self.stats["bytes_saved_estimate"] += AVERAGE_BYTES.get(
+            resource_type, AVERAGE_BYTES["other"])
+        by_type = self.stats["blocked_by_type"]
+        by_type[resource_type] = by_type.get(resource_type, 0) + 1
+
+    def merge(self, stats):
+        """Add the counts of another interceptor (e.g. in another process)
+
+        Args:
+            stats (dict): ``Interceptor.stats``
+        """
+        for key in ("requests", "blocked", "bytes_saved_estimate"):
+            self.stats[key] += stats[key]
+        by_type = self.stats["blocked_by_type"]
+        for resource_type, count in stats["blocked_by_type"].items():
+            by_type[resource_type] = by_type.get(resource_type, 0) + count
+
+    async def attach(self, page, page_url):
+        """Turn on request interception for a page
+
+        The page's own navigation request is never blocked.
+
+        Args:
+            page (pyppeteer.page.Page): a page that has not been navigated
+            page_url (str): url the page is about to load
+        """
+        await attach(page, page_url, intercept=self)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: ``profiles`` and request counts, for run metadata
+        """
+        return dict(profiles=self.profiles, **self.stats)
+
+
+async def attach(page, page_url, intercept=None, assets=None):
+    """Turn on request interception for a page, with one request handler
+    for both blocking and serving cached assets (a request can only be
+    handled once)
+
+    The page's own navigation request is never blocked nor served from
+    the asset cache.
+
+    Args:
+        page (pyppeteer.page.Page): a page that has not been navigated
+        page_url (str): url the page is about to load
+    Kwargs:
+        intercept (Interceptor or None): block the requests that its
+            profiles block
+        assets (chutie.assets.AssetCache or None): serve cached responses
+            from it, and add the page's responses to it
+    """
+    if intercept is not None and not intercept.rules:
+        intercept = None
+    if intercept is None and assets is None:
+        return
+    # imported here so that `chutie --help` doesn't pay for asyncio
+    import asyncio
+
+    def on_request(request):
+        navigation = (request.isNavigationRequest()
+                      and request.frame is page.mainFrame)
+        if intercept is not None:
+            blocked = not navigation and intercept.should_block(
+                request.url, request.resourceType, page_url)
+            intercept.count(request.resourceType, blocked)
+            if blocked:
+                asyncio.ensure_future(request.abort())
+                return
+        cached = None
+        if assets is not None and not navigation:
+            cached = assets.lookup(
+                request.url, request.resourceType, request.method)
+        asyncio.ensure_future(
+            request.continue_() if cached is None
+            else request.respond(cached))
+
+    await page.setRequestInterception(True)
+    page.on("request", on_request)
+    if assets is not None:
+        assets.watch(page)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming, resumable JSON Lines metadata output
+
+A journal is a ``.jsonl`` file with one ``{"type": "run", ...}`` record per
+run and one ``{"type": "screenshot", ...}`` record per screenshot, appended
+as soon as each screenshot is taken (or a ``{"type": "failure", ...}``
+record per viewport of a url that could not be loaded). ``compact`` folds a
+journal into the ``chutie.json`` format.
+"""
+
+import collections
+import json
+import logging
+import os
+
+
+class Journal(object):
+    """An append-only JSON Lines file of screenshot metadata
+
+    Each record is written with a single ``write()`` to a file opened with
+    ``O_APPEND``, so several processes can append to the same journal.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): path to the ``.jsonl`` file
+        """
+        self.path = str(path)
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def truncate(self):
+        """Remove any records from a previous run"""
+        with open(self.path, "w"):
+            pass
+
+    def write_header(self, metadata):
+        """Append a run record with the run's date and viewports
+
+        Args:
+            metadata (dict): metadata as built by ``get_screenshots``
+        """
+        self._append({
+            "type": "run",
+            "date": metadata["date"],
+            "viewports": metadata["viewports"],
+        })
+
+    def write(self, datas):
+        """Append screenshot (or failure) records
+
+        Args:
+            datas (list[dict]): screenshot metadata dicts
+        """
+        for data in datas:
+            record_type = "failure" if data.get("failed") else "screenshot"
+            self._append(dict(data, type=record_type))
+
+    def __iter__(self):
+        return read_journal(self.path)
+
+    def completed(self):
+        """
+        Returns:
+            dict: ``{(url, pathstr, fullPage): data}`` for every screenshot
+                in the journal (later records replace earlier ones)
+        """
+        done = {}
+        for record in self:
+            if record.get("type") == "screenshot":
+                done[_record_key(record)] = _strip_type(record)
+        return done
+
+
+def _record_key(record):
+    return (record["url"], record.get("pathstr"), bool(record["fullPage"]))
+
+
+def _strip_type(record):
+    data = dict(record)
+    data.pop("type", None)
+    return data
+
+
+def read_journal(path):
+    """
+    Args:
+        path (str): path to a ``.jsonl`` journal
+    Yields:
+        dict: journal records (a truncated last line, as left by a crash,
+            is skipped)
+    """
+    if not os.path.exists(path):
+        return
+    with open(path) as _file:
+        for lineno, line in enumerate(_file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(
+                    line, object_pairs_hook=collections.OrderedDict)
+            except ValueError:
+                logging.getLogger().warning(
+                    "skipping unreadable journal line %s:%d", path, lineno)
+
+
+def compact(journal_path, json_path=None):
+    """Fold a journal into the ``chutie.json`` format
+
+    Pages are ordered by the first time their url appears in the journal,
+    and each url's screenshots by viewport and then fullPage. Failures
+    are kept for the viewports that have no screenshots.
+
+    Args:
+        journal_path (str): path to a ``.jsonl`` journal
+    Kwargs:
+        json_path (str or None): if specified, write the result here
+    Returns:
+        dict: metadata in the same shape as ``get_screenshots`` returns
+    """
+    date = None
+    viewports = collections.OrderedDict()
+    urls = collections.OrderedDict()
+    screenshots = collections.OrderedDict()
+    failures = collections.OrderedDict()
+    for record in read_journal(journal_path):
+        if record.get("type") == "run":
+            date = date or record.get("date")
+            for key, value in record.get("viewports", {}).items():
+                viewports.setdefault(key, value)
+        elif record.get("type") == "screenshot":
+            urls.setdefault(record["url"], None)
+            screenshots[_record_key(record)] = _strip_type(record)
+        elif record.get("type") == "failure":
+            urls.setdefault(record["url"], None)
+            failures[(record["url"], record.get("pathstr"))] = (
+                _strip_type(record))
+
+    viewport_order = {key: n for n, key in enumerate(viewports)}
+    pages = collections.OrderedDict((url, []) for url in urls)
+    for key in sorted(
+            screenshots,
+            key=lambda key: (viewport_order.get(key[1], len(viewport_order)),
+                             key[2])):
+        pages[key[0]].append(screenshots[key])
+    captured = {key[:2] for key in screenshots}
+    for key, failure in failures.items():
+        if key not in captured:
+            pages[key[0]].append(failure)
+
+    metadata = collections.OrderedDict([
+        ("date", date),
+        ("urls", list(urls)),
+        ("viewports", viewports),
+        ("pages", pages),
+    ])
+    if json_path:
+        with open(json_path, "w") as _file:
+            json.dump(metadata, _file, indent=2)
+    return metadata
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Per-stage timings of screenshot captures, percentile summaries and
+metrics files (Prometheus text format or JSON)"""
+
+import collections
+import json
+import math
+import time
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+STAGE_HELP = collections.OrderedDict([
+    ("launch", "launching the browser"),
+    ("navigate", "loading a url until it is ready"),
+    ("resize", "resizing the tab to a viewport and waiting for layout"),
+    ("screenshot", "rendering and encoding a screenshot in the browser"),
+    ("write", "encoding and writing a screenshot (in an executor)"),
+    ("cache", "restoring screenshots from the capture cache"),
+    ("prewarm", "loading the prewarm urls to fill the browser caches"),
+])
+
+
+class _Stage(object):
+    """Time a block and record it (see ``Recorder.stage``)"""
+
+    __slots__ = ("recorder", "name", "timings", "labels", "start")
+
+    def __init__(self, recorder, name, timings, labels):
+        self.recorder = recorder
+        self.name = name
+        self.timings = timings
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(
+            self.name, time.monotonic() - self.start, self.timings,
+            self.labels)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullRecorder(object):
+    """A recorder that records nothing (metrics disabled)"""
+
+    enabled = False
+
+    def stage(self, name, timings=None, **labels):
+        return _NULL_STAGE
+
+    def record(self, name, seconds, timings=None, labels=None):
+        pass
+
+
+NULL_RECORDER = NullRecorder()
+
+
+class Recorder(object):
+    """Collect monotonic timings of capture stages"""
+
+    enabled = True
+
+    def __init__(self, hook=None):
+        """
+        Kwargs:
+            hook (callable or None): called with ``(stage, seconds, labels)``
+                after each timed stage, e.g. to feed a tracer (with
+                ``get_screenshots_sharded`` it is called in the worker
+                processes, so it must be picklable)
+        """
+        self.hook = hook
+        self.samples = collections.OrderedDict()
+
+    def stage(self, name, timings=None, **labels):
+        """
+        Args:
+            name (str): stage name (see ``STAGE_HELP``)
+        Kwargs:
+            timings (dict or None): also add the time to ``timings[name]``
+            labels: passed to the hook (e.g. ``url``)
+        Returns:
+            a context manager that times its block
+        """
+        return _Stage(self, name, timings, labels)
+
+    def record(self, name, seconds, timings=None, labels=None):
+        self.samples.setdefault(name, []).append(seconds)
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + seconds
+        if self.hook is not None:
+            self.hook(name, seconds, labels or {})
+
+    def merge(self, samples):
+        """Add the samples of another recorder (e.g. in another process)
+
+        Args:
+            samples (dict): ``Recorder.samples``
+        """
+        for name, values in samples.items():
+            self.samples.setdefault(name, []).extend(values)
+
+    def summary(self):
+        """
+        Returns:
+            dict: ``{stage: {count, sum, max, p50, p90, p95, p99}}``
+                in seconds
+        """
+        return collections.OrderedDict(
+            (name, summarize(values)) for name, values in self.samples.items())
+
+
+def percentile(values, q):
+    """
+    Args:
+        values (list[float]): sorted values
+        q (float): quantile (0.0 - 1.0)
+    Returns:
+        float: the nearest-rank percentile of ``values``
+    """
+    if not values:
+        return 0.0
+    rank = min(max(1, math.ceil(q * len(values))), len(values))
+    return values[rank - 1]
+
+
+def summarize(values):
+    """
+    Args:
+        values (list[float]): samples
+    Returns:
+        dict: ``count``, ``sum``, ``max`` and the ``QUANTILES`` of
+            ``values`` (as ``p50``, ``p90``, ...)
+    """
+    values = sorted(values)
+    summary = collections.OrderedDict([
+        ("count", len(values)),
+        ("sum", sum(values)),
+        ("max", values[-1] if values else 0.0),
+    ])
+    for q in QUANTILES:
+        summary[f"p{int(q * 100)}"] = percentile(values, q)
+    return summary
+
+
+def to_prometheus(summary, prefix="chutie"):
+    """
+    Args:
+        summary (dict): as returned by ``Recorder.summary``
+    Kwargs:
+        prefix (str): metric name prefix
+    Returns:
+        str: a Prometheus text format summary metric of stage durations
+    """
+    name = f"{prefix}_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Time spent in each stage of taking screenshots.",
+        f"# TYPE {name} summary",
+    ]
+    for stage, stats in summary.items():
+        for q in QUANTILES:
+            lines.append(
+                f'{name}{{stage="{stage}",quantile="{q}"}}'
+                f' {stats[f"p{int(q * 100)}"]:.6f}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(summary, path):
+    """Write a metrics file: Prometheus text format if ``path`` ends with
+    ``.prom`` or ``.txt``, else JSON
+
+    Args:
+        summary (dict): as returned by ``Recorder.summary``
+        path (str): path to write to
+    """
+    path = str(path)
+    with open(path, "w") as _file:
+        if path.endswith((".prom", ".txt")):
+            _file.write(to_prometheus(summary))
+        else:
+            json.dump({"stages": summary}, _file, indent=2)
+
+
+def open_recorder(metrics):
+    """
+    Args:
+        metrics (Recorder or bool or callable or None): a recorder, True
+            for a new one, a hook to make a new one with, or None/False to
+            disable metrics
+    Returns:
+        Recorder or NullRecorder
+    """
+    if not metrics:
+        return NULL_RECORDER
+    if isinstance(metrics, (Recorder, NullRecorder)):
+        return metrics
+    if callable(metrics):
+        return Recorder(hook=metrics)
+    return Recorder()
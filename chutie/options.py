@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Parsing and validation of viewports and screenshot options
+
+Kept apart from ``chutie.chutie`` (which imports pyppeteer) so that the
+commands that only validate options (e.g. ``chutie enqueue``) start fast.
+"""
+
+from chutie import encode as capture_encode
+
+
+def viewportstr_to_dict(viewportstr):
+    """
+    Args:
+        viewportstr (str): viewport string (e.g. ``1024x768 mobile landscape``)
+    Returns:
+        dict: dict suitable for use with pyppeteer page.emulate options=
+    """
+    _viewportstr = viewportstr.lower()
+    terms = _viewportstr.split(" ")
+    width, height = map(int, terms[0].split("x", 1))
+    isMobile = True if "mobile" in terms else False
+    isLandscape = True if "landscape" in terms else False
+    return dict(
+        width=width,
+        height=height,
+        isMobile=isMobile,
+        isLandscape=isLandscape,
+        pathstr=_viewportstr.replace(" ", "-"),
+    )
+
+
+def build_viewports(viewports):
+    """
+    Args:
+        viewports (list[str or dict]): list of viewport strings, or dicts
+            with a ``viewport`` string and screenshot options for it (see
+            ``chutie.encode.SCREENSHOT_OPTIONS``)
+    Returns:
+        dict: ``{pathstr: viewport dict}`` in the given order
+    """
+    _viewports = {}
+    for viewport in viewports:
+        if isinstance(viewport, dict):
+            options = dict(viewport)
+            resdict = viewportstr_to_dict(options.pop("viewport"))
+            if options:
+                resdict["screenshot"] = options
+                # raise early on an unknown option or image format
+                capture_encode.screenshot_options({}, resdict)
+        else:
+            resdict = viewportstr_to_dict(viewport)
+        _viewports[resdict["pathstr"]] = resdict
+    return _viewports
+
+
+def clean_screenshot_options(**options):
+    """
+    Returns:
+        dict: the screenshot options that are set (so that cache keys only
+            change when they are)
+    Raises:
+        ValueError: on an unknown image format
+    """
+    options = {key: value for key, value in options.items() if value}
+    capture_encode.screenshot_options(options, {})
+    return options
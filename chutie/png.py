@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal PNG reading and writing with the standard library
+
+Screenshots from Chromium are non-interlaced 8-bit RGB(A) PNGs; these
+functions work on their scanlines without decoding a whole image to pixels.
+"""
+
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# color type => samples per pixel
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def iter_chunks(data):
+    """
+    Args:
+        data (bytes): PNG file contents
+    Yields:
+        tuple: ``(chunk_type, chunk_data)`` (``chunk_type`` is bytes)
+    Raises:
+        ValueError: if ``data`` is not a PNG
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    offset = 8
+    while offset < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        yield chunk_type, data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+        if chunk_type == b"IEND":
+            break
+
+
+def make_chunk(chunk_type, chunk_data):
+    """
+    Args:
+        chunk_type (bytes): e.g. ``b"IDAT"``
+        chunk_data (bytes): chunk payload
+    Returns:
+        bytes: a length-prefixed, CRC-suffixed PNG chunk
+    """
+    crc = zlib.crc32(chunk_type + chunk_data) & 0xffffffff
+    return (struct.pack(">I", len(chunk_data)) + chunk_type + chunk_data
+            + struct.pack(">I", crc))
+
+
+def read_header(data):
+    """
+    Args:
+        data (bytes): PNG file contents
+    Returns:
+        dict: IHDR fields (``width``, ``height``, ``bit_depth``,
+            ``color_type``, ``interlace``) and the derived ``channels`` and
+            ``stride`` (bytes per scanline, excluding the filter byte)
+    """
+    for chunk_type, chunk_data in iter_chunks(data):
+        if chunk_type == b"IHDR":
+            return _parse_ihdr(chunk_data)
+    raise ValueError("PNG has no IHDR chunk")
+
+
+def _parse_ihdr(chunk_data):
+    (width, height, bit_depth, color_type, _compression, _filter,
+     interlace) = struct.unpack(">IIBBBBB", chunk_data)
+    channels = _CHANNELS[color_type]
+    return dict(
+        width=width,
+        height=height,
+        bit_depth=bit_depth,
+        color_type=color_type,
+        interlace=interlace,
+        channels=channels,
+        stride=(width * channels * bit_depth + 7) // 8,
+    )
+
+
+def crop_top(data, height, level=6):
+    """Crop a PNG to its top ``height`` rows
+
+    PNG row filters only refer to the row above, so the first ``height``
+    filtered scanlines are still valid on their own: they are copied
+    without unfiltering and only the zlib stream is rebuilt. Only as much of
+    the image as is needed is decompressed.
+
+    Args:
+        data (bytes): PNG file contents
+        height (int): number of rows to keep
+    Kwargs:
+        level (int): zlib compression level for the cropped image data
+    Returns:
+        bytes: PNG file contents (``data`` itself if it is not taller
+            than ``height``)
+    Raises:
+        ValueError: if ``data`` is not a non-interlaced PNG
+    """
+    chunks = list(iter_chunks(data))
+    header = _parse_ihdr(chunks[0][1])
+    if header["height"] <= height:
+        return data
+    if header["interlace"]:
+        raise ValueError("interlaced PNGs cannot be cropped by scanline")
+
+    nbytes = height * (1 + header["stride"])
+    decompressor = zlib.decompressobj()
+    rows = b""
+    for chunk_type, chunk_data in chunks:
+        if chunk_type != b"IDAT":
+            continue
+        rows += decompressor.decompress(chunk_data, nbytes - len(rows))
+        while decompressor.unconsumed_tail and len(rows) < nbytes:
+            rows += decompressor.decompress(
+                decompressor.unconsumed_tail, nbytes - len(rows))
+        if len(rows) >= nbytes:
+            break
+
+    ihdr = bytearray(chunks[0][1])
+    struct.pack_into(">I", ihdr, 4, height)
+    output = [PNG_SIGNATURE, make_chunk(b"IHDR", bytes(ihdr))]
+    wrote_idat = False
+    for chunk_type, chunk_data in chunks[1:]:
+        if chunk_type == b"IDAT":
+            if not wrote_idat:
+                output.append(
+                    make_chunk(b"IDAT", zlib.compress(rows, level)))
+                wrote_idat = True
+        else:
+            output.append(make_chunk(chunk_type, chunk_data))
+    return b"".join(output)
+
+
+def encode(rows, width, height, color_type=6, bit_depth=8, level=6):
+    """Encode unfiltered scanlines as a PNG
+
+    Args:
+        rows (iterable[bytes]): ``height`` rows of raw samples
+        width (int): image width in pixels
+        height (int): image height in pixels
+    Kwargs:
+        color_type (int): PNG color type (default: 6, RGBA)
+        bit_depth (int): bits per sample (default: 8)
+        level (int): zlib compression level
+    Returns:
+        bytes: PNG file contents
+    """
+    compressor = zlib.compressobj(level)
+    idat = [compressor.compress(b"\x00" + bytes(row)) for row in rows]
+    idat.append(compressor.flush())
+    ihdr = struct.pack(">IIBBBBB", width, height, bit_depth, color_type,
+                       0, 0, 0)
+    return b"".join([
+        PNG_SIGNATURE,
+        make_chunk(b"IHDR", ihdr),
+        make_chunk(b"IDAT", b"".join(idat)),
+        make_chunk(b"IEND", b""),
+    ])
+
+
+def iter_file_chunks(fileobj):
+    """
+    Args:
+        fileobj (file): a PNG file opened in binary mode
+    Yields:
+        tuple: ``(chunk_type, chunk_data)``, reading one chunk at a time
+    Raises:
+        ValueError: if ``fileobj`` is not a PNG
+    """
+    if fileobj.read(8) != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    while True:
+        head = fileobj.read(8)
+        if len(head) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", head)
+        chunk_data = fileobj.read(length)
+        fileobj.read(4)  # crc
+        yield chunk_type, chunk_data
+        if chunk_type == b"IEND":
+            return
+
+
+def iter_bands(path, rows=256):
+    """Decode a PNG in horizontal bands of at most ``rows`` rows, so that
+    only one band of decoded pixels is in memory at a time
+
+    Each band's filtered scanlines are wrapped in a small standalone PNG
+    (preceded by the last decoded row of the previous band, which the
+    first scanline's filter may refer to) and decoded with Pillow.
+
+    Args:
+        path (str): path to a non-interlaced PNG
+    Kwargs:
+        rows (int): maximum number of rows per band
+    Yields:
+        PIL.Image.Image: bands, top to bottom, in the PNG's own mode
+    Raises:
+        ValueError: if ``path`` is not a non-interlaced PNG
+    """
+    import io
+    from PIL import Image
+
+    with open(path, "rb") as _file:
+        chunks = iter_file_chunks(_file)
+        chunk_type, ihdr = next(chunks)
+        header = _parse_ihdr(ihdr)
+        if header["interlace"]:
+            raise ValueError("interlaced PNGs cannot be decoded in bands")
+        linesize = 1 + header["stride"]
+        palette_chunks = []
+        decompressor = zlib.decompressobj()
+        pending = b""
+        prior = b"\x00" + bytes(header["stride"])
+        remaining = header["height"]
+
+        def decode(scanlines, count):
+            ihdr_band = bytearray(ihdr)
+            struct.pack_into(">I", ihdr_band, 4, count + 1)
+            data = b"".join(
+                [PNG_SIGNATURE, make_chunk(b"IHDR", bytes(ihdr_band))]
+                + palette_chunks
+                + [make_chunk(b"IDAT", zlib.compress(prior + scanlines, 0)),
+                   make_chunk(b"IEND", b"")])
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            return image
+
+        for chunk_type, chunk_data in chunks:
+            if chunk_type in (b"PLTE", b"tRNS"):
+                palette_chunks.append(make_chunk(chunk_type, chunk_data))
+            if chunk_type != b"IDAT":
+                continue
+            # decompress no more than one band at a time
+            data = chunk_data
+            while remaining:
+                count = min(rows, remaining)
+                pending += decompressor.decompress(
+                    data, count * linesize - len(pending))
+                data = decompressor.unconsumed_tail
+                if len(pending) < count * linesize:
+                    break
+                image = decode(pending, count)
+                pending = b""
+                remaining -= count
+                # the last decoded row, re-encoded with filter type None
+                last = image.crop((0, count, image.width, count + 1))
+                prior = b"\x00" + last.tobytes()
+                yield image.crop((0, 1, image.width, count + 1))
+            if not remaining:
+                return
+        if remaining:
+            raise ValueError(f"PNG image data ended {remaining} rows early")
+
+
+class PNGWriter(object):
+    """Write a PNG one row (or band of rows) at a time"""
+
+    def __init__(self, fileobj, width, height, color_type=6, bit_depth=8,
+                 level=6):
+        """
+        Args:
+            fileobj (file): file opened in binary mode to write to
+            width (int): image width in pixels
+            height (int): image height in pixels
+        Kwargs:
+            color_type (int): PNG color type (default: 6, RGBA)
+            bit_depth (int): bits per sample (default: 8)
+            level (int): zlib compression level
+        """
+        self.fileobj = fileobj
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(level)
+        ihdr = struct.pack(">IIBBBBB", width, height, bit_depth, color_type,
+                           0, 0, 0)
+        fileobj.write(PNG_SIGNATURE + make_chunk(b"IHDR", ihdr))
+
+    def write_rows(self, rows):
+        """
+        Args:
+            rows (iterable[bytes]): rows of raw samples
+        """
+        data = []
+        for row in rows:
+            data.append(self._compressor.compress(b"\x00" + bytes(row)))
+            self.rows_written += 1
+        data = b"".join(data)
+        if data:
+            self.fileobj.write(make_chunk(b"IDAT", data))
+
+    def close(self):
+        """Finish the image data and write the IEND chunk"""
+        if self.rows_written != self.height:
+            raise ValueError(
+                f"wrote {self.rows_written} of {self.height} rows")
+        self.fileobj.write(make_chunk(b"IDAT", self._compressor.flush())
+                           + make_chunk(b"IEND", b""))
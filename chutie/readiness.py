@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Page readiness strategies: what to wait for after navigating to a url
+before taking screenshots, with per-url overrides and a run deadline"""
+
+import collections
+import time
+
+WAIT_UNTIL = ("load", "domcontentloaded", "networkidle0", "networkidle2")
+
+DEFAULT_STRATEGY = collections.OrderedDict([
+    # navigation event to wait for (one of WAIT_UNTIL)
+    ("wait_until", "load"),
+    # CSS selector to wait for after navigating
+    ("selector", None),
+    # seconds to wait after the page is otherwise ready
+    ("settle", 0),
+    # seconds to wait for navigation and the selector (0 or None: no limit)
+    ("timeout", 30),
+])
+
+
+def make_strategy(options=None, base=None):
+    """
+    Kwargs:
+        options (dict or None): strategy keys (see ``DEFAULT_STRATEGY``) to
+            override
+        base (dict or None): strategy to override (default:
+            ``DEFAULT_STRATEGY``)
+    Returns:
+        dict: a complete readiness strategy
+    Raises:
+        ValueError: on an unknown key, ``wait_until`` value or a negative
+            ``timeout``
+    """
+    strategy = dict(base or DEFAULT_STRATEGY)
+    for key, value in (options or {}).items():
+        if key not in DEFAULT_STRATEGY:
+            raise ValueError(f"unknown readiness option: {key}")
+        strategy[key] = value
+    if strategy["wait_until"] not in WAIT_UNTIL:
+        raise ValueError(
+            f"wait_until must be one of {', '.join(WAIT_UNTIL)}:"
+            f" {strategy['wait_until']!r}")
+    if strategy["timeout"] is not None and not strategy["timeout"] >= 0:
+        raise ValueError(
+            f"timeout must be 0 or more seconds: {strategy['timeout']!r}")
+    return strategy
+
+
+def split_urls(urls, base=None):
+    """Split a list of urls, some of which may be dicts with a ``url`` key
+    and readiness overrides (as in a config file)
+
+    Args:
+        urls (list[str or dict]): urls or
+            ``{"url": ..., "wait_until": ..., "timeout": ...}`` dicts
+    Kwargs:
+        base (dict or None): the run's readiness strategy
+    Returns:
+        tuple: ``(urls, strategies)``: the list of url strs and a
+            ``{url: strategy}`` dict for the urls with overrides
+    """
+    strategies = {}
+    return list(iter_split_urls(urls, strategies, base=base)), strategies
+
+
+def iter_split_urls(urls, strategies, base=None):
+    """Split urls lazily, like ``split_urls``
+
+    Args:
+        urls (iterable[str or dict]): see ``split_urls``
+        strategies (dict): ``{url: strategy}`` to add the overrides to as
+            their urls are yielded
+    Kwargs:
+        base (dict or None): the run's readiness strategy
+    Yields:
+        str: urls
+    """
+    for url in urls:
+        if isinstance(url, dict):
+            options = dict(url)
+            url = options.pop("url")
+            strategies[url] = make_strategy(options, base=base)
+        yield url
+
+
+async def wait_ready(page, url, strategy, deadline=None):
+    """Navigate to a url and wait until it is ready to screenshot
+
+    Args:
+        page (pyppeteer.page.Page): page to navigate
+        url (str): url to load
+        strategy (dict): as returned by ``make_strategy``
+    Kwargs:
+        deadline (float or None): ``time.time()`` by which the whole run
+            must be done; the strategy's timeout is shortened to fit
+    Returns:
+        pyppeteer.network_manager.Response or None: as returned by
+            ``page.goto``
+    Raises:
+        asyncio.TimeoutError: if the page is not ready in time
+            (``pyppeteer.errors.TimeoutError`` is a subclass)
+    """
+    import asyncio
+
+    started = time.time()
+    # 0 (as in pyppeteer) or None: no timeout
+    timeout = strategy["timeout"] or None
+    if deadline is not None:
+        left = deadline - started
+        timeout = left if timeout is None else min(timeout, left)
+        if timeout <= 0:
+            raise asyncio.TimeoutError("run deadline exceeded")
+
+    def remaining_ms():
+        if timeout is None:
+            return 0
+        # pyppeteer treats a timeout of 0 as no timeout
+        return max(1, int((timeout - (time.time() - started)) * 1000))
+
+    response = await page.goto(
+        url, waitUntil=strategy["wait_until"], timeout=remaining_ms())
+    if strategy["selector"]:
+        await page.waitForSelector(
+            strategy["selector"], timeout=remaining_ms())
+    if strategy["settle"]:
+        settle = strategy["settle"]
+        if timeout is not None:
+            settle = min(settle, remaining_ms() / 1000)
+        await asyncio.sleep(settle)
+    return response
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""Crash recovery: relaunching a crashed (or disconnected) browser, and
+retrying failed captures with exponential backoff within a retry budget"""
+
+import asyncio
+import logging
+import random
+import time
+
+# pyppeteer error messages of a crashed tab or a lost DevTools connection
+CRASH_MESSAGES = (
+    "Page crashed",
+    "Target closed",
+    "Session closed",
+    "Connection closed",
+    "Browser closed",
+)
+
+# seconds to wait for a cancelled attempt to close its tab
+_CANCEL_GRACE = 5
+
+
+def new_stats():
+    return {"retries": 0, "restarts": 0, "failed": 0}
+
+
+def is_crash(error):
+    """
+    Args:
+        error (Exception): an error raised while taking screenshots
+    Returns:
+        bool: True if the tab crashed or the browser connection was lost
+            (rather than e.g. a page that was too slow to load)
+    """
+    if isinstance(error, (ConnectionError, EOFError)):
+        return True
+    try:
+        from websockets.exceptions import ConnectionClosed
+    except ImportError:  # pragma: no cover
+        ConnectionClosed = ()
+    if isinstance(error, ConnectionClosed):
+        return True
+    message = str(error)
+    return any(crash in message for crash in CRASH_MESSAGES)
+
+
+def _lost_browser(error):
+    # a crashed tab only needs a new tab, not a new browser
+    return is_crash(error) and "Page crashed" not in str(error)
+
+
+class RetryPolicy(object):
+    """How often and how soon to retry a failed capture job"""
+
+    def __init__(self, retries=2, backoff=1.0, factor=2.0, max_backoff=30.0,
+                 budget=None, timeout=None, jitter=0.1):
+        """
+        Kwargs:
+            retries (int): maximum number of retries of one job
+            backoff (float): seconds to wait before the first retry
+            factor (float): multiply the wait by this after each retry
+            max_backoff (float): longest wait between retries, in seconds
+            budget (int or None): maximum number of retries in the whole run
+                (per worker process with ``get_screenshots_sharded``), so
+                that a run of broken urls fails fast (default: no limit)
+            timeout (float or None): seconds one attempt at a job may take
+                before it is cancelled and retried, e.g. when a crashed tab
+                stops responding (default: no limit)
+            jitter (float): add up to this fraction of each wait at random,
+                so that retries of concurrent jobs don't all happen at once
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.timeout = timeout
+        self.jitter = jitter
+        self.stats = new_stats()
+
+    def delay(self, attempt):
+        """
+        Args:
+            attempt (int): number of retries of the job so far
+        Returns:
+            float: seconds to wait before the next retry
+        """
+        delay = min(self.max_backoff, self.backoff * self.factor ** attempt)
+        return delay * (1 + random.uniform(0, self.jitter))
+
+    def allow(self, attempt, deadline=None):
+        """Take a retry from the budget if the job may be retried
+
+        Args:
+            attempt (int): number of retries of the job so far
+        Kwargs:
+            deadline (float or None): ``time.time()`` by which the run must
+                be done
+        Returns:
+            float or None: seconds to wait before retrying, or None if the
+                job must not be retried
+        """
+        if attempt >= self.retries:
+            return None
+        if self.budget is not None and self.stats["retries"] >= self.budget:
+            return None
+        delay = self.delay(attempt)
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        self.stats["retries"] += 1
+        return delay
+
+    def merge(self, stats):
+        """Add the counts of another policy (e.g. in another process)"""
+        for key, value in stats.items():
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: the arguments to make an equivalent policy with
+        """
+        return dict(retries=self.retries, backoff=self.backoff,
+                    factor=self.factor, max_backoff=self.max_backoff,
+                    budget=self.budget, timeout=self.timeout,
+                    jitter=self.jitter)
+
+
+def open_policy(retry):
+    """
+    Args:
+        retry (RetryPolicy or int or dict or None): a policy, a number of
+            retries, or ``RetryPolicy`` arguments; None to not retry
+    Returns:
+        RetryPolicy or None
+    """
+    if retry is None or isinstance(retry, RetryPolicy):
+        return retry
+    if isinstance(retry, dict):
+        return RetryPolicy(**retry)
+    return RetryPolicy(retries=int(retry))
+
+
+class SupervisedBrowser(object):
+    """A browser that is relaunched (or reconnected to) when it crashes
+
+    Tabs are opened with ``newPage`` as in a browser; ``restart`` replaces
+    the browser once however many tabs were open in it when it crashed.
+    """
+
+    def __init__(self, launcher, closer=None, stats=None):
+        """
+        Args:
+            launcher (coroutine function): launches (or connects to) a
+                browser
+        Kwargs:
+            closer (coroutine function or None): ``await closer(browser)``
+                closes (or disconnects from) a browser (default:
+                ``browser.close()``)
+            stats (dict or None): count ``restarts`` in this dict
+        """
+        self.launcher = launcher
+        self.closer = closer
+        self.stats = stats if stats is not None else new_stats()
+        self.browser = None
+        self.connected = False
+        self.generation = 0
+        self._lock = None
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        await self._launch()
+        return self
+
+    async def _launch(self):
+        browser = await self.launcher()
+        generation = self.generation
+        if hasattr(browser, "on"):
+            browser.on("disconnected",
+                       lambda *args: self._on_disconnected(generation))
+        self.browser = browser
+        self.connected = True
+
+    def _on_disconnected(self, generation):
+        if generation == self.generation:
+            self.connected = False
+
+    async def _close(self, browser):
+        try:
+            if self.closer is not None:
+                await self.closer(browser)
+            else:
+                await browser.close()
+        except Exception:
+            logging.getLogger().debug(
+                "could not close a crashed browser", exc_info=True)
+
+    async def restart(self, generation):
+        """Replace the browser, unless another tab already has since it
+        crashed
+
+        Args:
+            generation (int): ``self.generation`` when the crashed tab was
+                opened
+        """
+        async with self._lock:
+            if generation != self.generation:
+                return
+            logging.getLogger().warning("restarting the browser")
+            self.generation += 1
+            self.stats["restarts"] += 1
+            self.connected = False
+            await self._close(self.browser)
+            await self._launch()
+
+    async def recover(self, error, generation):
+        """Restart the browser if ``error`` means that it crashed or that
+        the connection to it was lost
+
+        Args:
+            error (Exception): the error of a failed capture attempt
+            generation (int): ``self.generation`` when the attempt started
+        """
+        if not self.connected or _lost_browser(error):
+            await self.restart(generation)
+
+    async def newPage(self):
+        return await self.browser.newPage()
+
+    async def close(self):
+        if self.browser is not None:
+            await self._close(self.browser)
+            self.browser = None
+
+
+class _Attempt(object):
+    """The browser of one attempt at a job: watches the tabs it opens for
+    crashes"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.crashed = asyncio.get_event_loop().create_future()
+
+    def _on_error(self, error):
+        if not self.crashed.done():
+            self.crashed.set_result(error)
+
+    async def newPage(self):
+        page = await self.browser.newPage()
+        if hasattr(page, "on"):
+            page.on("error", self._on_error)
+        return page
+
+
+def _retrieve(task):
+    # avoid "exception was never retrieved" warnings for abandoned attempts
+    if not task.cancelled():
+        task.exception()
+
+
+async def run_attempt(browser, capture, timeout=None):
+    """Run one attempt at a capture job, stopping it early if one of its
+    tabs crashes or it takes longer than ``timeout``
+
+    Args:
+        browser (SupervisedBrowser or pyppeteer.browser.Browser): browser
+            to open tabs in
+        capture (callable): ``await capture(browser)`` takes the screenshots
+    Kwargs:
+        timeout (float or None): seconds the attempt may take
+    Returns:
+        the result of ``capture``
+    Raises:
+        Exception: whatever ``capture`` raised, a ``PageError`` if a tab
+            crashed, or ``asyncio.TimeoutError``
+    """
+    attempt = _Attempt(browser)
+    task = asyncio.ensure_future(capture(attempt))
+    try:
+        await asyncio.wait([task, attempt.crashed], timeout=timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if task.done():
+        return task.result()
+    task.add_done_callback(_retrieve)
+    task.cancel()
+    await asyncio.wait([task], timeout=_CANCEL_GRACE)
+    if attempt.crashed.done():
+        raise attempt.crashed.result()
+    raise asyncio.TimeoutError(f"capture attempt took more than {timeout}s")
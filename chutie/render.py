@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""Rendering reports (e.g. ``chutie.html``) from run metadata with jinja2
+
+This module does not import the browser dependencies, so that
+``chutie template`` starts fast; jinja2 itself is imported when a template
+is first loaded.
+
+Templates are loaded by a ``Renderer``, which keeps one jinja2 environment
+(and so its compiled templates) per template directory for the life of the
+process (see ``get_renderer``), and can keep compiled templates on disk
+too, for the next process (``bytecode_cache``).
+"""
+
+import collections
+import logging
+import os
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from chutie import cache as capture_cache
+
+DEFAULT_TEMPLATE_DIR = Path(__file__).parent
+DEFAULT_TEMPLATE = "screenshots.j2"
+DEFAULT_INDEX_TEMPLATE = "screenshots_index.j2"
+
+
+def default_bytecode_cache_dir():
+    """
+    Returns:
+        str: ``$XDG_CACHE_HOME/chutie-templates``, next to (not inside) the
+            capture cache, whose eviction would remove it
+    """
+    return capture_cache.default_cache_dir() + "-templates"
+
+
+class Renderer(object):
+    """Render contexts with the templates of one directory
+
+    The jinja2 environment is created on first use and keeps each
+    compiled template (recompiling it if its file changes); with a
+    ``bytecode_cache``, compiled templates are also written to disk, so
+    that another process loads them without parsing and compiling them.
+    """
+
+    def __init__(self, template_dir=None, bytecode_cache=None):
+        """
+        Kwargs:
+            template_dir (str or None): directory of templates
+                (default: the chutie/ source directory)
+            bytecode_cache (str or bool or None): directory to keep
+                compiled templates in (True for
+                ``default_bytecode_cache_dir()``) (default: None, in
+                memory only)
+        """
+        self.template_dir = os.path.abspath(
+            str(template_dir or DEFAULT_TEMPLATE_DIR))
+        if bytecode_cache is True:
+            bytecode_cache = default_bytecode_cache_dir()
+        self.bytecode_cache = (
+            os.path.abspath(str(bytecode_cache)) if bytecode_cache else None)
+        self._env = None
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # unpickled as the cached renderer of the receiving process, so
+        # that a process pool compiles each template once per process
+        return get_renderer, (self.template_dir, self.bytecode_cache)
+
+    @property
+    def env(self):
+        """
+        Returns:
+            jinja2.Environment: the environment of ``template_dir``
+        """
+        if self._env is None:
+            with self._lock:
+                if self._env is None:
+                    self._env = self._new_env()
+        return self._env
+
+    def _new_env(self):
+        import jinja2
+
+        bytecode_cache = None
+        if self.bytecode_cache:
+            try:
+                os.makedirs(self.bytecode_cache, exist_ok=True)
+                writable = os.access(self.bytecode_cache, os.W_OK)
+            except OSError:
+                writable = False
+            if writable:
+                bytecode_cache = jinja2.FileSystemBytecodeCache(
+                    self.bytecode_cache)
+            else:
+                logging.getLogger().warning(
+                    "cannot write the template cache %s; compiling"
+                    " templates in memory only", self.bytecode_cache)
+        return jinja2.Environment(
+            loader=jinja2.FileSystemLoader([self.template_dir]),
+            autoescape=True, bytecode_cache=bytecode_cache)
+
+    def get_template(self, template_name=DEFAULT_TEMPLATE):
+        """
+        Args:
+            template_name (str): name of a template in ``template_dir``
+        Returns:
+            jinja2.Template: the compiled template (cached)
+        """
+        return self.env.get_template(template_name)
+
+    def render(self, context, template_name=DEFAULT_TEMPLATE,
+               write_to_path=None):
+        """Render a context (see ``render_template``)
+
+        Returns:
+            str: the rendered template
+        """
+        html = self.get_template(template_name).render(context)
+        if write_to_path:
+            with open(write_to_path, "w") as _file:
+                _file.write(html)
+        return html
+
+    def render_paginated(self, context, write_to_path="chutie.html",
+                         per_page=100, template_name=DEFAULT_TEMPLATE,
+                         index_template=DEFAULT_INDEX_TEMPLATE):
+        """Render a report as an index page and numbered report pages (see
+        ``render_paginated``)
+
+        Returns:
+            list[str]: paths of the index page and the report pages
+        """
+        return _render_pages(
+            self.get_template(template_name),
+            self.get_template(index_template),
+            context, write_to_path, per_page)
+
+    def render_many(self, reports, processes=1, template_name=None,
+                    per_page=None):
+        """Render many reports, e.g. one per site (see ``split_sites``)
+
+        Args:
+            reports (iterable[tuple]): ``(context, write_to_path)`` pairs
+        Kwargs:
+            processes (int or None): render in a pool of this many processes
+                (None for ``os.cpu_count()``; default: 1, render here). Each
+                process compiles (or, with a ``bytecode_cache``, loads) the
+                templates once.
+            template_name (str or None): name of the template in
+                ``template_dir`` (default: ``DEFAULT_TEMPLATE``)
+            per_page (int or None): paginate each report (see
+                ``render_paginated``)
+        Returns:
+            list[str]: the paths written (each report's index page first
+                if paginated), in ``reports`` order
+        """
+        jobs = [(self, context, str(path), template_name, per_page)
+                for context, path in reports]
+        if processes == 1 or len(jobs) < 2:
+            results = [_render_report(*job) for job in jobs]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            processes = min(processes or os.cpu_count() or 1, len(jobs))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(
+                    _render_report, *zip(*jobs),
+                    chunksize=max(1, len(jobs) // (processes * 4))))
+        return [path for paths in results for path in paths]
+
+
+# (template_dir, bytecode_cache) => Renderer, shared by the whole process
+_RENDERERS = {}
+_RENDERERS_LOCK = threading.Lock()
+
+
+def get_renderer(template_dir=None, bytecode_cache=None):
+    """
+    Kwargs:
+        template_dir (str or None): see ``Renderer``
+        bytecode_cache (str or bool or None): see ``Renderer``
+    Returns:
+        Renderer: the process's renderer for these arguments (so that each
+            template is only compiled once per process)
+    """
+    renderer = Renderer(template_dir, bytecode_cache)
+    key = (renderer.template_dir, renderer.bytecode_cache)
+    with _RENDERERS_LOCK:
+        return _RENDERERS.setdefault(key, renderer)
+
+
+def clear_renderers():
+    """Forget the cached renderers (and their compiled templates)"""
+    with _RENDERERS_LOCK:
+        _RENDERERS.clear()
+
+
+def _render_report(renderer, context, path, template_name=None,
+                   per_page=None):
+    """Render one report of ``Renderer.render_many``
+
+    Returns:
+        list[str]: the paths written
+    """
+    template_name = template_name or DEFAULT_TEMPLATE
+    if per_page:
+        return renderer.render_paginated(
+            context, write_to_path=path, per_page=per_page,
+            template_name=template_name)
+    renderer.render(context, template_name, write_to_path=path)
+    return [path]
+
+
+def resolve_template(template_dir=None, template_name=None,
+                     default_template=DEFAULT_TEMPLATE):
+    """
+    Returns:
+        tuple: ``(template_dir, template_name)`` of a template (see
+            ``render_template`` for the arguments)
+    """
+    if template_dir is None:
+        if template_name is None:
+            template_name = default_template
+        else:
+            template_dir = Path(template_name).parent
+            template_name = Path(template_name).name
+    return template_dir, template_name
+
+
+def _get_template(template_dir=None, template_name=None,
+                  default_template=DEFAULT_TEMPLATE, bytecode_cache=None):
+    """
+    Returns:
+        jinja2.Template: see ``render_template`` for the arguments
+    """
+    template_dir, template_name = resolve_template(
+        template_dir, template_name, default_template)
+    return get_renderer(template_dir, bytecode_cache).get_template(
+        template_name)
+
+
+def render_template(
+    context,
+    template_dir=None,
+    template_name=None,
+    default_template=DEFAULT_TEMPLATE,
+    write_to_path=None,
+    bytecode_cache=None,
+):
+    """Generate output from a context and a jinja2 template (e.g. HTML)
+    Args:
+        context (dict): context dict as generated by `get_screenshots()`
+    Kwargs:
+        template_dir (str): path to a directory of templates
+        template_name (str or None): name of a template in template_dir,
+            or a path to a template
+        default_template (str): default template in chutie/ source directory
+        write_to_path (str or None): if specified, write the template to
+            the given path
+        bytecode_cache (str or bool or None): directory to keep compiled
+            templates in, for other processes (see ``Renderer``)
+    Returns:
+        str: template rendered with `context` by jinja2
+    """
+    tmpl = _get_template(
+        template_dir, template_name, default_template, bytecode_cache)
+    html = tmpl.render(context)
+    if write_to_path:
+        with open(write_to_path, "w") as _file:
+            _file.write(html)
+    return html
+
+
+def split_sites(context):
+    """Split a run's context into one context per site (host)
+
+    Args:
+        context (dict): context dict as generated by `get_screenshots()`
+    Returns:
+        collections.OrderedDict: ``{host: context}``, in the order of the
+            hosts' first urls; each context has that host's ``urls`` and
+            ``pages`` only
+    """
+    sites = collections.OrderedDict()
+    for url, datas in context.get("pages", {}).items():
+        host = urlsplit(url).hostname or urlsplit(url).scheme or "local"
+        site = sites.get(host)
+        if site is None:
+            site = sites[host] = dict(
+                context, urls=[], pages=collections.OrderedDict())
+        site["urls"].append(url)
+        site["pages"][url] = datas
+    return sites
+
+
+def paginate(pages, per_page=100):
+    """Split ``pages`` into report pages of about ``per_page`` screenshots,
+    keeping each url's screenshots together (unless a url alone has more
+    than ``per_page``)
+
+    Args:
+        pages (dict): ``{url: [data, ...]}`` as in ``context["pages"]``
+    Kwargs:
+        per_page (int): number of screenshots per report page
+    Yields:
+        list[tuple]: ``(url, [data, ...])`` for each report page
+    """
+    per_page = max(1, int(per_page))
+    chunk, count = [], 0
+    for url, datas in pages.items():
+        for start in range(0, max(len(datas), 1), per_page):
+            part = datas[start:start + per_page]
+            if count and count + len(part) > per_page:
+                yield chunk
+                chunk, count = [], 0
+            chunk.append((url, part))
+            count += len(part)
+    if chunk:
+        yield chunk
+
+
+def _stream_template(tmpl, context, path):
+    """Render a template straight to a file with ``Template.generate``"""
+    with open(path, "w") as _file:
+        for text in tmpl.generate(context):
+            _file.write(text)
+
+
+def render_paginated(
+    context,
+    write_to_path="chutie.html",
+    per_page=100,
+    template_dir=None,
+    template_name=None,
+    default_template=DEFAULT_TEMPLATE,
+    index_template=DEFAULT_INDEX_TEMPLATE,
+    bytecode_cache=None,
+):
+    """Render a report as an index page and numbered pages of ``per_page``
+    screenshots each, streaming each page to its file
+
+    The report pages are written next to ``write_to_path`` as
+    ``<stem>-0001.html``, ``<stem>-0002.html``, ...; each one is rendered
+    with the template's ``generate()``, so the whole HTML is never in
+    memory. Each report page's context has a ``pagination`` dict.
+
+    Args:
+        context (dict): context dict as generated by `get_screenshots()`
+    Kwargs:
+        write_to_path (str): path of the index page (default: chutie.html)
+        per_page (int): number of screenshots per page (default: 100)
+        template_dir (str): see ``render_template``
+        template_name (str or None): see ``render_template``
+        default_template (str): see ``render_template``
+        index_template (str): name of the index template in the chutie/
+            source directory (or in ``template_dir``)
+        bytecode_cache (str or bool or None): see ``render_template``
+    Returns:
+        list[str]: paths of the index page and the report pages
+    """
+    tmpl = _get_template(
+        template_dir, template_name, default_template, bytecode_cache)
+    index_tmpl = _get_template(
+        template_dir, index_template if template_dir else None,
+        index_template, bytecode_cache)
+    return _render_pages(tmpl, index_tmpl, context, write_to_path, per_page)
+
+
+def _render_pages(tmpl, index_tmpl, context, write_to_path, per_page):
+    """Write the pages of ``render_paginated`` with compiled templates"""
+    index_path = Path(write_to_path)
+    chunks = list(paginate(context.get("pages", {}), per_page=per_page))
+    filenames = [
+        f"{index_path.stem}-{number:04d}{index_path.suffix}"
+        for number in range(1, len(chunks) + 1)]
+    reports = []
+    for number, chunk in enumerate(chunks, 1):
+        pagination = {
+            "number": number,
+            "count": len(chunks),
+            "index": index_path.name,
+            "previous": filenames[number - 2] if number > 1 else None,
+            "next": filenames[number] if number < len(chunks) else None,
+        }
+        page_context = dict(context, pages=collections.OrderedDict(chunk),
+                            pagination=pagination)
+        path = index_path.parent / filenames[number - 1]
+        _stream_template(tmpl, page_context, str(path))
+        reports.append({
+            "filename": filenames[number - 1],
+            "urls": [url for url, datas in chunk],
+            "screenshots": sum(len(datas) for url, datas in chunk),
+        })
+
+    index_context = dict(context, reports=reports)
+    index_context.pop("pages", None)
+    _stream_template(index_tmpl, index_context, str(index_path))
+    return [str(index_path)] + [
+        str(index_path.parent / filename) for filename in filenames]
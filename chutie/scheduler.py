@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+"""Per-host scheduling of capture jobs
+
+Url lists are often thousands of pages on a few hosts. Instead of handing
+jobs to the tabs in list order, a ``HostScheduler`` looks ahead in the list
+and deals jobs out round-robin across hosts, keeps at most ``max_per_host``
+jobs of one host in flight, spaces out page loads on each host with a token
+bucket, and backs off only the host that answered ``429 Too Many Requests``
+(or ``503`` with a ``Retry-After``) while the tabs keep working through the
+other hosts' jobs.
+"""
+
+import asyncio
+import collections
+import email.utils
+import logging
+import time
+from urllib.parse import urlsplit
+
+# HostScheduler arguments that may be set in a config file
+SETTINGS = ("max_per_host", "rate", "burst", "backoff", "max_backoff",
+            "lookahead")
+
+
+class Throttled(Exception):
+    """A host answered a page load with ``429`` (or ``503`` with a
+    ``Retry-After``)"""
+
+    def __init__(self, url, status, delay):
+        super().__init__(
+            f"{status} from {host_of(url)}: backing off for {delay:.1f}s")
+        self.url = url
+        self.status = status
+        self.delay = delay
+
+
+def host_of(url):
+    """
+    Args:
+        url (str): a url
+    Returns:
+        str: its lowercased ``host[:port]`` (empty for e.g. ``about:blank``)
+    """
+    return urlsplit(url).netloc.lower()
+
+
+def parse_retry_after(value, now=None):
+    """
+    Args:
+        value (str or None): a ``Retry-After`` header: a number of seconds
+            or an HTTP date
+    Kwargs:
+        now (float or None): ``time.time()`` to count from
+    Returns:
+        float or None: seconds to wait, or None if ``value`` is not valid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None or date.tzinfo is None:
+        return None
+    return max(0.0, date.timestamp() - (time.time() if now is None else now))
+
+
+class TokenBucket(object):
+    """Allow ``rate`` events per second on average, in bursts of up to
+    ``burst``"""
+
+    def __init__(self, rate, burst=1, now=None):
+        """
+        Args:
+            rate (float): tokens added per second
+        Kwargs:
+            burst (int): bucket size (and initial number of tokens)
+            now (float or None): ``time.monotonic()`` to start from
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """
+        Returns:
+            float: seconds until a token is available (0 if one is)
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Take a token (which ``delay`` said is available)"""
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Host(object):
+
+    def __init__(self, bucket=None):
+        self.active = 0
+        self.strikes = 0
+        self.blocked_until = 0.0
+        self.bucket = bucket
+
+
+def new_stats():
+    return {"jobs": 0, "throttled": 0, "backoff_seconds": 0.0,
+            "throttled_hosts": {}}
+
+
+class HostScheduler(object):
+    """Dispatch capture jobs across hosts with per-host concurrency caps,
+    rate limits and backoff"""
+
+    def __init__(self, max_per_host=None, rate=None, burst=1, backoff=5.0,
+                 max_backoff=300.0, lookahead=1000):
+        """
+        Kwargs:
+            max_per_host (int or None): most jobs of one host in flight at
+                once (default: None, no limit but the run's concurrency)
+            rate (float or None): most page loads per second on one host,
+                on average (default: None, no limit)
+            burst (int): page loads on one host that may start at once
+                before ``rate`` applies
+            backoff (float): seconds to back a host off for after a ``429``
+                without a ``Retry-After``, doubled for each further one in
+                a row
+            max_backoff (float): longest backoff, in seconds, whatever the
+                ``Retry-After``
+            lookahead (int): most jobs to read ahead of the tabs, looking
+                for a host that may be loaded
+        """
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lookahead = max(1, int(lookahead))
+        self.stats = new_stats()
+        self._hosts = {}
+
+    def __getstate__(self):
+        # each process schedules its own hosts
+        state = dict(self.__dict__)
+        state["_hosts"] = {}
+        return state
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            bucket = None
+            if self.rate:
+                bucket = TokenBucket(self.rate, self.burst)
+            state = self._hosts[host] = _Host(bucket)
+        return state
+
+    def ready_in(self, host, now=None):
+        """
+        Args:
+            host (str): as returned by ``host_of``
+        Kwargs:
+            now (float or None): ``time.monotonic()``
+        Returns:
+            float or None: seconds until another job of ``host`` may start
+                (0 if one may now), or None while it has ``max_per_host``
+                jobs in flight
+        """
+        now = time.monotonic() if now is None else now
+        state = self._host(host)
+        if self.max_per_host and state.active >= self.max_per_host:
+            return None
+        delay = max(0.0, state.blocked_until - now)
+        if state.bucket is not None:
+            delay = max(delay, state.bucket.delay(now))
+        return delay
+
+    def observe(self, url, response):
+        """Check the response to a page load, and back its host off if it
+        was throttled
+
+        Args:
+            url (str): the url that was loaded
+            response (pyppeteer.network_manager.Response or None): as
+                returned by ``page.goto``
+        Raises:
+            Throttled: on a ``429``, or a ``503`` with a ``Retry-After``
+        """
+        if response is None:
+            return
+        headers = {key.lower(): value
+                   for key, value in (response.headers or {}).items()}
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        status = response.status
+        if status == 429 or (status == 503 and retry_after is not None):
+            raise Throttled(url, status, self.throttle(url, retry_after))
+        self._host(host_of(url)).strikes = 0
+
+    def throttle(self, url, retry_after=None):
+        """Back off the host of ``url``
+
+        Args:
+            url (str): a url of the host
+        Kwargs:
+            retry_after (float or None): seconds the host asked to wait
+        Returns:
+            float: seconds the host is backed off for
+        """
+        host = host_of(url)
+        state = self._host(host)
+        state.strikes += 1
+        delay = retry_after
+        if delay is None:
+            delay = self.backoff * 2 ** (state.strikes - 1)
+        delay = min(delay, self.max_backoff)
+        state.blocked_until = max(
+            state.blocked_until, time.monotonic() + delay)
+        self.stats["throttled"] += 1
+        self.stats["backoff_seconds"] += delay
+        hosts = self.stats["throttled_hosts"]
+        hosts[host] = hosts.get(host, 0) + 1
+        logging.getLogger().warning(
+            "%s is throttling requests; backing off for %.1fs", host, delay)
+        return delay
+
+    async def wait(self, url):
+        """Wait until the host of ``url`` may be loaded again and take a
+        token (e.g. before retrying a job that is already in flight)"""
+        state = self._host(host_of(url))
+        while True:
+            now = time.monotonic()
+            delay = max(0.0, state.blocked_until - now)
+            if state.bucket is not None:
+                delay = max(delay, state.bucket.delay(now))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if state.bucket is not None:
+            state.bucket.take(time.monotonic())
+
+    def _next_host(self, pending, now):
+        """
+        Returns:
+            tuple: ``(host, wait)``: the first host in ``pending`` whose
+                next job may start now (or None), and the seconds until one
+                of the others may (or None)
+        """
+        wait = None
+        for host in pending:
+            delay = self.ready_in(host, now)
+            if delay is None:
+                continue
+            if delay <= 0:
+                return host, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def run(self, jobs, worker, concurrency=1, key=None):
+        """Run ``worker(job)`` for each job with at most ``concurrency``
+        workers in flight at once (as ``chutie.chutie._run_pool``), in a
+        host-aware order
+
+        Args:
+            jobs (iterable or async iterable): jobs to run (read ahead at
+                most ``lookahead`` jobs at a time)
+            worker (coroutine function): ``await worker(job)`` returns a
+                result
+        Kwargs:
+            concurrency (int): maximum number of concurrent workers
+            key (callable or None): returns the url of a job (default: its
+                first item)
+        Returns:
+            list: ``worker`` results, in the same order as ``jobs``
+        """
+        key = key or (lambda job: job[0])
+        concurrency = max(1, int(concurrency))
+        if hasattr(jobs, "__aiter__"):
+            iterator = jobs.__aiter__()
+        else:
+            iterator = iter(jobs)
+        # host => deque of (index, job), in round-robin order
+        pending = collections.OrderedDict()
+        results = {}
+        tasks = set()
+        counts = {"read": 0, "buffered": 0, "exhausted": False}
+
+        async def read():
+            try:
+                if hasattr(iterator, "__anext__"):
+                    job = await iterator.__anext__()
+                else:
+                    job = next(iterator)
+            except (StopIteration, StopAsyncIteration):
+                counts["exhausted"] = True
+                return
+            host = host_of(key(job))
+            pending.setdefault(host, collections.deque()).append(
+                (counts["read"], job))
+            counts["read"] += 1
+            counts["buffered"] += 1
+
+        async def run_one(host, index, job):
+            try:
+                results[index] = await worker(job)
+            finally:
+                self._hosts[host].active -= 1
+
+        try:
+            while True:
+                while (not counts["exhausted"]
+                       and counts["buffered"] < concurrency):
+                    await read()
+                wait = None
+                while len(tasks) < concurrency:
+                    now = time.monotonic()
+                    host, wait = self._next_host(pending, now)
+                    if host is None:
+                        if (counts["exhausted"]
+                                or counts["buffered"] >= self.lookahead):
+                            break
+                        # look further ahead for another host's jobs
+                        await read()
+                        continue
+                    index, job = pending[host].popleft()
+                    counts["buffered"] -= 1
+                    if pending[host]:
+                        pending.move_to_end(host)
+                    else:
+                        del pending[host]
+                    state = self._host(host)
+                    state.active += 1
+                    if state.bucket is not None:
+                        state.bucket.take(now)
+                    self.stats["jobs"] += 1
+                    tasks.add(asyncio.ensure_future(
+                        run_one(host, index, job)))
+                    if (not counts["exhausted"]
+                            and counts["buffered"] < concurrency):
+                        await read()
+                if not tasks:
+                    if not pending and counts["exhausted"]:
+                        break
+                    await asyncio.sleep(wait or 0)
+                    continue
+                if len(tasks) >= concurrency:
+                    wait = None
+                done, _ = await asyncio.wait(
+                    tasks, timeout=wait,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    task.result()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [results[index] for index in sorted(results)]
+
+    def merge(self, stats):
+        """Add the counts of another process's scheduler
+
+        Args:
+            stats (dict): ``HostScheduler.stats``
+        """
+        for key, value in stats.items():
+            if key == "throttled_hosts":
+                hosts = self.stats["throttled_hosts"]
+                for host, count in value.items():
+                    hosts[host] = hosts.get(host, 0) + count
+            else:
+                self.stats[key] += value
+
+    def settings(self):
+        """
+        Returns:
+            dict: the arguments to make an equivalent scheduler with
+        """
+        return {name: getattr(self, name) for name in SETTINGS}
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: settings and counts, for run metadata
+        """
+        return dict(self.settings(), **self.stats)
+
+
+def open_scheduler(scheduler):
+    """
+    Args:
+        scheduler (HostScheduler or dict or bool or None): a scheduler,
+            ``HostScheduler`` arguments, True for the defaults, or
+            None/False for none
+    Returns:
+        HostScheduler or None
+    Raises:
+        ValueError: on an unknown setting
+    """
+    if scheduler is None or scheduler is False or isinstance(
+            scheduler, HostScheduler):
+        return scheduler or None
+    if scheduler is True:
+        return HostScheduler()
+    unknown = set(scheduler) - set(SETTINGS)
+    if unknown:
+        raise ValueError(
+            f"unknown scheduler setting: {', '.join(sorted(unknown))}")
+    return HostScheduler(**scheduler)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming url sources (text files, sitemaps and stdin) with
+memory-efficient deduplication of equivalent urls
+
+Sources are read lazily, one url at a time, so that a run can take
+screenshots of millions of urls without holding them all in memory.
+"""
+
+import array
+import gzip
+import hashlib
+import logging
+import math
+import os
+import sys
+from urllib.parse import urlsplit, urlunsplit
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_SITEMAP_SUFFIXES = (".xml", ".xml.gz")
+
+
+def normalize_url(url):
+    """
+    Args:
+        url (str): a url
+    Returns:
+        str: the url with a lowercase scheme and host, without a default
+            port, and with ``/`` for an empty path (the fragment is kept:
+            it may select the route of a single page app)
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        return urlunsplit(parts)
+    netloc = (parts.hostname or "").lower()
+    if parts.username or parts.password:
+        userinfo = parts.username or ""
+        if parts.password:
+            userinfo += f":{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    if parts.port and parts.port != _DEFAULT_PORTS[scheme]:
+        netloc += f":{parts.port}"
+    return urlunsplit(
+        (scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def _digest(url):
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+
+
+class HashedSet(object):
+    """A set of urls that stores a 64-bit hash of each url in an
+    open-addressing table (16 to 32 bytes per url)
+
+    Two different urls with the same 64-bit hash (which is about as likely as
+    one in 10**19 per pair) are treated as the same url.
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        Kwargs:
+            capacity (int): initial number of urls to make room for
+        """
+        self._size = 0
+        self._slots = array.array("Q", bytes(8 * _table_size(capacity)))
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _hash(url):
+        # 0 marks an empty slot
+        return int.from_bytes(_digest(url)[:8], "little") or 1
+
+    def _insert(self, slots, value):
+        mask = len(slots) - 1
+        index = value & mask
+        while True:
+            current = slots[index]
+            if current == 0:
+                slots[index] = value
+                return True
+            if current == value:
+                return False
+            index = (index + 1) & mask
+
+    def add(self, url):
+        """
+        Args:
+            url (str): url to add
+        Returns:
+            bool: True if ``url`` was not already in the set
+        """
+        if (self._size + 1) * 2 > len(self._slots):
+            slots = array.array("Q", bytes(8 * len(self._slots) * 2))
+            for value in self._slots:
+                if value:
+                    self._insert(slots, value)
+            self._slots = slots
+        added = self._insert(self._slots, self._hash(url))
+        self._size += added
+        return added
+
+    def __contains__(self, url):
+        slots = self._slots
+        value = self._hash(url)
+        mask = len(slots) - 1
+        index = value & mask
+        while slots[index]:
+            if slots[index] == value:
+                return True
+            index = (index + 1) & mask
+        return False
+
+
+def _table_size(capacity):
+    return 1 << max(4, math.ceil(math.log2(max(capacity, 1) * 2)))
+
+
+class BloomFilter(object):
+    """A fixed-size Bloom filter of urls
+
+    It never forgets a url, but with probability ``error_rate`` a new url
+    is reported as seen (and would be skipped), in exchange for a size of
+    about 2.4 bytes per url at a 1e-4 error rate.
+    """
+
+    def __init__(self, capacity, error_rate=1e-4):
+        """
+        Args:
+            capacity (int): expected number of urls
+        Kwargs:
+            error_rate (float): false positive rate at ``capacity`` urls
+        """
+        capacity = max(1, int(capacity))
+        self.nbits = max(8, int(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.nhashes = max(1, round(self.nbits / capacity * math.log(2)))
+        self._bits = bytearray((self.nbits + 7) // 8)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _positions(self, url):
+        # double hashing: h1 + i * h2
+        digest = _digest(url)
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def add(self, url):
+        """
+        Args:
+            url (str): url to add
+        Returns:
+            bool: True if ``url`` was (probably) not already in the filter
+        """
+        added = False
+        for position in self._positions(url):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        self._size += added
+        return added
+
+    def __contains__(self, url):
+        return all(
+            self._bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(url))
+
+
+def iter_lines(fileobj):
+    """
+    Args:
+        fileobj (file): a text file of one url per line
+    Yields:
+        str: urls (blank lines and ``#`` comments are skipped)
+    """
+    for line in fileobj:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def _open(path):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _local_sitemap(loc, sitemap_path):
+    """
+    Returns:
+        str or None: the local path of a child sitemap of a sitemap index:
+            ``loc`` itself if it is a path (or ``file://`` url), else a file
+            with the same name next to the index
+    """
+    parts = urlsplit(loc)
+    if parts.scheme in ("", "file"):
+        path = parts.path
+    else:
+        path = os.path.basename(parts.path)
+    path = os.path.join(os.path.dirname(str(sitemap_path)), path)
+    return path if os.path.exists(path) else None
+
+
+def iter_sitemap(path):
+    """Read the urls of a local sitemap (or sitemap index) incrementally
+
+    The children of a sitemap index are read from local files: a ``<loc>``
+    that is an ``http(s)`` url is looked for next to the index by its file
+    name.
+
+    Args:
+        path (str): path to a ``sitemap.xml`` (or ``.xml.gz``)
+    Yields:
+        str: the ``<loc>`` of each ``<url>``
+    """
+    import xml.etree.ElementTree as ET
+
+    children = []
+    with _open(path) as _file:
+        context = ET.iterparse(_file, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end":
+                continue
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if tag != "loc":
+                if tag in ("url", "sitemap"):
+                    # drop parsed elements so memory use stays flat
+                    root.clear()
+                continue
+            parent = "sitemap" if root.tag.endswith("sitemapindex") else "url"
+            loc = (elem.text or "").strip()
+            if not loc:
+                continue
+            if parent == "url":
+                yield loc
+            else:
+                children.append(loc)
+    for loc in children:
+        child = _local_sitemap(loc, path)
+        if child is None:
+            logging.getLogger().warning(
+                "skipping sitemap %s: no local copy next to %s", loc, path)
+            continue
+        yield from iter_sitemap(child)
+
+
+def iter_source(source):
+    """
+    Args:
+        source (str): ``-`` for stdin, a path to a sitemap (``.xml`` or
+            ``.xml.gz``), or a path to a text file of one url per line
+    Yields:
+        str: urls
+    """
+    if source == "-":
+        yield from iter_lines(sys.stdin)
+    elif str(source).endswith(_SITEMAP_SUFFIXES):
+        yield from iter_sitemap(source)
+    else:
+        with open(source) as _file:
+            yield from iter_lines(_file)
+
+
+def iter_urls(urls=(), sources=(), normalize=True, seen=None):
+    """Chain urls and url sources lazily, deduplicating
+
+    Args:
+        urls (iterable[str or dict]): urls (dicts with a ``url`` key, as in
+            config files, are deduplicated by their ``url``)
+        sources (iterable[str]): see ``iter_source``
+    Kwargs:
+        normalize (bool): treat urls that are the same once normalized with
+            ``normalize_url`` as duplicates
+        seen (HashedSet or BloomFilter or None): urls to skip (and to add
+            new urls to) (default: a new ``HashedSet``)
+    Yields:
+        str or dict: the first of each set of duplicate urls, as given
+            (stripped of whitespace)
+    """
+    seen = HashedSet() if seen is None else seen
+
+    def _all():
+        yield from urls
+        for source in sources:
+            yield from iter_source(source)
+
+    for url in _all():
+        if isinstance(url, dict):
+            url = dict(url, url=url["url"].strip())
+            key = url["url"]
+        else:
+            key = url = url.strip()
+        if normalize:
+            key = normalize_url(key)
+        if seen.add(key):
+            yield url
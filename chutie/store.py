@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""A packed screenshot store: screenshots as blobs in one SQLite file
+instead of one file each
+
+Each screenshot is stored under a name derived from its ``(url, pathstr,
+fullPage)`` key (``shots/<sha1>.png``), which is the ``filename`` in its
+metadata. The HTML report links screenshots by ``filename`` as usual, and
+``serve_report`` (``chutie view``) serves them from the store, so that a
+report can be browsed without extracting any files (``extract`` writes
+them out when files are needed, e.g. for ``chutie diff``).
+"""
+
+import collections
+import hashlib
+import http.server
+import json
+import mimetypes
+import os
+import socketserver
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from chutie import encode as capture_encode
+
+DEFAULT_STORE = "chutie.shots.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    name TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    pathstr TEXT NOT NULL,
+    fullPage INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    data BLOB NOT NULL,
+    UNIQUE (url, pathstr, fullPage)
+);
+"""
+
+
+def shot_name(url, pathstr, fullPage, extension=".png"):
+    """
+    Args:
+        url (str): page url
+        pathstr (str): viewport pathstr
+        fullPage (bool): whether it is the full page screenshot
+    Kwargs:
+        extension (str): file extension of the image format
+    Returns:
+        str: the name of the screenshot in a store (a valid, collision-free
+            relative path for any url)
+    """
+    key = json.dumps([url, pathstr, bool(fullPage)])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f"shots/{digest}{extension}"
+
+
+class ScreenshotStore(object):
+    """A SQLite file of screenshots, indexed by name and by
+    ``(url, pathstr, fullPage)``
+
+    A store can be written from several threads (each has its own
+    connection) and processes (SQLite locks the file).
+    """
+
+    def __init__(self, path=DEFAULT_STORE):
+        """
+        Kwargs:
+            path (str): path to the SQLite file (created if needed)
+        """
+        self.path = str(path)
+        self._local = threading.local()
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(
+                self.path, timeout=60, isolation_level=None)
+        return db
+
+    def __getstate__(self):
+        # connections stay in the process (and thread) that opened them
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._local = threading.local()
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def put(self, name, url, pathstr, fullPage, data):
+        """Add (or replace) a screenshot
+
+        Args:
+            name (str): as returned by ``shot_name``
+            url (str): page url
+            pathstr (str): viewport pathstr
+            fullPage (bool): whether it is the full page screenshot
+            data (bytes): the encoded image
+        """
+        self._db().execute(
+            "INSERT OR REPLACE INTO shots"
+            " (name, url, pathstr, fullPage, size, created, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, url, pathstr, int(bool(fullPage)), len(data), time.time(),
+             sqlite3.Binary(data)))
+
+    def write_screenshot(self, data, name, url, pathstr, fullPage,
+                         **encode_options):
+        """Encode a screenshot and add it to the store (as
+        ``chutie.encode.write_screenshot`` writes a file)
+
+        Args:
+            data (bytes): a PNG or JPEG screenshot
+            name, url, pathstr, fullPage: see ``put``
+        Kwargs:
+            encode_options: see ``chutie.encode.encode_screenshot``
+        Returns:
+            int: number of bytes stored
+        """
+        data = capture_encode.encode_screenshot(data, **encode_options)
+        self.put(name, url, pathstr, fullPage, data)
+        return len(data)
+
+    def get(self, url, pathstr, fullPage):
+        """
+        Returns:
+            bytes or None: the screenshot of a url in a viewport
+        """
+        row = self._db().execute(
+            "SELECT data FROM shots"
+            " WHERE url = ? AND pathstr = ? AND fullPage = ?",
+            (url, pathstr, int(bool(fullPage)))).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def read(self, name):
+        """
+        Args:
+            name (str): a screenshot's ``filename``
+        Returns:
+            bytes or None: the screenshot
+        """
+        row = self._db().execute(
+            "SELECT data FROM shots WHERE name = ?", (name,)).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def __contains__(self, name):
+        row = self._db().execute(
+            "SELECT 1 FROM shots WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM shots").fetchone()[0]
+
+    def entries(self):
+        """
+        Yields:
+            dict: ``name``, ``url``, ``pathstr``, ``fullPage`` and ``size``
+                of each screenshot (without reading the images)
+        """
+        rows = self._db().execute(
+            "SELECT name, url, pathstr, fullPage, size FROM shots"
+            " ORDER BY rowid")
+        for name, url, pathstr, fullPage, size in rows:
+            yield collections.OrderedDict([
+                ("name", name), ("url", url), ("pathstr", pathstr),
+                ("fullPage", bool(fullPage)), ("size", size)])
+
+    def extract(self, dest_path, names=None):
+        """Write screenshots out as files
+
+        Args:
+            dest_path (str): directory to write ``<dest_path>/<name>`` into
+        Kwargs:
+            names (iterable[str] or None): names to extract (default: all)
+        Returns:
+            int: number of files written
+        """
+        dest = Path(dest_path)
+        if names is None:
+            names = [entry["name"] for entry in self.entries()]
+        count = 0
+        for name in names:
+            data = self.read(name)
+            if data is None:
+                continue
+            path = dest / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            count += 1
+        return count
+
+
+class ReportHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve a report directory, with screenshots read from a store"""
+
+    store = None
+    report_dir = "."
+
+    def translate_path(self, path):
+        # SimpleHTTPRequestHandler only takes a directory argument in 3.7+
+        path = super().translate_path(path)
+        relpath = os.path.relpath(path, os.getcwd())
+        return os.path.join(self.report_dir, relpath)
+
+    def do_GET(self):
+        name = unquote(urlsplit(self.path).path).lstrip("/")
+        data = self.store.read(name) if name.startswith("shots/") else None
+        if data is None:
+            return super().do_GET()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ReportServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def report_server(store, report_dir=".", host="127.0.0.1", port=8000):
+    """
+    Args:
+        store (ScreenshotStore or str): the store (or the path to it)
+    Kwargs:
+        report_dir (str): directory of the HTML report
+        host (str): address to listen on
+        port (int): port to listen on (0 for any free port)
+    Returns:
+        ReportServer: call ``serve_forever()`` to serve the report
+    """
+    if not isinstance(store, ScreenshotStore):
+        store = ScreenshotStore(store)
+    handler = type("ReportHandler", (ReportHandler,), dict(
+        store=store, report_dir=os.path.abspath(str(report_dir))))
+    return ReportServer((host, port), handler)
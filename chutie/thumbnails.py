@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Downscaled thumbnails of screenshots for lightweight reports
+
+Requires Pillow (``pip install chutie[thumbnails]``).
+"""
+
+import logging
+import os
+from pathlib import Path
+
+from chutie import png
+from chutie import tiles as capture_tiles
+
+THUMBNAILS_DIR = "thumbs"
+DEFAULT_WIDTH = 320
+DEFAULT_MAX_HEIGHT = 2400
+DEFAULT_FORMAT = "webp"
+DEFAULT_QUALITY = 75
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "png": "PNG"}
+EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+
+
+def make_thumbnail(path, thumbnail_path, width=DEFAULT_WIDTH,
+                   max_height=DEFAULT_MAX_HEIGHT, format=DEFAULT_FORMAT,
+                   quality=DEFAULT_QUALITY, band_rows=256):
+    """Write a downscaled copy of a PNG screenshot
+
+    The screenshot is decoded and downscaled band by band, and decoding
+    stops once ``max_height`` rows of thumbnail have been produced, so tall
+    full page screenshots are never fully in memory.
+
+    Args:
+        path (str): path to a PNG screenshot
+        thumbnail_path (str): path to write the thumbnail to
+    Kwargs:
+        width (int): thumbnail width (screenshots are never upscaled)
+        max_height (int): crop the thumbnail to this height
+        format (str): one of ``FORMATS`` (default: webp)
+        quality (int): webp/jpeg quality (1-100)
+        band_rows (int): number of rows to decode at a time
+    Returns:
+        tuple: ``(width, height)`` of the thumbnail
+    """
+    from PIL import Image
+
+    with open(path, "rb") as _file:
+        header = png.read_header(_file.read(33))
+    scale = min(1.0, width / max(header["width"], 1))
+    thumb_width = max(1, round(header["width"] * scale))
+    thumb_height = max(1, min(max_height, round(header["height"] * scale)))
+    thumbnail = Image.new("RGB", (thumb_width, thumb_height), "white")
+
+    rows_done = 0
+    for band in png.iter_bands(str(path), rows=band_rows):
+        top = round(rows_done * scale)
+        rows_done += band.height
+        bottom = min(round(rows_done * scale), thumb_height)
+        if bottom > top:
+            band = band.convert("RGBA").resize(
+                (thumb_width, bottom - top), Image.LANCZOS)
+            thumbnail.paste(band, (0, top), band)
+        if bottom >= thumb_height:
+            break
+
+    Path(thumbnail_path).parent.mkdir(parents=True, exist_ok=True)
+    thumbnail.save(str(thumbnail_path), FORMATS[format], quality=quality)
+    return thumbnail.size
+
+
+def _make_thumbnail(args):
+    """Make one thumbnail (run in a worker process)"""
+    path, thumbnail_path, options = args
+    try:
+        if (os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path)
+                >= os.path.getmtime(path)):
+            return True
+        make_thumbnail(path, thumbnail_path, **options)
+        return True
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning(
+            "could not make a thumbnail of %s: %s", path, e)
+        return False
+
+
+def generate_thumbnails(context, dest_path=".", width=DEFAULT_WIDTH,
+                        max_height=DEFAULT_MAX_HEIGHT, format=DEFAULT_FORMAT,
+                        quality=DEFAULT_QUALITY, processes=None):
+    """Make a thumbnail of every screenshot of a run in a process pool
+
+    Thumbnails are written to ``<dest_path>/thumbs/`` (and are not remade if
+    they are newer than their screenshot). Each screenshot's metadata dict
+    (or each tile's, for a screenshot taken with ``tiles="files"``) gets a
+    ``thumbnail`` path, relative to the same directory as its ``path``.
+
+    Args:
+        context (dict): metadata as returned by ``get_screenshots``
+    Kwargs:
+        dest_path (str): directory the screenshots are in
+        width (int): see ``make_thumbnail``
+        max_height (int): see ``make_thumbnail``
+        format (str): see ``make_thumbnail``
+        quality (int): see ``make_thumbnail``
+        processes (int or None): number of worker processes
+            (default: ``os.cpu_count()``)
+    Returns:
+        dict: ``context``
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    dest = Path(dest_path)
+    options = dict(width=width, max_height=max_height, format=format,
+                   quality=quality)
+    datas, tasks = [], []
+    for pageset in context["pages"].values():
+        for data in pageset:
+            if not data.get("filename"):
+                continue
+            # each tile of a tiled screenshot gets its own thumbnail
+            for item in capture_tiles.screenshot_files(data):
+                name = Path(item["filename"]).stem + EXTENSIONS[format]
+                datas.append((item, name))
+                tasks.append((str(dest / item["filename"]),
+                              str(dest / THUMBNAILS_DIR / name), options))
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(tasks) <= 1:
+        made = [_make_thumbnail(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            made = list(executor.map(_make_thumbnail, tasks, chunksize=8))
+
+    for (data, name), ok in zip(datas, made):
+        if not ok:
+            continue
+        base = Path(data["path"]).parent if data.get("path") else dest
+        data["thumbnail"] = str(base / THUMBNAILS_DIR / name)
+    return context
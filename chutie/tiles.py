@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""Tiled full page screenshots
+
+A full page screenshot makes the browser resize its viewport to the whole
+page and render it as one bitmap, which for very tall pages (feeds, long
+reports) means huge textures in the browser and a huge image in chutie. A
+tiled capture scrolls the page one viewport at a time instead, takes a
+viewport screenshot at each position and either writes each tile to its own
+file (with a manifest of their offsets) or stitches the tiles into one PNG
+as they arrive, so that at most one decoded tile is in memory at a time.
+
+Elements with ``position: fixed`` appear in every tile, and content that
+the page adds as it is scrolled past its initial height is not captured.
+"""
+
+import asyncio
+import functools
+import io
+import os
+
+from chutie import encode as capture_encode
+from chutie import png
+
+_PAGE_HEIGHT_JS = """() => Math.max(
+    document.documentElement.scrollHeight,
+    document.body ? document.body.scrollHeight : 0)"""
+
+# the browser clamps the scroll position at the bottom of the page
+_SCROLL_TO_JS = "(y) => { window.scrollTo(0, y); return window.scrollY; }"
+
+
+def plan_tiles(page_height, tile_height, max_height=None):
+    """
+    Args:
+        page_height (int): height of the page in CSS pixels
+        tile_height (int): height of the viewport in CSS pixels
+    Kwargs:
+        max_height (int or None): capture at most this many CSS pixels
+            of the page (default: None, all of it)
+    Returns:
+        tuple: ``(height, tops)``: the height to capture and the scroll
+            position of each tile, in CSS pixels
+    """
+    height = max(1, page_height)
+    if max_height:
+        height = min(height, max_height)
+    return height, list(range(0, height, max(1, tile_height)))
+
+
+def tile_name(filename, n):
+    """
+    Args:
+        filename (str): name of the full page screenshot
+        n (int): tile number (from 1)
+    Returns:
+        str: e.g. ``example.com__1024x768__full__tile0001.png``
+    """
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}__tile{n:04d}{extension}"
+
+
+def screenshot_files(data):
+    """
+    Args:
+        data (dict): a screenshot metadata dict
+    Returns:
+        list[dict]: the metadata dicts of its image files: its tiles if it
+            was taken with ``tiles="files"`` (each with a ``filename``,
+            ``path``, ``y`` and ``height``), else ``[data]``
+    """
+    tiled = data.get("tiled") or {}
+    if tiled.get("mode") == "files":
+        return list(tiled["tiles"])
+    return [data]
+
+
+class Stitcher(object):
+    """Stitch PNG tiles into one PNG, written row by row as tiles are
+    added (requires Pillow)"""
+
+    def __init__(self, fileobj, width, height, level=6):
+        """
+        Args:
+            fileobj (file): file opened in binary mode to write to
+            width (int): image width in pixels
+            height (int): image height in pixels
+        Kwargs:
+            level (int): zlib compression level
+        """
+        self.width = width
+        self.writer = png.PNGWriter(fileobj, width, height, level=level)
+
+    def add(self, data, skip=0, rows=None):
+        """Decode a tile and append its rows
+
+        Args:
+            data (bytes): a PNG tile
+        Kwargs:
+            skip (int): rows at the top of the tile that a previous tile
+                already added
+            rows (int or None): number of rows to add (default: the rest of
+                the tile); a tile narrower or shorter than that is padded
+                with transparent pixels
+        Returns:
+            int: number of rows added
+        """
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        if rows is None:
+            rows = image.height - skip
+        band = image.convert("RGBA").crop((0, skip, self.width, skip + rows))
+        raw = band.tobytes()
+        stride = self.width * 4
+        self.writer.write_rows(
+            raw[row * stride:(row + 1) * stride] for row in range(rows))
+        return rows
+
+    def close(self):
+        self.writer.close()
+
+
+async def _measure(page, max_height):
+    viewport = page.viewport
+    scale = viewport.get("deviceScaleFactor") or 1
+    page_height = int(await page.evaluate(_PAGE_HEIGHT_JS) or 0)
+    height, tops = plan_tiles(page_height, viewport["height"], max_height)
+    manifest = {
+        "width": int(viewport["width"] * scale),
+        "height": int(height * scale),
+        "truncated": page_height > height,
+    }
+    return scale, viewport["height"], height, tops, manifest
+
+
+async def _scroll_to(page, top):
+    """
+    Returns:
+        int: the scroll position the browser scrolled to
+    """
+    scrolled = await page.evaluate(_SCROLL_TO_JS, top)
+    return top if scrolled is None else int(scrolled)
+
+
+async def stitch_tiles(page, screenshot, fileobj, max_height=None, level=6):
+    """Take a full page screenshot one viewport at a time and stitch the
+    tiles into one PNG
+
+    Args:
+        page (pyppeteer.page.Page): a loaded page
+        screenshot (callable): coroutine function that takes a PNG
+            screenshot of the viewport
+        fileobj (file): file opened in binary mode to write the PNG to
+    Kwargs:
+        max_height (int or None): capture at most this many CSS pixels
+            of the page (default: None, all of it)
+        level (int): zlib compression level
+    Returns:
+        dict: manifest: ``mode``, ``width`` and ``height`` in pixels,
+            ``truncated`` (True if the page is taller than ``max_height``)
+            and the number of ``tiles``
+    """
+    loop = asyncio.get_event_loop()
+    scale, tile_height, height, tops, manifest = await _measure(
+        page, max_height)
+    stitcher = Stitcher(fileobj, manifest["width"], manifest["height"],
+                        level=level)
+    written = 0
+    for top in tops:
+        y = int(await _scroll_to(page, top) * scale)
+        image = await screenshot()
+        end = int(min(top + tile_height, height) * scale)
+        written += await loop.run_in_executor(None, functools.partial(
+            stitcher.add, image, skip=max(0, written - y),
+            rows=end - written))
+    await _scroll_to(page, 0)
+    await loop.run_in_executor(None, stitcher.close)
+    return dict(manifest, mode="stitch", tiles=len(tops))
+
+
+async def write_tiles(page, screenshot, path, max_height=None,
+                      **encode_options):
+    """Take a full page screenshot one viewport at a time and write each
+    tile to its own file, named after ``path`` (see ``tile_name``)
+
+    Args:
+        page (pyppeteer.page.Page): a loaded page
+        screenshot (callable): coroutine function that takes a screenshot
+            of the viewport
+        path (str): path of the full page screenshot (which isn't written)
+    Kwargs:
+        max_height (int or None): capture at most this many CSS pixels
+            of the page (default: None, all of it)
+        encode_options: see ``chutie.encode.encode_screenshot``
+    Returns:
+        dict: manifest: ``mode``, ``width`` and ``height`` in pixels,
+            ``truncated`` and ``tiles``, a list of ``filename``, ``path``
+            and the ``y`` offset and ``height`` of each tile in pixels.
+            The last tile may overlap the one before it.
+    """
+    loop = asyncio.get_event_loop()
+    scale, tile_height, height, tops, manifest = await _measure(
+        page, max_height)
+    dirname, filename = os.path.split(path)
+    tiles = []
+    for n, top in enumerate(tops, 1):
+        y = int(await _scroll_to(page, top) * scale)
+        image = await screenshot()
+        tile = {
+            "filename": tile_name(filename, n),
+            "y": y,
+            "height": int(tile_height * scale),
+        }
+        tile["path"] = os.path.join(dirname, tile["filename"])
+        await loop.run_in_executor(None, functools.partial(
+            capture_encode.write_screenshot, image, tile["path"],
+            **encode_options))
+        tiles.append(tile)
+    await _scroll_to(page, 0)
+    return dict(manifest, mode="files", tiles=tiles)
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+
+"""A work queue of (url, viewport) capture tasks in a SQLite file, so that
+several ``chutie worker`` processes (on one or more machines with shared
+storage) can work on the same run
+
+Workers claim tasks atomically and hold a lease on them, which they renew
+with heartbeats while they work. The tasks of a worker that stops renewing
+its leases (e.g. because its machine crashed) are claimed again by other
+workers once the leases expire. ``assemble`` builds the ``chutie.json``
+metadata of the run from the finished tasks.
+
+The database uses SQLite's default rollback journal (not WAL), which works
+on network filesystems with working POSIX locks.
+"""
+
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from chutie import assets as capture_assets
+from chutie import encode as capture_encode
+from chutie import metrics as capture_metrics
+from chutie import readiness as capture_readiness
+from chutie import recovery as capture_recovery
+from chutie import scheduler as capture_scheduler
+
+DEFAULT_LEASE = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+# get_screenshots options that are stored with the queue, so that every
+# worker takes the same screenshots
+RUN_OPTIONS = (
+    "reload_per_viewport", "single_capture", "intercept", "readiness",
+    "image_format", "quality", "clip", "element", "optimize", "tiles",
+    "max_height", "scheduler",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    pathstr TEXT NOT NULL,
+    readiness TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    updated REAL,
+    UNIQUE (url, pathstr)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);
+"""
+
+# states of a task
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+
+def default_worker_id():
+    """
+    Returns:
+        str: ``<hostname>-<pid>-<random>``
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkQueue(object):
+    """A SQLite file of (url, viewport) capture tasks"""
+
+    def __init__(self, path, lease=DEFAULT_LEASE,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Args:
+            path (str): path to the SQLite file (created if needed)
+        Kwargs:
+            lease (float): seconds a claimed task stays leased to a worker
+                without a heartbeat
+            max_attempts (int): claims of a task (by workers whose leases
+                then expired) before it is recorded as failed
+        """
+        self.path = str(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _transaction(self):
+        """
+        Returns:
+            sqlite3.Cursor: a cursor in an ``IMMEDIATE`` transaction (which
+                holds the write lock, so claims are atomic across
+                processes); commit with ``COMMIT``
+        """
+        cursor = self._db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        return cursor
+
+    def _get(self, key, default=None):
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(
+            row[0], object_pairs_hook=collections.OrderedDict)
+
+    def _set(self, cursor, key, value):
+        cursor.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)))
+
+    @property
+    def viewports(self):
+        """dict: ``{pathstr: viewport dict}`` of the queued tasks"""
+        return self._get("viewports", collections.OrderedDict())
+
+    @property
+    def options(self):
+        """dict: the ``RUN_OPTIONS`` the queue was created with"""
+        return self._get("options", {})
+
+    def enqueue(self, urls, viewports, options=None):
+        """Add a task for each url x viewport (tasks that are already
+        queued are left as they are)
+
+        Args:
+            urls (iterable[str or dict]): urls (consumed lazily); a url may
+                be a dict with a ``url`` key and readiness strategy
+                overrides, as in ``get_screenshots``
+            viewports (dict): ``{pathstr: viewport dict}`` as built by
+                ``chutie.chutie._build_viewports``
+        Kwargs:
+            options (dict or None): ``RUN_OPTIONS`` for the workers
+                (replacing any that were stored before)
+        Returns:
+            int: number of tasks added
+        Raises:
+            ValueError: on an unknown option
+        """
+        unknown = set(options or {}) - set(RUN_OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown queue options: {', '.join(unknown)}")
+        cursor = self._transaction()
+        try:
+            if self._get("date") is None:
+                self._set(cursor, "date", datetime.datetime.now().isoformat())
+            _viewports = self.viewports
+            _viewports.update(viewports)
+            self._set(cursor, "viewports", _viewports)
+            if options is not None:
+                self._set(cursor, "options", options)
+            before = self._db.total_changes
+            cursor.executemany(
+                "INSERT OR IGNORE INTO tasks (url, pathstr, readiness,"
+                " updated) VALUES (?, ?, ?, ?)",
+                ((url, pathstr, readiness, time.time())
+                 for url, readiness in _split_readiness(urls)
+                 for pathstr in viewports))
+            added = self._db.total_changes - before
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker, limit=1):
+        """Lease pending tasks (or tasks whose lease expired) to a worker
+
+        Args:
+            worker (str): worker id
+        Kwargs:
+            limit (int): maximum number of tasks to claim
+        Returns:
+            list[tuple]: ``(url, pathstr, readiness)`` of the claimed tasks,
+                in the order they were queued (``readiness`` is a dict of
+                the url's readiness overrides, or None)
+        """
+        now = time.time()
+        cursor = self._transaction()
+        try:
+            self._fail_abandoned(cursor, now)
+            rows = cursor.execute(
+                "SELECT id, url, pathstr, readiness FROM tasks"
+                " WHERE state = ? OR (state = ? AND lease_until < ?)"
+                " ORDER BY id LIMIT ?",
+                (PENDING, LEASED, now, limit)).fetchall()
+            cursor.executemany(
+                "UPDATE tasks SET state = ?, worker = ?, lease_until = ?,"
+                " attempts = attempts + 1, updated = ? WHERE id = ?",
+                ((LEASED, worker, now + self.lease, now, row[0])
+                 for row in rows))
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return [
+            (url, pathstr, json.loads(readiness) if readiness else None)
+            for _, url, pathstr, readiness in rows]
+
+    def _fail_abandoned(self, cursor, now):
+        """Record expired tasks that were already claimed
+        ``max_attempts`` times as failed"""
+        rows = cursor.execute(
+            "SELECT id, url, pathstr, worker FROM tasks"
+            " WHERE state = ? AND lease_until < ? AND attempts >= ?",
+            (LEASED, now, self.max_attempts)).fetchall()
+        viewports = self.viewports
+        for task_id, url, pathstr, worker in rows:
+            data = dict(url=url, failed=True, error=(
+                f"abandoned by {self.max_attempts} workers"
+                f" (the last was {worker})"))
+            data.update(viewports.get(pathstr, {"pathstr": pathstr}))
+            cursor.execute(
+                "UPDATE tasks SET state = ?, result = ?, updated = ?"
+                " WHERE id = ?", (FAILED, json.dumps([data]), now, task_id))
+
+    def heartbeat(self, worker):
+        """Renew the leases of a worker's tasks
+
+        Returns:
+            int: number of leases renewed
+        """
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE tasks SET lease_until = ? WHERE state = ? AND worker = ?",
+            (now + self.lease, LEASED, worker))
+        return cursor.rowcount
+
+    def complete(self, worker, url, datas):
+        """Record the screenshots (or failures) of a url's tasks
+
+        Args:
+            worker (str): worker id
+            url (str): url
+            datas (list[dict]): screenshot metadata of one or more of the
+                url's viewports
+        """
+        by_pathstr = collections.OrderedDict()
+        for data in datas:
+            by_pathstr.setdefault(data["pathstr"], []).append(data)
+        now = time.time()
+        cursor = self._transaction()
+        try:
+            for pathstr, _datas in by_pathstr.items():
+                state = FAILED if all(
+                    data.get("failed") for data in _datas) else DONE
+                # a late result still counts, unless another worker's
+                # screenshots were recorded first
+                cursor.execute(
+                    "UPDATE tasks SET state = ?, worker = ?, result = ?,"
+                    " updated = ? WHERE url = ? AND pathstr = ?"
+                    " AND state != ?",
+                    (state, worker, json.dumps(_datas), now, url, pathstr,
+                     DONE))
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def release(self, worker):
+        """Return a worker's unfinished tasks to the queue (e.g. when it is
+        stopped)"""
+        self._db.execute(
+            "UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL,"
+            " attempts = MAX(attempts - 1, 0) WHERE state = ? AND worker = ?",
+            (PENDING, LEASED, worker))
+
+    def counts(self):
+        """
+        Returns:
+            dict: number of tasks in each state
+        """
+        counts = {state: 0 for state in (PENDING, LEASED, DONE, FAILED)}
+        counts.update(self._db.execute(
+            "SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+        return counts
+
+    def unfinished(self, worker=None):
+        """
+        Kwargs:
+            worker (str or None): ignore the tasks leased to this worker
+        Returns:
+            bool: whether any task is pending or leased
+        """
+        return self._db.execute(
+            "SELECT 1 FROM tasks WHERE state = ?"
+            " OR (state = ? AND worker IS NOT ?) LIMIT 1",
+            (PENDING, LEASED, worker)).fetchone() is not None
+
+    def assemble(self, dest_path=None):
+        """Build the run's metadata from the finished tasks
+
+        Kwargs:
+            dest_path (str or None): rewrite each screenshot's ``path`` to
+                be in this directory (workers may mount it elsewhere)
+        Returns:
+            dict: metadata in the ``chutie.json`` format, in the order the
+                urls were queued and in viewport order, with the task
+                ``counts`` as ``metadata["queue"]``
+        """
+        viewports = self.viewports
+        order = {pathstr: n for n, pathstr in enumerate(viewports)}
+        pages = collections.OrderedDict()
+        rows = self._db.execute(
+            "SELECT url, pathstr, result FROM tasks WHERE result IS NOT NULL"
+            " ORDER BY id")
+        for url, pathstr, result in rows:
+            pages.setdefault(url, []).append((order.get(pathstr), result))
+        for url, results in pages.items():
+            results.sort(key=lambda item: item[0])
+            datas = []
+            for _, result in results:
+                datas.extend(json.loads(
+                    result, object_pairs_hook=collections.OrderedDict))
+            pages[url] = datas
+        if dest_path is not None:
+            for datas in pages.values():
+                for data in datas:
+                    if data.get("filename") and not data.get("store"):
+                        data["path"] = os.path.join(
+                            str(dest_path), data["filename"])
+        return collections.OrderedDict([
+            ("date", self._get("date")),
+            ("urls", list(pages)),
+            ("viewports", viewports),
+            ("pages", pages),
+            ("queue", self.counts()),
+        ])
+
+
+def _split_readiness(urls):
+    """
+    Yields:
+        tuple: ``(url, readiness)``: each url and a JSON dict of its
+            readiness overrides (or None)
+    """
+    for url in urls:
+        if isinstance(url, dict):
+            options = dict(url)
+            url = options.pop("url")
+            yield url, json.dumps(options) if options else None
+        else:
+            yield url, None
+
+
+def _group_jobs(tasks, reload_per_viewport=False):
+    """
+    Args:
+        tasks (list[tuple]): ``(url, pathstr, readiness)`` tasks in queue
+            order
+    Returns:
+        list[tuple]: ``(url, [pathstr, ...])`` capture jobs (one per url,
+            or one per task if ``reload_per_viewport``)
+    """
+    if reload_per_viewport:
+        return [(url, [pathstr]) for url, pathstr, _ in tasks]
+    jobs = collections.OrderedDict()
+    for url, pathstr, _ in tasks:
+        jobs.setdefault(url, []).append(pathstr)
+    return list(jobs.items())
+
+
+async def _claim_jobs(queue, worker, batch, url_readiness, base=None,
+                      reload_per_viewport=False, wait=True, poll=5):
+    """Claim tasks as the capture workers need them
+
+    Args:
+        url_readiness (dict): ``{url: strategy}`` to add the readiness
+            overrides of claimed urls to
+    Kwargs:
+        base (dict or None): the run's readiness strategy
+    Yields:
+        tuple: ``(url, [pathstr, ...])`` capture jobs
+    """
+    while True:
+        tasks = queue.claim(worker, limit=batch)
+        if not tasks:
+            # other workers' tasks may still come back when leases expire
+            if not wait or not queue.unfinished(worker):
+                return
+            await asyncio.sleep(poll)
+            continue
+        for url, _, readiness in tasks:
+            if readiness:
+                url_readiness[url] = capture_readiness.make_strategy(
+                    readiness, base=base)
+        for job in _group_jobs(tasks, reload_per_viewport):
+            yield job
+
+
+async def _heartbeat(queue, worker):
+    while True:
+        await asyncio.sleep(queue.lease / 3)
+        try:
+            queue.heartbeat(worker)
+        except sqlite3.OperationalError:
+            # e.g. "database is locked": try again on the next tick, while
+            # the leases are still good
+            logging.getLogger().warning(
+                "worker %s could not renew its leases", worker,
+                exc_info=True)
+
+
+async def run_worker(queue, dest_path=".", worker=None, concurrency=1,
+                     batch=None, wait=True, poll=5, **capture_options):
+    """Take the screenshots of queued tasks until the queue is done
+
+    Args:
+        queue (WorkQueue or str): the queue (or the path to its file)
+    Kwargs:
+        dest_path (str): directory to write screenshots into (shared by
+            the workers)
+        worker (str or None): worker id (default: ``default_worker_id()``)
+        concurrency (int): number of tabs to take screenshots in at once
+        batch (int or None): number of tasks to claim at once
+            (default: a url's viewports per tab)
+        wait (bool): when there is nothing to claim, wait for other
+            workers' tasks to be done (or for their leases to expire)
+            instead of stopping
+        poll (float): seconds between claims while waiting
+        capture_options: ``retry``, ``cache`` or ``store``, ``metrics``,
+            ``profile``, ``assets``, ``prewarm``, ``browser_endpoint`` and
+            other ``get_screenshots`` options (the queue's own
+            ``RUN_OPTIONS`` take precedence)
+    Returns:
+        dict: ``{"worker": ..., "urls": n, "screenshots": n, "failed": n}``
+            (and ``asset_cache`` and ``browser_cache`` hit ratios and
+            ``scheduler`` counts if set)
+    """
+    from chutie import chutie
+
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    worker = worker or default_worker_id()
+    viewports = queue.viewports
+    options = dict(capture_options, **queue.options)
+    reload_per_viewport = options.pop("reload_per_viewport", False)
+    readiness = options["readiness"] = capture_readiness.make_strategy(
+        options.get("readiness"))
+    url_readiness = options["url_readiness"] = {}
+    options["deadline"] = chutie._deadline_at(options.get("deadline"))
+    options["intercept"] = chutie._open_intercept(options.get("intercept"))
+    options["store"] = chutie._open_store(
+        options.get("store"), options.get("cache"))
+    options["cache"] = chutie._open_cache(options.get("cache"))
+    options["metrics"] = capture_metrics.open_recorder(options.get("metrics"))
+    options["retry"] = capture_recovery.open_policy(options.get("retry"))
+    scheduler = options["scheduler"] = capture_scheduler.open_scheduler(
+        options.get("scheduler"))
+    profile = options["profile"] = capture_assets.open_profile(
+        options.get("profile"))
+    assets = options["assets"] = capture_assets.open_asset_cache(
+        options.get("assets"))
+    options.update(chutie._screenshot_options(**{
+        key: options.pop(key, None)
+        for key in capture_encode.SCREENSHOT_OPTIONS}))
+    batch = batch or max(1, len(viewports)) * max(1, concurrency)
+    dest = chutie._ensure_dest(dest_path)
+    stats = dict(worker=worker, urls=0, screenshots=0, failed=0)
+
+    def on_result(url, datas):
+        queue.complete(worker, url, datas)
+        stats["urls"] += 1
+        failed = sum(1 for data in datas if data.get("failed"))
+        stats["failed"] += failed
+        stats["screenshots"] += len(datas) - failed
+
+    heartbeat = asyncio.ensure_future(_heartbeat(queue, worker))
+    try:
+        await chutie._capture_jobs(
+            _claim_jobs(queue, worker, batch, url_readiness, base=readiness,
+                        reload_per_viewport=reload_per_viewport,
+                        wait=wait, poll=poll),
+            viewports, dest, concurrency=concurrency, on_result=on_result,
+            **options)
+    finally:
+        heartbeat.cancel()
+        queue.release(worker)
+    chutie._finish_assets(stats, assets, profile)
+    chutie._finish_scheduler(stats, scheduler)
+    logging.getLogger().info("worker %s done: %s", worker, stats)
+    return stats
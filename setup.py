@@ -13,9 +13,19 @@ with open('HISTORY.rst') as history_file:
 
 requirements = ['Click>=6.0', 'syncer', 'pyppeteer', 'pyyaml', "jinja2"]
 
+extras_requirements = {
+    'diff': ['numpy', 'Pillow'],
+    'dedupe': ['numpy', 'Pillow'],
+    'thumbnails': ['Pillow'],
+    'encode': ['Pillow'],
+    'webp': ['Pillow'],
+    'stitch': ['Pillow'],
+    'publicsuffix': ['publicsuffix2'],
+}
+
 setup_requirements = [ ]
 
-test_requirements = ['syncer']
+test_requirements = ['syncer', 'numpy', 'Pillow']
 
 setup(
     author="Wes Turner",
@@ -35,6 +45,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="BSD license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
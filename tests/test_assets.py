@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.assets`."""
+
+
+import asyncio
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import assets
+from chutie import chutie
+from chutie import cli
+from chutie import intercept
+from tests.test_chutie import FakeBrowser, FakePage
+from tests.test_intercept import FakeRequest
+
+
+class FakeResponse(object):
+
+    def __init__(self, request, body, status=200, headers=None,
+                 fromCache=False):
+        self.request = request
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.fromCache = fromCache
+
+    async def buffer(self):
+        return self.body
+
+
+class InterceptedPage(FakePage):
+    """A page that records its event handlers and intercepted requests"""
+
+    mainFrame = object()
+
+    def __init__(self, browser):
+        super().__init__(browser)
+        self.handlers = {}
+
+    async def setRequestInterception(self, value):
+        self.browser.calls.append(("intercept", value))
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+
+class InterceptedBrowser(FakeBrowser):
+
+    async def newPage(self):
+        page = InterceptedPage(self)
+        self.pages.append(page)
+        return page
+
+
+class CachedRequest(FakeRequest):
+
+    method = "GET"
+
+    async def respond(self, response):
+        self.outcome = ("responded", response["body"])
+
+
+class TestAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_asset_cache(self):
+        cache = assets.AssetCache(max_bytes=10, max_entry_bytes=6)
+        self.assertTrue(cache.put("https://a.test/a.css", 200, {
+            "Content-Type": "text/css", "Content-Length": "4"}, b"aaaa"))
+        self.assertTrue(cache.put("https://a.test/b.js", 200, {}, b"bbbb"))
+        # not storable
+        self.assertFalse(cache.put("https://a.test/c.js", 404, {}, b"c"))
+        self.assertFalse(cache.put("https://a.test/c.js", 200, {
+            "Cache-Control": "no-store"}, b"c"))
+        self.assertFalse(cache.put("https://a.test/c.js", 200, {
+            "Set-Cookie": "a=b"}, b"c"))
+        self.assertFalse(cache.put("https://a.test/c.js", 200, {}, b"c" * 7))
+
+        entry = cache.lookup("https://a.test/a.css", "stylesheet")
+        self.assertEqual(entry["body"], b"aaaa")
+        self.assertEqual(entry["headers"], {"content-type": "text/css"})
+        self.assertIsNone(cache.lookup("https://a.test/a.css", "document"))
+        self.assertIsNone(cache.lookup("https://a.test/a.css", "stylesheet",
+                                       method="POST"))
+        self.assertIsNone(cache.lookup("https://a.test/x.css", "stylesheet"))
+
+        # b.js is the least recently used
+        cache.put("https://a.test/d.png", 200, {}, b"dddd")
+        self.assertNotIn("https://a.test/b.js", cache)
+        self.assertIn("https://a.test/a.css", cache)
+        self.assertEqual(cache.bytes, 8)
+
+        stats = cache.to_dict()
+        self.assertEqual(
+            (stats["requests"], stats["hits"], stats["evicted"]), (2, 1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(len(copy), 0)
+        self.assertEqual(copy.stats, cache.stats)
+
+        self.assertIsNone(assets.open_asset_cache(0))
+        self.assertEqual(assets.open_asset_cache(100).max_bytes, 100)
+        self.assertIs(assets.open_asset_cache(cache), cache)
+
+    def test_attach(self):
+        cache = assets.AssetCache()
+        blocker = intercept.Interceptor(["fonts"])
+        page = InterceptedPage(FakeBrowser())
+        page_url = "https://www.example.com/"
+        sync(intercept.attach(page, page_url, intercept=blocker,
+                              assets=cache))
+        on_request, = page.handlers["request"]
+        on_response, = page.handlers["response"]
+
+        @sync
+        async def run():
+            first = CachedRequest(page_url + "a.css", "stylesheet")
+            on_request(first)
+            on_response(FakeResponse(first, b"body"))
+            # the body is stored (and requests handled) in tasks
+            await asyncio.sleep(0)
+            requests = [
+                CachedRequest(page_url + "a.css", "stylesheet"),
+                CachedRequest(page_url + "f.woff2", "font"),
+                CachedRequest(page_url, "document", frame=page.mainFrame,
+                              navigation=True),
+            ]
+            for request in requests:
+                on_request(request)
+            await asyncio.sleep(0)
+            return first, requests
+
+        first, requests = run()
+        self.assertEqual(first.outcome, "continued")
+        self.assertEqual([request.outcome for request in requests], [
+            ("responded", b"body"), "aborted", "continued"])
+        self.assertEqual(blocker.stats["blocked"], 1)
+        self.assertEqual((cache.stats["requests"], cache.stats["hits"]),
+                         (2, 1))
+
+    def test_profile(self):
+        # the CLI default (in MB) is spelled out so that `chutie --help`
+        # doesn't import this module
+        option, = [param for param in cli.screenshots.params
+                   if param.name == "disk_cache_size"]
+        self.assertEqual(
+            option.default * 1024 ** 2, assets.DEFAULT_DISK_CACHE_SIZE)
+        profile = assets.BrowserProfile(self.path / "profile",
+                                        disk_cache_size=10)
+        first, second = profile.acquire(), profile.acquire()
+        self.assertNotEqual(first, second)
+        options = profile.launch_options(first)
+        self.assertEqual(options["userDataDir"], str(first / "user-data"))
+        self.assertIn(f"--disk-cache-dir={first / 'disk-cache'}",
+                      options["args"])
+        self.assertIn("--disk-cache-size=10", options["args"])
+
+        for slot in (first, second):
+            (slot / "disk-cache").mkdir()
+            (slot / "disk-cache" / "data").write_bytes(b"x" * 11)
+        profile.release(first)
+        # only the unlocked slot is trimmed
+        self.assertEqual(profile.evict(), 1)
+        self.assertFalse((first / "disk-cache").exists())
+        self.assertTrue((second / "disk-cache").exists())
+        self.assertEqual(profile.acquire(), first)
+
+        copy = pickle.loads(pickle.dumps(profile))
+        self.assertEqual(copy.path, profile.path)
+        # as in another process: the locked slots are not free
+        self.assertNotIn(copy.acquire(), (first, second))
+
+        self.assertIsNone(assets.open_profile(None))
+        self.assertEqual(
+            assets.open_profile(str(self.path)).path, self.path)
+
+    def test_get_screenshots(self):
+        viewports = ["64x48", "32x16"]
+        browser = InterceptedBrowser()
+        context = sync(chutie.get_screenshots(
+            ["about:blank#a"], viewports, self.path, assets=1024,
+            prewarm=["about:blank#warm"], browser=browser))
+        self.assertEqual(
+            [call[1] for call in browser.calls if call[0] == "goto"],
+            ["about:blank#warm", "about:blank#a"])
+        self.assertEqual(len(context["pages"]["about:blank#a"]), 4)
+        self.assertEqual(context["asset_cache"]["max_bytes"], 1024)
+        self.assertIsNone(context["asset_cache"]["hit_ratio"])
+        self.assertNotIn("browser_cache", context)
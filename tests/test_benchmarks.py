@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `benchmarks` synthetic site and result comparison."""
+
+
+import json
+import tempfile
+import unittest
+import urllib.request
+from pathlib import Path
+
+from benchmarks import bench_capture
+from benchmarks import bench_import
+from benchmarks import synthetic_site
+from chutie import png
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_synthetic_site(self):
+        with synthetic_site.running_site() as base_url:
+            url, = synthetic_site.page_urls(
+                base_url, 1, size=20, depth=7, images=3, height=5000)
+            with urllib.request.urlopen(url) as response:
+                html = response.read().decode("utf-8")
+            image_url = f"{base_url}/image/0-0.png?image_kb=16"
+            with urllib.request.urlopen(image_url) as response:
+                image = response.read()
+        self.assertAlmostEqual(len(html), 20 * 1024, delta=200)
+        self.assertEqual(html.count("<div>"), 7)
+        self.assertEqual(html.count("<img "), 3)
+        self.assertIn("min-height: 5000px", html)
+        header = png.read_header(image)
+        self.assertEqual((header["width"], header["height"]), (256, 16))
+        self.assertGreater(len(image), 16 * 1024)
+
+    def test_compare(self):
+        self.assertEqual(bench_capture.parse_scales("1x1, 4X2"),
+                         [(1, 1), (4, 2)])
+        baseline = {"results": [
+            dict(name="1x1", captures_per_sec=10.0, p50=0.1, p95=0.2)]}
+        current = {"results": [
+            dict(name="1x1", captures_per_sec=8.0, p50=0.1, p95=0.21),
+            dict(name="4x2", captures_per_sec=1.0, p50=1.0, p95=1.0)]}
+        rows = bench_capture.compare(current, baseline, tolerance=0.1)
+        self.assertEqual(
+            [(row["metric"], row["regression"]) for row in rows],
+            [("captures_per_sec", True), ("p50", False), ("p95", False)])
+        self.assertAlmostEqual(rows[0]["change"], 0.2)
+
+    def test_import_time(self):
+        # no subcommand imports the browser, YAML or jinja2 to start
+        for args in [["--help"]] + [
+                [name, "--help"] for name in bench_import.commands()]:
+            result = bench_import.measure(args, repeat=1)
+            self.assertEqual(result["modules"], [], result["name"])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jsonpath = Path(tmpdir) / "chutie.json"
+            output = Path(tmpdir) / "chutie.html"
+            jsonpath.write_text(json.dumps(
+                dict(urls=[], viewports={}, pages={})))
+            result = bench_import.measure(
+                ["template", "-f", str(jsonpath), "-o", str(output)],
+                repeat=1)
+            self.assertTrue(output.exists())
+        self.assertEqual(result["modules"], ["jinja2"])
+
+        rows = bench_import.compare(
+            {"results": [dict(name="--help", seconds=0.2, modules=[])]},
+            {"results": [dict(name="--help", seconds=0.1, modules=[])]})
+        self.assertTrue(rows[0]["regression"])
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.cache`."""
+
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import cache
+
+
+class FakeResponse(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakePage(object):
+    async def content(self):
+        return "<html></html>"
+
+
+class TestCaptureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.src = self.path / "src"
+        self.dest = self.path / "dest"
+        self.src.mkdir()
+        self.dest.mkdir()
+        self.cache = cache.CaptureCache(self.path / "cache")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_datas(self, name, content=b"png"):
+        (self.src / name).write_bytes(content)
+        return [{"filename": name, "path": str(self.src / name),
+                 "fullPage": False}]
+
+    def test_page_fingerprint(self):
+        page = FakePage()
+        self.assertEqual(
+            sync(cache.page_fingerprint(page, FakeResponse({"ETag": "abc"}))),
+            "etag:abc")
+        self.assertEqual(
+            sync(cache.page_fingerprint(
+                page, FakeResponse({"last-modified": "then"}))),
+            "last-modified:then")
+        fingerprint = sync(cache.page_fingerprint(page, FakeResponse({})))
+        self.assertTrue(fingerprint.startswith("dom:"))
+
+    def test_key(self):
+        key = self.cache.key("u", {"width": 1}, "etag:a")
+        self.assertEqual(key, self.cache.key("u", {"width": 1}, "etag:a"))
+        self.assertNotEqual(key, self.cache.key("u", {"width": 1}, "etag:b"))
+        self.assertNotEqual(
+            key, self.cache.key("u", {"width": 1}, "etag:a",
+                                {"single_capture": True}))
+
+    def test_store_restore(self):
+        key = self.cache.key("u", {}, "etag:a")
+        self.assertIsNone(self.cache.restore(key, self.dest))
+        self.cache.store(key, self.make_datas("a.png"))
+        datas = self.cache.restore(key, self.dest)
+        self.assertEqual(len(datas), 1)
+        self.assertTrue(datas[0]["cached"])
+        self.assertEqual(datas[0]["path"], str(self.dest / "a.png"))
+        self.assertEqual((self.dest / "a.png").read_bytes(), b"png")
+
+    def test_evict(self):
+        now = time.time()
+        for n, age in enumerate((100, 50, 10)):
+            key = self.cache.key("u", {}, str(n))
+            self.cache.store(key, self.make_datas(f"{n}.png", b"x" * 100))
+            metapath = self.cache._entry(key) / "meta.json"
+            os.utime(str(metapath), (now - age, now - age))
+
+        self.cache.max_age = 75
+        self.cache.max_bytes = None
+        self.assertEqual(self.cache.evict(now=now), 1)
+        self.assertIsNone(
+            self.cache.restore(self.cache.key("u", {}, "0"), self.dest))
+
+        self.cache.max_age = None
+        self.cache.max_bytes = 300
+        self.assertEqual(self.cache.evict(now=now), 1)
+        self.assertIsNone(
+            self.cache.restore(self.cache.key("u", {}, "1"), self.dest))
+        self.assertIsNotNone(
+            self.cache.restore(self.cache.key("u", {}, "2"), self.dest))
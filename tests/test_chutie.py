@@ -4,14 +4,78 @@
 """Tests for `chutie` package."""
 
 
+import asyncio
+import tempfile
 import unittest
 from pathlib import Path
 
 from click.testing import CliRunner
+from pyppeteer.errors import TimeoutError
 from syncer import sync
 
 from chutie import chutie
 from chutie import cli
+from chutie import journal as capture_journal
+from chutie import png
+
+
+class FakePage(object):
+    """A minimal stand-in for a pyppeteer Page that records calls"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.url = "about:blank"
+        self.viewport = None
+        self.closed = False
+
+    async def setViewport(self, viewport):
+        self.viewport = viewport
+
+    async def goto(self, url, **kwargs):
+        self.browser.calls.append(("goto", url))
+        if url.startswith("slow:"):
+            raise TimeoutError("Navigation Timeout Exceeded: 1 ms exceeded.")
+        self.url = url
+
+    async def evaluate(self, js, *args):
+        self.browser.calls.append(("evaluate",))
+
+    async def screenshot(self, options=None, **kwargs):
+        options = dict(options or {}, **kwargs)
+        self.browser.calls.append(
+            ("screenshot", self.viewport["pathstr"], options["fullPage"],
+             options))
+        viewport = self.viewport
+        height = viewport["height"] * (2 if options["fullPage"] else 1)
+        data = png.encode(
+            (bytes(viewport["width"] * 4) for _ in range(height)),
+            viewport["width"], height)
+        if options.get("path"):
+            Path(options["path"]).write_bytes(data)
+        return data
+
+    async def title(self):
+        return "title"
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser(object):
+    wsEndpoint = "ws://127.0.0.1:9222/devtools/browser/fake"
+
+    def __init__(self):
+        self.calls = []
+        self.pages = []
+        self.closed = False
+
+    async def newPage(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        self.closed = True
 
 
 class TestChutie(unittest.TestCase):
@@ -69,6 +133,179 @@ class TestChutie(unittest.TestCase):
         )
         self.assertEqual(chutie.viewportstr_to_dict(i), o)
 
+    def test_020_iter_jobs(self):
+        viewports = {"1024x768": {}, "800x600": {}}
+        jobs = list(chutie._iter_jobs(["a", "b"], viewports))
+        self.assertEqual(jobs, [
+            ("a", ["1024x768", "800x600"]),
+            ("b", ["1024x768", "800x600"]),
+        ])
+        jobs = list(chutie._iter_jobs(["a", "b"], viewports,
+                                      reload_per_viewport=True))
+        self.assertEqual(jobs, [
+            ("a", ["1024x768"]),
+            ("a", ["800x600"]),
+            ("b", ["1024x768"]),
+            ("b", ["800x600"]),
+        ])
+
+    def test_030_run_pool(self):
+        running = []
+        peak = []
+
+        async def worker(job):
+            running.append(job)
+            peak.append(len(running))
+            # finish later jobs first
+            await asyncio.sleep(0.001 * (10 - job))
+            running.remove(job)
+            return job * 2
+
+        results = sync(chutie._run_pool(iter(range(10)), worker,
+                                        concurrency=3))
+        self.assertEqual(results, [job * 2 for job in range(10)])
+        self.assertEqual(max(peak), 3)
+
+        results = sync(chutie._run_pool([], worker, concurrency=3))
+        self.assertEqual(results, [])
+
+    def test_040_split_shards(self):
+        jobs = list("abcde")
+        shards = chutie._split_shards(jobs, 2)
+        self.assertEqual(shards, [
+            [(0, "a"), (2, "c"), (4, "e")],
+            [(1, "b"), (3, "d")],
+        ])
+        self.assertEqual(len(chutie._split_shards(jobs, 8)), 5)
+        self.assertEqual(chutie._split_shards([], 4), [])
+
+    def test_050_capture_job(self):
+        viewports = chutie._build_viewports(
+            ["1024x768", "320x568 mobile", "800x600"])
+        browser = FakeBrowser()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datas = sync(chutie._capture_job(
+                browser, Path(tmpdir), viewports,
+                ("about:blank", list(viewports))))
+        self.assertEqual(
+            [call for call in browser.calls if call[0] == "goto"],
+            [("goto", "about:blank")])
+        self.assertEqual(len(browser.pages), 1)
+        self.assertTrue(browser.pages[0].closed)
+        # the mobile viewport is captured last but returned in order
+        shots = [call[1] for call in browser.calls if call[0] == "screenshot"]
+        self.assertEqual(shots[-1], "320x568-mobile")
+        self.assertEqual(
+            [(data["pathstr"], data["fullPage"]) for data in datas],
+            [("1024x768", False), ("1024x768", True),
+             ("320x568-mobile", False), ("320x568-mobile", True),
+             ("800x600", False), ("800x600", True)])
+
+    def test_060_capture_job_single_capture(self):
+        viewports = chutie._build_viewports(["64x48", "32x16 mobile"])
+        browser = FakeBrowser()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datas = sync(chutie._capture_job(
+                browser, Path(tmpdir), viewports,
+                ("about:blank", list(viewports)), single_capture=True))
+            sizes = [
+                (png.read_header(Path(data["path"]).read_bytes())["height"],
+                 data["fullPage"])
+                for data in datas]
+        self.assertEqual(
+            [call[2] for call in browser.calls if call[0] == "screenshot"],
+            [True, True])
+        self.assertEqual(
+            sizes, [(48, False), (96, True), (16, False), (32, True)])
+
+    def test_065_capture_job_failed(self):
+        viewports = chutie._build_viewports(["64x48", "32x16"])
+        browser = FakeBrowser()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = capture_journal.Journal(Path(tmpdir) / "chutie.jsonl")
+            datas = sync(chutie._capture_job(
+                browser, Path(tmpdir), viewports,
+                ("slow:page", list(viewports)), journal=journal))
+            records = list(journal)
+        self.assertTrue(browser.pages[0].closed)
+        self.assertEqual(
+            [call for call in browser.calls if call[0] == "screenshot"], [])
+        self.assertEqual([data["pathstr"] for data in datas],
+                         ["64x48", "32x16"])
+        self.assertTrue(all(data["failed"] for data in datas))
+        self.assertIn("Navigation Timeout", datas[0]["error"])
+        self.assertNotIn("filename", datas[0])
+        self.assertEqual([record["type"] for record in records],
+                         ["failure", "failure"])
+
+        context = dict(date="now", viewports=viewports,
+                       pages={"slow:page": datas})
+        html = chutie.render_template(context)
+        self.assertIn("Navigation Timeout", html)
+
+    def test_070_split_resumed(self):
+        done = {
+            ("a", "1024x768", False): {"n": 1},
+            ("a", "1024x768", True): {"n": 2},
+            ("a", "800x600", False): {"n": 3},
+        }
+        todo, previous = chutie._split_resumed(
+            ("a", ["1024x768", "800x600"]), done)
+        self.assertEqual(todo, ["800x600"])
+        self.assertEqual(previous, {"1024x768": [{"n": 1}, {"n": 2}]})
+
+    def test_080_paginate(self):
+        pages = {"a": [1, 2], "b": [3, 4, 5], "c": [6], "d": [7, 8, 9, 10, 11]}
+        chunks = list(chutie.paginate(pages, per_page=3))
+        self.assertEqual(chunks, [
+            [("a", [1, 2])],
+            [("b", [3, 4, 5])],
+            [("c", [6])],
+            [("d", [7, 8, 9])],
+            [("d", [10, 11])],
+        ])
+        self.assertEqual(list(chutie.paginate({}, per_page=3)), [])
+
+    def test_090_render_paginated(self):
+        datas = [
+            dict(url=f"u{n}", filename=f"{n}.png", path=f"{n}.png",
+                 fullPage=False, page=dict(title=f"title {n}"))
+            for n in range(5)]
+        context = dict(date="now", viewports={},
+                       pages={data["url"]: [data] for data in datas})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index = Path(tmpdir) / "report.html"
+            paths = chutie.render_paginated(
+                context, write_to_path=str(index), per_page=2)
+            self.assertEqual(
+                [Path(path).name for path in paths],
+                ["report.html", "report-0001.html", "report-0002.html",
+                 "report-0003.html"])
+            html = index.read_text()
+            self.assertIn('href="./report-0003.html"', html)
+            self.assertIn('href="./report-0001.html#u1"', html)
+            page_2 = (Path(tmpdir) / "report-0002.html").read_text()
+            self.assertIn("Page 2 of 3", page_2)
+            self.assertIn('href="./report-0001.html"', page_2)
+            self.assertIn('href="./report-0003.html"', page_2)
+            self.assertIn("title 2", page_2)
+            self.assertNotIn("title 4", page_2)
+
+    def test_095_get_screenshots_streaming(self):
+        viewports = ["64x48"]
+        browser = FakeBrowser()
+
+        def _urls():
+            yield "about:blank#1"
+            yield {"url": "about:blank#2", "settle": 0}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            context = sync(chutie.get_screenshots(
+                _urls(), viewports, tmpdir, browser=browser))
+        self.assertEqual(context["urls"], ["about:blank#1", "about:blank#2"])
+        self.assertEqual(list(context["pages"]), context["urls"])
+        self.assertFalse(browser.closed)
+
     def test_100_get_screenshots(self):
 
         urls = ["about:blank"]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.daemon`."""
+
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import daemon
+from tests.test_chutie import FakeBrowser
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.browsers = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    async def launch(self, **options):
+        browser = FakeBrowser()
+        self.browsers.append(browser)
+        return browser
+
+    def test_pool_recycles(self):
+        pool = daemon.BrowserPool(size=1, recycle_after=2,
+                                  launcher=self.launch)
+
+        @sync
+        async def run():
+            await pool.start()
+            leased = await pool.acquire()
+            pages = [await leased.newPage() for _ in range(3)]
+            # recycled in the middle of a job: the third page is in a new
+            # browser, and the old one stays open until its pages close
+            self.assertEqual(len(self.browsers), 2)
+            self.assertIs(pages[2].browser, self.browsers[1])
+            self.assertFalse(self.browsers[0].closed)
+            for page in pages[:2]:
+                await page.close()
+            self.assertTrue(self.browsers[0].closed)
+            await pool.release(leased)
+            status = pool.status()
+            await pool.close()
+            return status
+
+        status = run()
+        self.assertEqual(status["launched"], 2)
+        self.assertEqual(status["recycled"], 1)
+        self.assertEqual(status["pages"], [1])
+        self.assertTrue(all(browser.closed for browser in self.browsers))
+
+    def test_serve(self):
+        socket_path = str(self.path / "chutie.sock")
+        server = daemon.Daemon(
+            socket_path,
+            daemon.BrowserPool(size=1, recycle_after=None,
+                               launcher=self.launch))
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        thread = threading.Thread(
+            target=loop.run_until_complete, args=(server.wait_closed(),))
+        thread.start()
+        try:
+            status = daemon.request({"op": "status"}, socket_path)
+            self.assertEqual(status["browsers"], 1)
+            with daemon.lease_endpoint(socket_path) as endpoint:
+                self.assertEqual(endpoint, FakeBrowser.wsEndpoint)
+                # leased until the client disconnects
+                self.assertEqual(
+                    daemon.request({"op": "status"}, socket_path)["idle"], 0)
+            for _ in range(100):
+                status = daemon.request({"op": "status"}, socket_path)
+                if status["idle"]:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(status["idle"], 1)
+            with self.assertRaises(RuntimeError):
+                daemon.request({"op": "nope"}, socket_path)
+
+            dest = self.path / "out"
+            context = daemon.capture(
+                ["about:blank"], ["64x48", "32x16"], str(dest),
+                socket_path=socket_path, metrics=True)
+            datas = context["pages"]["about:blank"]
+            self.assertEqual(len(datas), 4)
+            self.assertTrue(all(os.path.exists(data["path"])
+                                for data in datas))
+            self.assertEqual(datas[0]["path"],
+                             os.path.join(str(dest), datas[0]["filename"]))
+            self.assertIn("stages", context["metrics"])
+            self.assertEqual(
+                daemon.request({"op": "status"}, socket_path)["pages"], [1])
+        finally:
+            daemon.request({"op": "shutdown"}, socket_path)
+            thread.join(10)
+            loop.close()
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertTrue(self.browsers[0].closed)
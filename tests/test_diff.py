@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.diff`."""
+
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+from PIL import Image
+
+from chutie import cli
+from chutie import diff
+from chutie import png
+
+
+def save(path, width, height, pixels=None):
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    for xy, color in (pixels or {}).items():
+        image.putpixel(xy, color)
+    image.save(str(path))
+    return str(path)
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_identical(self):
+        a = save(self.path / "a.png", 20, 50)
+        b = save(self.path / "b.png", 20, 50)
+        result = diff.diff_images(a, b, band_rows=7)
+        self.assertEqual(result["different_pixels"], 0)
+        self.assertEqual(result["score"], 0.0)
+
+    def test_different_pixels(self):
+        a = save(self.path / "a.png", 20, 50, {(3, 3): (0, 0, 0)})
+        b = save(self.path / "b.png", 20, 50, {(15, 40): (0, 0, 0)})
+        mask = self.path / "mask.png"
+        result = diff.diff_images(a, b, mask_path=str(mask),
+                                  aa_tolerance=0, band_rows=7)
+        self.assertEqual(result["different_pixels"], 2)
+        self.assertEqual(result["total_pixels"], 1000)
+        image = Image.open(str(mask)).convert("RGBA")
+        self.assertEqual(image.size, (20, 50))
+        self.assertEqual(image.getpixel((15, 40)), diff.DIFF_COLOR)
+        self.assertNotEqual(image.getpixel((0, 0)), diff.DIFF_COLOR)
+
+        # below the threshold
+        b = save(self.path / "b.png", 20, 50, {(3, 3): (10, 10, 10)})
+        result = diff.diff_images(a, b, threshold=0.1, aa_tolerance=0)
+        self.assertEqual(result["different_pixels"], 0)
+
+    def test_aa_tolerance(self):
+        # a one pixel shift across a band boundary
+        a = save(self.path / "a.png", 20, 50, {(5, 6): (0, 0, 0)})
+        b = save(self.path / "b.png", 20, 50, {(6, 7): (0, 0, 0)})
+        result = diff.diff_images(a, b, aa_tolerance=0, band_rows=7)
+        self.assertEqual(result["different_pixels"], 2)
+        result = diff.diff_images(a, b, aa_tolerance=1, band_rows=7)
+        self.assertEqual(result["different_pixels"], 0)
+
+    def test_size_mismatch(self):
+        a = save(self.path / "a.png", 20, 50)
+        b = save(self.path / "b.png", 25, 40)
+        mask = self.path / "mask.png"
+        result = diff.diff_images(a, b, mask_path=str(mask), band_rows=16)
+        self.assertEqual((result["width"], result["height"]), (25, 50))
+        self.assertEqual(result["different_pixels"], 25 * 50 - 20 * 40)
+        self.assertEqual(png.read_header(mask.read_bytes())["height"], 50)
+
+    def test_first_image_shorter(self):
+        # e.g. a full page screenshot of a page that got taller
+        a = save(self.path / "a.png", 20, 40, {(3, 30): (0, 0, 0)})
+        b = save(self.path / "b.png", 20, 100)
+        mask = self.path / "mask.png"
+        result = diff.diff_images(a, b, mask_path=str(mask), band_rows=16)
+        self.assertEqual((result["width"], result["height"]), (20, 100))
+        self.assertEqual(result["different_pixels"], 1 + 20 * 60)
+        self.assertEqual(png.read_header(mask.read_bytes())["height"], 100)
+        mask_pixels = Image.open(str(mask)).convert("RGBA")
+        # the first image's rows are faded, the rest are all different
+        self.assertNotEqual(mask_pixels.getpixel((0, 39)), diff.DIFF_COLOR)
+        self.assertEqual(
+            mask_pixels.getpixel((0, 40)), diff.DIFF_COLOR)
+        self.assertEqual(
+            mask_pixels.getpixel((0, 99)), diff.DIFF_COLOR)
+
+    def write_run(self, name, pages):
+        run = self.path / name
+        run.mkdir()
+        context = {"pages": {}}
+        for url, pathstr, fullPage, pixels in pages:
+            filename = f"{url}__{pathstr}{'__full' if fullPage else ''}.png"
+            save(run / filename, 10, 10, pixels)
+            context["pages"].setdefault(url, []).append(dict(
+                url=url, pathstr=pathstr, fullPage=fullPage,
+                filename=filename, path="elsewhere/" + filename))
+        jsonpath = run / "chutie.json"
+        jsonpath.write_text(json.dumps(context))
+        return str(jsonpath)
+
+    def test_diff_runs(self):
+        a = self.write_run("a", [
+            ("u", "10x10", False, {}),
+            ("u", "10x10", True, {}),
+            ("v", "10x10", False, {}),
+        ])
+        b = self.write_run("b", [
+            ("u", "10x10", False, {(1, 1): (0, 0, 0)}),
+            ("u", "10x10", True, {}),
+            ("w", "10x10", False, {}),
+        ])
+        output = self.path / "out"
+        result = diff.diff_runs(a, b, output_dir=str(output), processes=2)
+        self.assertEqual(
+            [(pair["url"], pair["fullPage"], pair["different_pixels"])
+             for pair in result["pairs"]],
+            [("u", False, 1), ("u", True, 0)])
+        self.assertEqual(result["only_a"], [("v", "10x10", False)])
+        self.assertEqual(result["only_b"], [("w", "10x10", False)])
+        self.assertTrue((output / "diff.json").exists())
+        self.assertTrue(Path(result["pairs"][0]["mask"]).exists())
+        self.assertEqual(diff.mask_name("u__10x10.jpg"), "diff__u__10x10.png")
+
+        runner = CliRunner()
+        args = ["diff", a, b, "-o", str(output), "-p", "1"]
+        result = runner.invoke(cli.main, args)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("2 pairs, 1 only in A, 1 only in B", result.output)
+        result = runner.invoke(cli.main, args + ["--max-score", "0"])
+        self.assertEqual(result.exit_code, 1)
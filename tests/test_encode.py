@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.encode`."""
+
+
+import io
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from click.testing import CliRunner
+from PIL import Image
+from syncer import sync
+
+from chutie import chutie
+from chutie import cli
+from chutie import encode
+from chutie import png
+from tests.test_chutie import FakeBrowser
+
+
+def make_png(width=64, height=48):
+    return png.encode(
+        (bytes([n % 256, 0, 0, 255]) * width for n in range(height)),
+        width, height)
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_screenshot_options(self):
+        options = encode.screenshot_options(
+            {"image_format": "jpeg", "quality": 60},
+            {"screenshot": {"quality": 90, "clip": None}})
+        self.assertEqual(options["image_format"], "jpeg")
+        self.assertEqual(options["quality"], 90)
+        with self.assertRaises(ValueError):
+            encode.screenshot_options({"image_format": "gif"}, {})
+        with self.assertRaises(ValueError):
+            encode.screenshot_options({}, {"screenshot": {"colour": 1}})
+
+    def test_encode_screenshot(self):
+        data = make_png()
+        self.assertIs(encode.encode_screenshot(data), data)
+        cropped = encode.encode_screenshot(data, crop_height=10)
+        self.assertEqual(png.read_header(cropped)["height"], 10)
+        for image_format, pil_format in (("jpeg", "JPEG"), ("webp", "WEBP")):
+            encoded = encode.encode_screenshot(
+                data, image_format=image_format, quality=50, crop_height=10)
+            image = Image.open(io.BytesIO(encoded))
+            self.assertEqual(image.format, pil_format)
+            self.assertEqual(image.size, (64, 10))
+        optimized = encode.encode_screenshot(data, optimize=True)
+        self.assertEqual(Image.open(io.BytesIO(optimized)).size, (64, 48))
+
+    def test_capture_job_formats(self):
+        viewports = chutie._build_viewports([
+            "64x48",
+            {"viewport": "32x16", "image_format": "jpeg", "quality": 70}])
+        browser = FakeBrowser()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datas = sync(chutie._capture_job(
+                browser, Path(tmpdir), viewports,
+                ("about:blank", list(viewports)), image_format="webp",
+                clip=dict(x=0, y=0, width=8, height=8)))
+            formats = [Image.open(data["path"]).format for data in datas]
+        self.assertEqual(
+            [data["filename"].rsplit(".", 1)[1] for data in datas],
+            ["webp", "webp", "jpg", "jpg"])
+        self.assertEqual(formats, ["WEBP", "WEBP", "JPEG", "JPEG"])
+        self.assertEqual(datas[0]["region"], dict(x=0, y=0, width=8, height=8))
+        self.assertNotIn("region", datas[1])
+        options = [call[3] for call in browser.calls
+                   if call[0] == "screenshot"]
+        self.assertEqual(options[0]["type"], "png")
+        self.assertIn("clip", options[0])
+        self.assertNotIn("clip", options[1])
+        self.assertEqual((options[2]["type"], options[2]["quality"]),
+                         ("jpeg", 70))
+
+    def test_needs_pillow(self):
+        self.assertFalse(encode.needs_pillow({"image_format": "png"}))
+        self.assertFalse(encode.needs_pillow({"image_format": "jpeg"}))
+        self.assertTrue(
+            encode.needs_pillow({"image_format": "jpeg"}, crop=True))
+        self.assertTrue(encode.needs_pillow({"image_format": "webp"}))
+        self.assertTrue(encode.needs_pillow({"optimize": True}))
+        self.assertTrue(encode.needs_pillow({"tiles": "stitch"}))
+        self.assertFalse(encode.needs_pillow({"tiles": "files"}))
+
+        runner = CliRunner()
+        with mock.patch.object(encode, "have_pillow", return_value=False):
+            result = runner.invoke(cli.main, [
+                "screenshots", "-u", "about:blank", "-r", "64x48",
+                "--format", "webp"])
+        self.assertEqual(result.exit_code, 2, result.output)
+        self.assertIn("pip install chutie[encode]", result.output)
+
+    def test_cli_needs_png(self):
+        runner = CliRunner()
+        for args in (["--format", "jpeg", "--dedupe"],
+                     ["--format", "webp", "--thumbnails"]):
+            result = runner.invoke(
+                cli.main,
+                ["screenshots", "-u", "about:blank", "-r", "64x48"] + args)
+            self.assertEqual(result.exit_code, 2, result.output)
+            self.assertIn("need PNG screenshots", result.output)
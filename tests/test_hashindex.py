@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.hashindex`."""
+
+
+import itertools
+import os
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+from PIL import Image, ImageDraw
+
+from chutie import cli
+from chutie import hashindex
+
+
+def save(path, size=(64, 300), boxes=(), fill=(255, 255, 255)):
+    image = Image.new("RGB", size, fill)
+    draw = ImageDraw.Draw(image)
+    for box in boxes:
+        draw.rectangle(box, fill=(0, 0, 0))
+    image.save(str(path))
+    return str(path)
+
+
+class TestBKTree(unittest.TestCase):
+
+    def test_search_matches_linear_scan(self):
+        rng = random.Random(7)
+        keys = [rng.getrandbits(16) for _ in range(300)]
+        tree = hashindex.BKTree()
+        for n, key in enumerate(keys):
+            tree.add(key, n)
+        self.assertEqual(tree.size, 300)
+        for query in keys[:20]:
+            for k in (0, 2, 5):
+                expected = sorted(
+                    n for n, key in enumerate(keys)
+                    if hashindex.hamming(query, key) <= k)
+                found = sorted(n for _, n in tree.search(query, k))
+                self.assertEqual(found, expected)
+
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hash_image(self):
+        box = (0, 0, 20, 100)
+        dot = (50, 250, 50, 250)
+        a = hashindex.hash_image(save(self.path / "a.png", boxes=[box]))
+        b = hashindex.hash_image(save(self.path / "b.png", boxes=[box]))
+        c = hashindex.hash_image(save(self.path / "c.png", boxes=[box, dot]))
+        d = hashindex.hash_image(save(
+            self.path / "d.png", boxes=[(30, 0, 63, 140), (0, 160, 30, 299)]))
+        self.assertEqual(a, b)
+        self.assertNotEqual(a["sha256"], c["sha256"])
+        self.assertLessEqual(
+            hashindex.hamming(int(a["phash"], 16), int(c["phash"], 16)), 2)
+        self.assertGreater(
+            hashindex.hamming(int(a["phash"], 16), int(d["phash"], 16)), 8)
+        # the hash doesn't depend on the band size
+        self.assertEqual(
+            hashindex.hash_image(str(self.path / "d.png"), band_rows=7), d)
+
+    def test_index_screenshots(self):
+        boxes = {"a": [(0, 0, 20, 100)], "b": [(0, 0, 20, 100)],
+                 "c": [(0, 0, 20, 100), (50, 250, 50, 250)],
+                 "d": [(30, 0, 63, 140), (0, 160, 30, 299)]}
+        context = {"pages": {}}
+        for name, box in boxes.items():
+            save(self.path / f"{name}.png", boxes=box)
+            context["pages"][name] = [
+                dict(url=name, filename=f"{name}.png", pathstr="64x300",
+                     fullPage=False)]
+        index = hashindex.index_screenshots(context, self.path, processes=1)
+
+        self.assertEqual(context["pages"]["b"][0]["duplicate_of"], "a.png")
+        self.assertNotIn("duplicate_of", context["pages"]["c"][0])
+        self.assertEqual(os.stat(self.path / "a.png").st_ino,
+                         os.stat(self.path / "b.png").st_ino)
+        self.assertEqual(
+            [[entry["filename"] for entry in group]
+             for group in index.duplicates()],
+            [["a.png", "b.png"]])
+        pairs = [(entry_a["filename"], entry_b["filename"])
+                 for _, entry_a, entry_b in index.near_duplicates(k=2)]
+        self.assertEqual(sorted(pairs), sorted(
+            itertools.combinations(["a.png", "b.png", "c.png"], 2)))
+
+        loaded = hashindex.HashIndex.load(
+            str(self.path / hashindex.INDEX_FILENAME))
+        self.assertEqual(loaded.entries, index.entries)
+        near = loaded.near(context["pages"]["d"][0]["phash"], k=0)
+        self.assertEqual([entry["filename"] for _, entry in near], ["d.png"])
+
+        (self.path / "chutie.json").write_text("{}")
+        result = CliRunner().invoke(
+            cli.main, ["dupes", "-f", str(self.path / "chutie.json"),
+                       "-k", "0"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("a.png b.png", result.output)
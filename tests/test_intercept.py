@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.intercept`."""
+
+
+import asyncio
+import unittest
+
+from syncer import sync
+
+from chutie import intercept
+
+
+class FakeRequest(object):
+
+    def __init__(self, url, resourceType, frame=None, navigation=False):
+        self.url = url
+        self.resourceType = resourceType
+        self.frame = frame
+        self.navigation = navigation
+        self.outcome = None
+
+    def isNavigationRequest(self):
+        return self.navigation
+
+    async def abort(self):
+        self.outcome = "aborted"
+
+    async def continue_(self):
+        self.outcome = "continued"
+
+
+class FakePage(object):
+
+    mainFrame = object()
+
+    def __init__(self):
+        self.intercepting = False
+        self.handlers = []
+
+    async def setRequestInterception(self, value):
+        self.intercepting = value
+
+    def on(self, event, handler):
+        self.handlers.append((event, handler))
+
+
+class TestIntercept(unittest.TestCase):
+
+    page_url = "https://www.example.com/a"
+
+    def test_profiles(self):
+        third_party = intercept.Interceptor(["third-party"])
+        self.assertFalse(third_party.should_block(
+            "https://cdn.example.com/x.js", "script", self.page_url))
+        self.assertFalse(third_party.should_block(
+            "https://example.com/x.js", "script", self.page_url))
+        self.assertTrue(third_party.should_block(
+            "https://tracker.test/x.js", "script", self.page_url))
+        self.assertFalse(third_party.should_block(
+            "data:image/png;base64,AAAA", "image", self.page_url))
+        # the site of www.example.co.uk is example.co.uk, not co.uk
+        page_url = "https://www.example.co.uk/a"
+        self.assertFalse(third_party.should_block(
+            "https://static.example.co.uk/x.js", "script", page_url))
+        self.assertTrue(third_party.should_block(
+            "https://tracker.co.uk/x.js", "script", page_url))
+        self.assertEqual(
+            intercept._guess_site("a.b.example.com.au"), "example.com.au")
+        self.assertEqual(
+            intercept._guess_site("www.example.io"), "example.io")
+        self.assertEqual(intercept._guess_site("127.0.0.1"), "127.0.0.1")
+
+        same_origin = intercept.Interceptor(["same-origin"])
+        self.assertTrue(same_origin.should_block(
+            "https://cdn.example.com/x.js", "script", self.page_url))
+        self.assertTrue(same_origin.should_block(
+            "http://www.example.com/x.js", "script", self.page_url))
+        self.assertFalse(same_origin.should_block(
+            "https://www.example.com/x.js", "script", self.page_url))
+
+        composed = intercept.Interceptor(["media", "fonts"])
+        self.assertTrue(composed.should_block(
+            "https://www.example.com/v.mp4", "media", self.page_url))
+        self.assertTrue(composed.should_block(
+            "https://www.example.com/f.woff2", "font", self.page_url))
+        self.assertFalse(composed.should_block(
+            "https://www.example.com/i.png", "image", self.page_url))
+
+        with self.assertRaises(ValueError):
+            intercept.Interceptor(["nope"])
+
+    def test_attach(self):
+        interceptor = intercept.Interceptor(["third-party"])
+        page = FakePage()
+
+        @sync
+        async def run():
+            await interceptor.attach(page, self.page_url)
+            requests = [
+                FakeRequest("https://redirect.test/", "document",
+                            frame=page.mainFrame, navigation=True),
+                FakeRequest("https://www.example.com/s.css", "stylesheet"),
+                FakeRequest("https://ads.test/a.js", "script"),
+                FakeRequest("https://ads.test/i.gif", "image"),
+            ]
+            for request in requests:
+                event, handler = page.handlers[0]
+                self.assertEqual(event, "request")
+                handler(request)
+            await asyncio.sleep(0)
+            return requests
+
+        requests = run()
+        self.assertTrue(page.intercepting)
+        self.assertEqual([request.outcome for request in requests],
+                         ["continued", "continued", "aborted", "aborted"])
+        self.assertEqual(interceptor.stats["requests"], 4)
+        self.assertEqual(interceptor.stats["blocked"], 2)
+        self.assertEqual(interceptor.stats["blocked_by_type"],
+                         {"script": 1, "image": 1})
+        self.assertEqual(
+            interceptor.stats["bytes_saved_estimate"],
+            intercept.AVERAGE_BYTES["script"]
+            + intercept.AVERAGE_BYTES["image"])
+
+        totals = intercept.Interceptor(["third-party"])
+        totals.merge(interceptor.stats)
+        totals.merge(interceptor.stats)
+        self.assertEqual(totals.to_dict()["blocked"], 4)
+        self.assertEqual(totals.to_dict()["profiles"], ["third-party"])
+        self.assertEqual(totals.stats["blocked_by_type"]["script"], 2)
+
+    def test_no_profiles(self):
+        page = FakePage()
+        sync(intercept.Interceptor().attach(page, self.page_url))
+        self.assertFalse(page.intercepting)
+        self.assertEqual(page.handlers, [])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.journal`."""
+
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from chutie import cli
+from chutie import journal
+
+
+def screenshot(url, pathstr, fullPage):
+    return {"url": url, "pathstr": pathstr, "fullPage": fullPage,
+            "filename": f"{url}__{pathstr}{'__full' if fullPage else ''}.png"}
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "chutie.jsonl"
+        self.journal = journal.Journal(self.path)
+        self.journal.write_header({
+            "date": "2019-03-05",
+            "viewports": {"1024x768": {}, "800x600": {}},
+        })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_completed(self):
+        self.journal.write([screenshot("a", "800x600", False),
+                            screenshot("a", "800x600", True)])
+        with open(self.path, "a") as _file:
+            _file.write('{"type": "screenshot", "url": "tr')
+        done = self.journal.completed()
+        self.assertEqual(set(done), {("a", "800x600", False),
+                                     ("a", "800x600", True)})
+        self.assertNotIn("type", done[("a", "800x600", False)])
+
+    def test_compact(self):
+        self.journal.write([
+            screenshot("b", "800x600", True),
+            screenshot("b", "800x600", False),
+            screenshot("a", "800x600", False),
+            screenshot("b", "1024x768", False),
+        ])
+        self.journal.write([dict(screenshot("a", "800x600", False),
+                                 title="again")])
+        jsonpath = Path(self.tmpdir.name) / "chutie.json"
+        context = journal.compact(str(self.path), json_path=str(jsonpath))
+        self.assertEqual(context["date"], "2019-03-05")
+        self.assertEqual(context["urls"], ["b", "a"])
+        self.assertEqual(list(context["viewports"]), ["1024x768", "800x600"])
+        self.assertEqual(
+            [(data["pathstr"], data["fullPage"])
+             for data in context["pages"]["b"]],
+            [("1024x768", False), ("800x600", False), ("800x600", True)])
+        self.assertEqual(context["pages"]["a"][0]["title"], "again")
+        with open(jsonpath) as _file:
+            self.assertEqual(json.load(_file), json.loads(json.dumps(context)))
+
+    def test_failures(self):
+        failure = {"url": "a", "pathstr": "800x600", "failed": True,
+                   "error": "timeout"}
+        self.journal.write([failure, dict(failure, pathstr="1024x768")])
+        self.assertEqual(self.journal.completed(), {})
+        # a later, successful attempt replaces a failure
+        self.journal.write([screenshot("a", "800x600", False),
+                            screenshot("a", "800x600", True)])
+        context = journal.compact(str(self.path))
+        self.assertEqual(
+            [(data["pathstr"], bool(data.get("failed")))
+             for data in context["pages"]["a"]],
+            [("800x600", False), ("800x600", False), ("1024x768", True)])
+
+    def test_cli_compact(self):
+        self.journal.write([screenshot("a", "800x600", False)])
+        output = Path(self.tmpdir.name) / "out.json"
+        result = CliRunner().invoke(
+            cli.main, ["compact", "-f", str(self.path), "-o", str(output)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Wrote 1 screenshots", result.output)
+        self.assertTrue(output.exists())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.metrics`."""
+
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import chutie
+from chutie import metrics
+from tests.test_chutie import FakeBrowser
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_percentiles(self):
+        summary = metrics.summarize([float(n) for n in range(100, 0, -1)])
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["max"], 100.0)
+        self.assertEqual(summary["p50"], 50.0)
+        self.assertEqual(summary["p95"], 95.0)
+        self.assertEqual(metrics.summarize([])["p99"], 0.0)
+
+    def test_recorder(self):
+        calls = []
+        recorder = metrics.Recorder(
+            hook=lambda *args: calls.append(args))
+        timings = {}
+        with recorder.stage("write", timings, url="u"):
+            pass
+        with recorder.stage("write", timings, url="u"):
+            pass
+        self.assertEqual(len(recorder.samples["write"]), 2)
+        self.assertAlmostEqual(
+            timings["write"], sum(recorder.samples["write"]))
+        self.assertEqual([call[0] for call in calls], ["write", "write"])
+        self.assertEqual(calls[0][2], {"url": "u"})
+
+        other = metrics.Recorder()
+        other.merge(recorder.samples)
+        self.assertEqual(other.summary()["write"]["count"], 2)
+
+        null = metrics.open_recorder(None)
+        self.assertFalse(null.enabled)
+        timings = {}
+        with null.stage("write", timings):
+            pass
+        self.assertEqual(timings, {})
+
+    def test_write_metrics(self):
+        recorder = metrics.Recorder()
+        recorder.record("navigate", 0.25)
+        recorder.record("navigate", 0.5)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prom = Path(tmpdir) / "chutie.prom"
+            metrics.write_metrics(recorder.summary(), prom)
+            text = prom.read_text()
+            self.assertIn(
+                "# TYPE chutie_stage_duration_seconds summary", text)
+            self.assertIn('chutie_stage_duration_seconds{stage="navigate",'
+                          'quantile="0.5"} 0.250000', text)
+            self.assertIn('chutie_stage_duration_seconds_count'
+                          '{stage="navigate"} 2', text)
+            jsonpath = Path(tmpdir) / "metrics.json"
+            metrics.write_metrics(recorder.summary(), jsonpath)
+            stages = json.loads(jsonpath.read_text())["stages"]
+            self.assertEqual(stages["navigate"]["sum"], 0.75)
+
+    def test_capture_job_timings(self):
+        viewports = chutie._build_viewports(["64x48", "32x16"])
+        recorder = metrics.Recorder()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datas = sync(chutie._capture_job(
+                FakeBrowser(), Path(tmpdir), viewports,
+                ("about:blank", list(viewports)), metrics=recorder))
+            plain = sync(chutie._capture_job(
+                FakeBrowser(), Path(tmpdir), viewports,
+                ("about:blank", list(viewports))))
+        self.assertEqual(
+            sorted(datas[0]["timings"]), ["navigate", "screenshot", "write"])
+        self.assertEqual(
+            sorted(datas[2]["timings"]),
+            ["navigate", "resize", "screenshot", "write"])
+        self.assertEqual(len(recorder.samples["navigate"]), 1)
+        self.assertEqual(len(recorder.samples["screenshot"]), 4)
+        self.assertNotIn("timings", plain[0])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.png`."""
+
+
+import unittest
+import zlib
+
+from chutie import png
+
+
+def make_png(width, height, color_type=6):
+    channels = png._CHANNELS[color_type]
+    rows = [
+        bytes((x + y) % 256 for x in range(width * channels))
+        for y in range(height)]
+    return png.encode(rows, width, height, color_type=color_type), rows
+
+
+def decode_rows(data):
+    header = png.read_header(data)
+    idat = b"".join(
+        chunk_data for chunk_type, chunk_data in png.iter_chunks(data)
+        if chunk_type == b"IDAT")
+    raw = zlib.decompress(idat)
+    stride = header["stride"] + 1
+    # rows written by png.encode use filter type 0 (None)
+    return [raw[i * stride + 1:(i + 1) * stride]
+            for i in range(header["height"])]
+
+
+class TestPng(unittest.TestCase):
+
+    def test_read_header(self):
+        data, rows = make_png(5, 3)
+        header = png.read_header(data)
+        self.assertEqual(header["width"], 5)
+        self.assertEqual(header["height"], 3)
+        self.assertEqual(header["channels"], 4)
+        self.assertEqual(header["stride"], 20)
+        with self.assertRaises(ValueError):
+            png.read_header(b"GIF89a")
+
+    def test_crop_top(self):
+        data, rows = make_png(7, 50, color_type=2)
+        cropped = png.crop_top(data, 20)
+        header = png.read_header(cropped)
+        self.assertEqual((header["width"], header["height"]), (7, 20))
+        self.assertEqual(decode_rows(cropped), rows[:20])
+        chunk_types = [chunk_type for chunk_type, _ in
+                       png.iter_chunks(cropped)]
+        self.assertEqual(chunk_types, [b"IHDR", b"IDAT", b"IEND"])
+
+    def test_crop_top_shorter(self):
+        data, rows = make_png(4, 10)
+        self.assertIs(png.crop_top(data, 10), data)
+        self.assertIs(png.crop_top(data, 100), data)
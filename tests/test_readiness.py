@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.readiness`."""
+
+
+import asyncio
+import time
+import unittest
+
+from syncer import sync
+
+from chutie import readiness
+
+
+class FakePage(object):
+
+    def __init__(self):
+        self.calls = []
+
+    async def goto(self, url, **kwargs):
+        self.calls.append(("goto", url, kwargs))
+        return "response"
+
+    async def waitForSelector(self, selector, **kwargs):
+        self.calls.append(("waitForSelector", selector, kwargs))
+
+
+class TestReadiness(unittest.TestCase):
+
+    def test_make_strategy(self):
+        strategy = readiness.make_strategy()
+        self.assertEqual(strategy, readiness.DEFAULT_STRATEGY)
+        strategy = readiness.make_strategy({"wait_until": "networkidle0"})
+        self.assertEqual(strategy["wait_until"], "networkidle0")
+        self.assertEqual(strategy["timeout"], 30)
+        with self.assertRaises(ValueError):
+            readiness.make_strategy({"wait_until": "never"})
+        with self.assertRaises(ValueError):
+            readiness.make_strategy({"timeuot": 3})
+        with self.assertRaises(ValueError):
+            readiness.make_strategy({"timeout": -1})
+
+    def test_split_urls(self):
+        base = readiness.make_strategy({"timeout": 10})
+        urls, strategies = readiness.split_urls(
+            ["https://a/", {"url": "https://b/", "selector": "#main"}],
+            base=base)
+        self.assertEqual(urls, ["https://a/", "https://b/"])
+        self.assertEqual(list(strategies), ["https://b/"])
+        self.assertEqual(strategies["https://b/"]["selector"], "#main")
+        self.assertEqual(strategies["https://b/"]["timeout"], 10)
+
+    def test_wait_ready(self):
+        page = FakePage()
+        strategy = readiness.make_strategy(
+            {"wait_until": "domcontentloaded", "selector": ".ready",
+             "settle": 0.01, "timeout": 5})
+        response = sync(readiness.wait_ready(page, "https://a/", strategy))
+        self.assertEqual(response, "response")
+        (_, url, goto), (_, selector, wait) = page.calls
+        self.assertEqual(goto["waitUntil"], "domcontentloaded")
+        self.assertTrue(4000 < goto["timeout"] <= 5000)
+        self.assertEqual(selector, ".ready")
+        self.assertTrue(0 < wait["timeout"] <= 5000)
+
+    def test_deadline(self):
+        page = FakePage()
+        strategy = readiness.make_strategy()
+        sync(readiness.wait_ready(
+            page, "https://a/", strategy, deadline=time.time() + 2))
+        self.assertTrue(page.calls[0][2]["timeout"] <= 2000)
+        with self.assertRaises(asyncio.TimeoutError):
+            sync(readiness.wait_ready(
+                page, "https://b/", strategy, deadline=time.time() - 1))
+        self.assertEqual(len(page.calls), 1)
+
+    def test_no_timeout(self):
+        # 0 (from --timeout 0) and None (``timeout: null`` in a config
+        # file) both mean no timeout, which is 0 to pyppeteer
+        for timeout in (0, None):
+            page = FakePage()
+            strategy = readiness.make_strategy(
+                {"selector": ".ready", "settle": 0.01, "timeout": timeout})
+            sync(readiness.wait_ready(page, "https://a/", strategy))
+            self.assertEqual(
+                [call[2]["timeout"] for call in page.calls], [0, 0])
+            # but the run deadline still applies
+            page = FakePage()
+            sync(readiness.wait_ready(
+                page, "https://a/", strategy, deadline=time.time() + 2))
+            self.assertTrue(0 < page.calls[0][2]["timeout"] <= 2000)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.recovery`."""
+
+
+import asyncio
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from pyppeteer.errors import NetworkError, PageError
+from syncer import sync
+
+from chutie import chutie
+from chutie import journal as capture_journal
+from chutie import recovery
+from tests.test_chutie import FakeBrowser, FakePage
+
+
+class CrashingPage(FakePage):
+    """A page whose first screenshots fail as if the browser crashed"""
+
+    async def screenshot(self, options=None, **kwargs):
+        if self.browser.crashes:
+            self.browser.crashes -= 1
+            raise NetworkError(
+                "Protocol error Page.captureScreenshot: Target closed.")
+        return await super().screenshot(options, **kwargs)
+
+
+class CrashingBrowser(FakeBrowser):
+
+    def __init__(self, crashes=0):
+        super().__init__()
+        self.crashes = crashes
+
+    async def newPage(self):
+        page = CrashingPage(self)
+        self.pages.append(page)
+        return page
+
+
+class HangingPage(FakePage):
+    """A page that never finishes loading"""
+
+    async def goto(self, url, **kwargs):
+        await asyncio.sleep(60)
+
+
+class CrashedPage(HangingPage):
+    """A page that crashes while it loads"""
+
+    def on(self, event, callback):
+        if event == "error":
+            asyncio.get_event_loop().call_soon(
+                callback, PageError("Page crashed!"))
+
+
+class HangingBrowser(FakeBrowser):
+
+    def __init__(self, page_class):
+        super().__init__()
+        self.page_class = page_class
+
+    async def newPage(self):
+        page = self.page_class(self)
+        self.pages.append(page)
+        return page
+
+
+async def load(browser):
+    page = await browser.newPage()
+    await page.goto("about:blank")
+
+
+class TestRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_is_crash(self):
+        self.assertTrue(recovery.is_crash(NetworkError(
+            "Protocol error Runtime.evaluate: Target closed.")))
+        self.assertTrue(recovery.is_crash(PageError("Page crashed!")))
+        self.assertTrue(recovery.is_crash(ConnectionResetError()))
+        self.assertFalse(recovery.is_crash(asyncio.TimeoutError(
+            "Navigation Timeout Exceeded: 30000 ms exceeded.")))
+
+    def test_policy(self):
+        policy = recovery.RetryPolicy(
+            retries=3, backoff=1, factor=2, max_backoff=3, jitter=0)
+        self.assertEqual(
+            [policy.allow(n) for n in range(4)], [1, 2, 3, None])
+        self.assertEqual(policy.stats["retries"], 3)
+        self.assertIsNone(policy.allow(0, deadline=time.time() + 0.5))
+
+        policy = recovery.RetryPolicy(retries=3, budget=1)
+        self.assertIsNotNone(policy.allow(0))
+        self.assertIsNone(policy.allow(0))
+
+        self.assertIsNone(recovery.open_policy(None))
+        self.assertEqual(recovery.open_policy(4).retries, 4)
+        policy = recovery.open_policy(dict(retries=1, budget=5))
+        self.assertEqual(
+            recovery.open_policy(policy.to_dict()).to_dict(),
+            policy.to_dict())
+
+    def test_restart_once(self):
+        browsers = []
+
+        async def launcher():
+            browsers.append(FakeBrowser())
+            return browsers[-1]
+
+        @sync
+        async def run():
+            supervised = await recovery.SupervisedBrowser(launcher).start()
+            error = NetworkError("Connection closed")
+            # two tabs of the same browser see the crash
+            await asyncio.gather(supervised.recover(error, 0),
+                                 supervised.recover(error, 0))
+            # a crashed tab does not need a new browser
+            await supervised.recover(PageError("Page crashed!"), 1)
+            await supervised.close()
+            return supervised
+
+        supervised = run()
+        self.assertEqual(len(browsers), 2)
+        self.assertEqual(supervised.stats["restarts"], 1)
+        self.assertTrue(all(browser.closed for browser in browsers))
+
+    def test_run_attempt(self):
+        with self.assertRaises(PageError):
+            sync(recovery.run_attempt(HangingBrowser(CrashedPage), load))
+        with self.assertRaises(asyncio.TimeoutError):
+            sync(recovery.run_attempt(
+                HangingBrowser(HangingPage), load, timeout=0.05))
+
+    def test_capture_with_retry(self):
+        viewports = chutie._build_viewports(["64x48", "32x16"])
+        browsers = []
+
+        async def launcher():
+            # the first browser crashes
+            browsers.append(CrashingBrowser(crashes=0 if browsers else 1))
+            return browsers[-1]
+
+        policy = recovery.RetryPolicy(retries=2, backoff=0, jitter=0)
+
+        @sync
+        async def run():
+            supervised = await recovery.SupervisedBrowser(
+                launcher, stats=policy.stats).start()
+            try:
+                return await chutie._capture_with_retry(
+                    supervised, self.path, viewports,
+                    ("about:blank", list(viewports)), retry=policy)
+            finally:
+                await supervised.close()
+
+        datas = run()
+        self.assertEqual(len(browsers), 2)
+        self.assertFalse(any(data.get("failed") for data in datas))
+        self.assertEqual([data["retries"] for data in datas], [1] * 4)
+        self.assertEqual(policy.stats,
+                         {"retries": 1, "restarts": 1, "failed": 0})
+
+    def test_capture_with_retry_gives_up(self):
+        viewports = chutie._build_viewports(["64x48"])
+        policy = recovery.RetryPolicy(retries=2, backoff=0, jitter=0)
+        browser = FakeBrowser()
+        journal = capture_journal.Journal(self.path / "chutie.jsonl")
+        datas = sync(chutie._capture_with_retry(
+            browser, self.path, viewports, ("slow:page", list(viewports)),
+            retry=policy, journal=journal))
+        self.assertTrue(datas[0]["failed"])
+        self.assertEqual(datas[0]["retries"], 2)
+        # one record of the final outcome, not one per attempt
+        records = list(capture_journal.read_journal(journal.path))
+        self.assertEqual([record.get("retries") for record in records], [2])
+        self.assertEqual(
+            len([call for call in browser.calls if call[0] == "goto"]), 3)
+        self.assertEqual(policy.stats,
+                         {"retries": 2, "restarts": 0, "failed": 1})
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.render`."""
+
+
+import json
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from chutie import cli
+from chutie import render
+
+
+def make_context(urls):
+    return dict(
+        urls=list(urls), viewports={},
+        pages={url: [dict(url=url, filename=f"{n}.png", path=f"{n}.png",
+                          fullPage=False, page=dict(title=f"title {n}"))]
+               for n, url in enumerate(urls)})
+
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        render.clear_renderers()
+
+    def tearDown(self):
+        render.clear_renderers()
+        self.tmpdir.cleanup()
+
+    def test_get_renderer(self):
+        renderer = render.get_renderer()
+        self.assertIs(render.get_renderer(render.DEFAULT_TEMPLATE_DIR),
+                      renderer)
+        self.assertIsNot(render.get_renderer(self.path), renderer)
+        # compiled once
+        self.assertIs(renderer.get_template(), renderer.get_template())
+        self.assertIs(render._get_template(), renderer.get_template())
+        self.assertIs(pickle.loads(pickle.dumps(renderer)), renderer)
+
+    def test_bytecode_cache(self):
+        cache_dir = self.path / "bytecode"
+        context = make_context(["https://a.test/1"])
+        html = render.render_template(context, bytecode_cache=cache_dir)
+        self.assertIn("title 0", html)
+        self.assertTrue(list(cache_dir.iterdir()))
+
+        # as in the next process
+        render.clear_renderers()
+        renderer = render.get_renderer(bytecode_cache=cache_dir)
+        self.assertEqual(renderer.render(context), html)
+
+    def test_render_many(self):
+        context = make_context([
+            "https://a.test/1", "https://b.test/1", "https://a.test/2"])
+        sites = render.split_sites(context)
+        self.assertEqual(list(sites), ["a.test", "b.test"])
+        self.assertEqual(sites["a.test"]["urls"],
+                         ["https://a.test/1", "https://a.test/2"])
+        self.assertEqual(list(sites["b.test"]["pages"]),
+                         ["https://b.test/1"])
+
+        renderer = render.get_renderer()
+        for processes in (1, 2):
+            reports = [(site_context, self.path / f"{processes}-{host}.html")
+                       for host, site_context in sites.items()]
+            paths = renderer.render_many(reports, processes=processes)
+            self.assertEqual(paths, [str(path) for context, path in reports])
+            html = (self.path / f"{processes}-b.test.html").read_text()
+            self.assertIn("https://b.test/1", html)
+            self.assertNotIn("https://a.test/1", html)
+
+        paths = renderer.render_many(
+            [(sites["a.test"], self.path / "paged.html")], per_page=1)
+        self.assertEqual(len(paths), 3)
+
+    def test_cli_per_site(self):
+        jsonpath = self.path / "chutie.json"
+        jsonpath.write_text(json.dumps(make_context(
+            ["https://a.test/1", "https://b.test/1"])))
+        result = CliRunner().invoke(cli.main, [
+            "template", "-f", str(jsonpath), "-o",
+            str(self.path / "report.html"), "--per-site",
+            "--no-bytecode-cache"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Rendered 2 reports", result.output)
+        self.assertTrue((self.path / "report-a.test.html").exists())
+        self.assertTrue((self.path / "report-b.test.html").exists())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.scheduler`."""
+
+
+import asyncio
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import chutie
+from chutie import scheduler as capture_scheduler
+from tests.test_chutie import FakeBrowser, FakePage
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class ThrottlingPage(FakePage):
+    """A page whose first load of each ``throttled.test`` url is
+    answered with a 429"""
+
+    async def goto(self, url, **kwargs):
+        await super().goto(url, **kwargs)
+        loads = self.browser.loads
+        loads[url] = loads.get(url, 0) + 1
+        if "throttled.test" in url and loads[url] == 1:
+            return FakeResponse(429, {"Retry-After": "0"})
+        return FakeResponse()
+
+
+class ThrottlingBrowser(FakeBrowser):
+
+    def __init__(self):
+        super().__init__()
+        self.loads = {}
+
+    async def newPage(self):
+        page = ThrottlingPage(self)
+        self.pages.append(page)
+        return page
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = capture_scheduler.TokenBucket(rate=2, burst=2, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.delay(0), 0)
+            bucket.take(0)
+        self.assertAlmostEqual(bucket.delay(0), 0.5)
+        self.assertAlmostEqual(bucket.delay(0.25), 0.25)
+        self.assertEqual(bucket.delay(0.5), 0)
+
+    def test_parse_retry_after(self):
+        parse = capture_scheduler.parse_retry_after
+        self.assertEqual(parse("120"), 120)
+        self.assertEqual(parse(" 1.5 "), 1.5)
+        self.assertEqual(
+            parse("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412420), 60)
+        self.assertEqual(
+            parse("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412540), 0)
+        self.assertIsNone(parse(None))
+        self.assertIsNone(parse("soon"))
+
+    def test_run(self):
+        scheduler = capture_scheduler.HostScheduler(max_per_host=1)
+        jobs = [(f"https://{host}.test/{n}", n) for n, host in
+                enumerate(["a", "a", "a", "b", "c", "b"])]
+        started = []
+        active = {}
+
+        async def worker(job):
+            host = capture_scheduler.host_of(job[0])
+            started.append(host)
+            active[host] = active.get(host, 0) + 1
+            self.assertEqual(active[host], 1)
+            await asyncio.sleep(0.01)
+            active[host] -= 1
+            return job[1]
+
+        results = sync(scheduler.run(jobs, worker, concurrency=3))
+        # in job order, whatever order they ran in
+        self.assertEqual(results, list(range(6)))
+        # the other hosts' jobs don't wait behind a's
+        self.assertEqual(started[:3], ["a.test", "b.test", "c.test"])
+        self.assertEqual(scheduler.stats["jobs"], 6)
+
+        # sharded runs keep all of a host's jobs in one process
+        shards = chutie._split_shards(jobs, 2, by_host=True)
+        self.assertEqual(
+            [[job[1] for index, job in shard] for shard in shards],
+            [[0, 1, 2], [3, 4, 5]])
+
+    def test_backoff(self):
+        scheduler = capture_scheduler.HostScheduler(backoff=0.05)
+        throttled = FakeResponse(429)
+        with self.assertRaises(capture_scheduler.Throttled) as raised:
+            scheduler.observe("https://a.test/1", throttled)
+        self.assertAlmostEqual(raised.exception.delay, 0.05)
+        with self.assertRaises(capture_scheduler.Throttled) as raised:
+            scheduler.observe("https://a.test/2", throttled)
+        self.assertAlmostEqual(raised.exception.delay, 0.1)
+        # only a.test is backed off
+        self.assertGreater(scheduler.ready_in("a.test"), 0)
+        self.assertEqual(scheduler.ready_in("b.test"), 0)
+        scheduler.observe("https://b.test/1", FakeResponse(
+            503, {"Content-Type": "text/html"}))
+        with self.assertRaises(capture_scheduler.Throttled):
+            scheduler.observe("https://b.test/1", FakeResponse(
+                503, {"retry-after": "1000"}))
+        self.assertAlmostEqual(scheduler.stats["backoff_seconds"], 300.15)
+        self.assertEqual(scheduler.stats["throttled_hosts"],
+                         {"a.test": 2, "b.test": 1})
+
+        started = []
+
+        async def worker(job):
+            started.append(job)
+
+        sync(scheduler.run(["https://a.test/3", "https://c.test/1"], worker,
+                           key=lambda job: job))
+        self.assertEqual(started, ["https://c.test/1", "https://a.test/3"])
+
+        copy = pickle.loads(pickle.dumps(scheduler))
+        self.assertEqual(copy.ready_in("a.test"), 0)
+        copy.merge(scheduler.stats)
+        self.assertEqual(copy.stats["throttled"], 6)
+        self.assertEqual(copy.settings()["backoff"], 0.05)
+
+        self.assertIsNone(capture_scheduler.open_scheduler(None))
+        self.assertEqual(capture_scheduler.open_scheduler(
+            {"max_per_host": 2}).max_per_host, 2)
+        with self.assertRaises(ValueError):
+            capture_scheduler.open_scheduler({"per_host": 2})
+
+    def test_get_screenshots(self):
+        urls = ["https://throttled.test/1", "https://ok.test/1"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            context = sync(chutie.get_screenshots(
+                urls, ["64x48"], Path(tmpdir), concurrency=2,
+                scheduler={"max_per_host": 1, "backoff": 0.01},
+                browser=ThrottlingBrowser()))
+            throttled, ok = (context["pages"][url] for url in urls)
+            self.assertTrue(all(data.get("failed") for data in throttled))
+            self.assertIn("429", throttled[0]["error"])
+            self.assertFalse(any(data.get("failed") for data in ok))
+            self.assertEqual(context["scheduler"]["throttled"], 1)
+
+            # retried once the host's backoff is over
+            context = sync(chutie.get_screenshots(
+                urls, ["64x48"], Path(tmpdir), retry=dict(backoff=0.01),
+                scheduler={"max_per_host": 1}, browser=ThrottlingBrowser()))
+            throttled = context["pages"][urls[0]]
+            self.assertFalse(any(data.get("failed") for data in throttled))
+            self.assertEqual(throttled[0]["retries"], 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.sources`."""
+
+
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from chutie import sources
+
+SITEMAP = """<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.org/a</loc><lastmod>2019-01-01</lastmod></url>
+  <url><loc> https://example.org/b </loc></url>
+</urlset>
+"""
+
+SITEMAP_INDEX = """<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://example.org/sitemap-1.xml</loc></sitemap>
+  <sitemap><loc>sitemap-2.xml.gz</loc></sitemap>
+  <sitemap><loc>https://example.org/missing.xml</loc></sitemap>
+</sitemapindex>
+"""
+
+
+class TestSources(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_normalize_url(self):
+        self.assertEqual(
+            sources.normalize_url("HTTPS://Example.ORG:443"),
+            "https://example.org/")
+        self.assertEqual(
+            sources.normalize_url("http://example.org:8080/A?b=1#c"),
+            "http://example.org:8080/A?b=1#c")
+        self.assertEqual(
+            sources.normalize_url("http://user:pw@Example.org:80/"),
+            "http://user:pw@example.org/")
+        self.assertEqual(
+            sources.normalize_url("file:///tmp/a.html#x"),
+            "file:///tmp/a.html#x")
+
+    def test_hashed_set(self):
+        seen = sources.HashedSet(capacity=4)
+        urls = [f"https://example.org/{n}" for n in range(1000)]
+        self.assertTrue(all(seen.add(url) for url in urls))
+        self.assertFalse(any(seen.add(url) for url in urls))
+        self.assertEqual(len(seen), 1000)
+        self.assertIn(urls[500], seen)
+        self.assertNotIn("https://example.org/1000", seen)
+
+    def test_bloom_filter(self):
+        seen = sources.BloomFilter(1000, error_rate=1e-3)
+        urls = [f"https://example.org/{n}" for n in range(1000)]
+        added = sum(seen.add(url) for url in urls)
+        self.assertGreater(added, 990)
+        self.assertTrue(all(url in seen for url in urls))
+        self.assertFalse(any(seen.add(url) for url in urls))
+
+    def test_iter_lines(self):
+        fileobj = io.StringIO("# urls\nhttps://example.org/a\n\n  b  \n")
+        self.assertEqual(
+            list(sources.iter_lines(fileobj)), ["https://example.org/a", "b"])
+
+    def test_iter_sitemap(self):
+        path = os.path.join(self.path, "sitemap.xml")
+        with open(path, "w") as _file:
+            _file.write(SITEMAP)
+        self.assertEqual(list(sources.iter_source(path)),
+                         ["https://example.org/a", "https://example.org/b"])
+
+    def test_iter_sitemap_index(self):
+        with open(os.path.join(self.path, "sitemap-1.xml"), "w") as _file:
+            _file.write(SITEMAP)
+        with gzip.open(os.path.join(self.path, "sitemap-2.xml.gz"),
+                       "wt") as _file:
+            _file.write(SITEMAP.replace("/a<", "/c<"))
+        path = os.path.join(self.path, "index.xml")
+        with open(path, "w") as _file:
+            _file.write(SITEMAP_INDEX)
+        with self.assertLogs(level="WARNING"):
+            urls = list(sources.iter_sitemap(path))
+        self.assertEqual(urls, [
+            "https://example.org/a", "https://example.org/b",
+            "https://example.org/c", "https://example.org/b"])
+
+    def test_iter_urls(self):
+        path = os.path.join(self.path, "urls.txt")
+        with open(path, "w") as _file:
+            _file.write("https://EXAMPLE.org:443/a\nhttps://example.org/c\n")
+        urls = [
+            "https://example.org/a",
+            {"url": "https://example.org/b", "settle": 1},
+            "https://example.org/b",
+            " https://example.org/b#x",
+        ]
+        with mock.patch("sys.stdin", io.StringIO("https://example.org/d\n")):
+            result = list(sources.iter_urls(urls, [path, "-"]))
+        self.assertEqual(result, [
+            "https://example.org/a",
+            {"url": "https://example.org/b", "settle": 1},
+            "https://example.org/b#x",
+            "https://example.org/c",
+            "https://example.org/d",
+        ])
+        self.assertEqual(
+            urls[1], {"url": "https://example.org/b", "settle": 1})
+        # duplicates are found by their normalized form, but urls are
+        # yielded as given
+        self.assertEqual(
+            list(sources.iter_urls(
+                ["https://Example.org", "https://example.org/"])),
+            ["https://Example.org"])
+
+    def test_iter_urls_is_lazy(self):
+        def _urls():
+            yield "https://example.org/a"
+            raise AssertionError("read too far")
+
+        urls = sources.iter_urls(_urls())
+        self.assertEqual(next(urls), "https://example.org/a")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.store`."""
+
+
+import pickle
+import tempfile
+import threading
+import unittest
+import urllib.request
+from pathlib import Path
+
+from syncer import sync
+
+from chutie import chutie
+from chutie import store
+from tests.test_chutie import FakeBrowser
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.store = store.ScreenshotStore(self.path / "shots.sqlite")
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_shot_name(self):
+        name = store.shot_name("http://example.org/a?b=c/d", "64x48", True)
+        self.assertTrue(name.startswith("shots/"))
+        self.assertTrue(name.endswith(".png"))
+        self.assertNotIn("?", name)
+        self.assertEqual(
+            name, store.shot_name("http://example.org/a?b=c/d", "64x48", 1))
+        self.assertNotEqual(
+            name, store.shot_name("http://example.org/a?b=c/d", "64x48",
+                                  False))
+
+    def test_put_get(self):
+        name = store.shot_name("about:blank", "64x48", False)
+        self.store.put(name, "about:blank", "64x48", False, b"image")
+        self.store.put(name, "about:blank", "64x48", False, b"image 2")
+        self.assertEqual(len(self.store), 1)
+        self.assertIn(name, self.store)
+        self.assertEqual(self.store.read(name), b"image 2")
+        self.assertEqual(
+            self.store.get("about:blank", "64x48", False), b"image 2")
+        self.assertIsNone(self.store.get("about:blank", "64x48", True))
+        self.assertEqual(list(self.store.entries()), [dict(
+            name=name, url="about:blank", pathstr="64x48", fullPage=False,
+            size=7)])
+
+        copy = pickle.loads(pickle.dumps(self.store))
+        self.assertEqual(copy.read(name), b"image 2")
+        copy.close()
+
+        self.assertEqual(self.store.extract(self.path / "out"), 1)
+        self.assertEqual((self.path / "out" / name).read_bytes(), b"image 2")
+
+    def test_get_screenshots(self):
+        dest = self.path / "dest"
+        with self.assertRaises(ValueError):
+            sync(chutie.get_screenshots(
+                ["about:blank"], ["64x48"], dest, store=self.store,
+                cache=str(self.path / "cache"), browser=FakeBrowser()))
+        context = sync(chutie.get_screenshots(
+            ["about:blank"], ["64x48", "32x16"], dest, store=self.store,
+            browser=FakeBrowser()))
+        self.assertEqual(context["store"], self.store.path)
+        datas = context["pages"]["about:blank"]
+        self.assertEqual(len(datas), 4)
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(list(dest.glob("*.png")), [])
+        for data in datas:
+            self.assertNotIn("path", data)
+            self.assertEqual(
+                self.store.read(data["filename"]),
+                self.store.get(data["url"], data["pathstr"],
+                               data["fullPage"]))
+        # the report links to the screenshots by filename, which is what
+        # chutie view serves them from the store as
+        html = chutie.render_template(context)
+        for data in datas:
+            self.assertIn(f'src="./{data["filename"]}"', html)
+        self.assertNotIn('src="./"', html)
+
+    def test_report_server(self):
+        name = store.shot_name("about:blank", "64x48", False)
+        self.store.put(name, "about:blank", "64x48", False, b"image")
+        (self.path / "chutie.html").write_text("report")
+        server = store.report_server(self.store.path, self.path, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            base = "http://%s:%d/" % server.server_address[:2]
+            with urllib.request.urlopen(base + name) as response:
+                self.assertEqual(response.read(), b"image")
+                self.assertEqual(
+                    response.headers["Content-Type"], "image/png")
+            with urllib.request.urlopen(base + "chutie.html") as response:
+                self.assertEqual(response.read(), b"report")
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.thumbnails`."""
+
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+from PIL import Image
+
+from chutie import chutie
+from chutie import cli
+from chutie import thumbnails
+
+
+class TestThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_make_thumbnail(self):
+        image = Image.new("RGB", (1000, 5000), "white")
+        image.paste((255, 0, 0), (0, 0, 1000, 2500))
+        image.save(str(self.path / "full.png"))
+        size = thumbnails.make_thumbnail(
+            str(self.path / "full.png"), str(self.path / "t.webp"),
+            width=100, max_height=300, band_rows=64)
+        self.assertEqual(size, (100, 300))
+        thumb = Image.open(str(self.path / "t.webp")).convert("RGB")
+        self.assertEqual(thumb.size, (100, 300))
+        red = thumb.getpixel((50, 100))
+        self.assertGreater(red[0], 200)
+        self.assertLess(red[1], 60)
+        self.assertGreater(min(thumb.getpixel((50, 280))), 200)
+
+        size = thumbnails.make_thumbnail(
+            str(self.path / "full.png"), str(self.path / "t.jpg"),
+            width=100, max_height=100, format="jpeg")
+        self.assertEqual(size, (100, 100))
+
+        # small screenshots are not upscaled
+        Image.new("RGB", (50, 20)).save(str(self.path / "small.png"))
+        size = thumbnails.make_thumbnail(
+            str(self.path / "small.png"), str(self.path / "s.png"),
+            width=100, format="png")
+        self.assertEqual(size, (50, 20))
+
+    def test_generate_thumbnails(self):
+        run = self.path / "run"
+        run.mkdir()
+        Image.new("RGB", (640, 480)).save(str(run / "a.png"))
+        context = {"date": "now", "viewports": {}, "pages": {"u": [
+            dict(url="u", filename="a.png", path=str(run / "a.png"),
+                 fullPage=False, page=dict(title="a"))]}}
+        jsonpath = run / "chutie.json"
+        jsonpath.write_text(json.dumps(context))
+
+        result = CliRunner().invoke(
+            cli.main, ["thumbnails", "-f", str(jsonpath), "-p", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        context = json.loads(jsonpath.read_text())
+        thumbnail = context["pages"]["u"][0]["thumbnail"]
+        self.assertEqual(thumbnail, str(run / "thumbs" / "a.webp"))
+        self.assertEqual(Image.open(thumbnail).size, (320, 240))
+
+        html = chutie.render_template(context)
+        self.assertIn(f'loading="lazy" src="./{thumbnail}"', html)
+        self.assertIn(f'href="./{run / "a.png"}"', html)
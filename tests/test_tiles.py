@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.tiles`."""
+
+
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+from syncer import sync
+
+from chutie import cache as capture_cache
+from chutie import chutie
+from chutie import diff
+from chutie import hashindex
+from chutie import png
+from chutie import store as capture_store
+from chutie import thumbnails
+from chutie import tiles
+from tests.test_chutie import FakeBrowser, FakePage
+
+
+class ScrollingPage(FakePage):
+    """A page ``page_height`` pixels tall whose viewport screenshots have
+    the page row number in the red channel of each row"""
+
+    page_height = 100
+
+    def __init__(self, browser):
+        super().__init__(browser)
+        self.scroll_y = 0
+
+    async def evaluate(self, js, *args):
+        self.browser.calls.append(("evaluate",))
+        if "scrollHeight" in js:
+            return self.page_height
+        if "scrollTo" in js:
+            self.scroll_y = max(0, min(
+                args[0], self.page_height - self.viewport["height"]))
+            return self.scroll_y
+
+    async def content(self):
+        return f"<html>{self.url}</html>"
+
+    async def screenshot(self, options=None, **kwargs):
+        options = dict(options or {}, **kwargs)
+        self.browser.calls.append(
+            ("screenshot", self.viewport["pathstr"], options["fullPage"],
+             options))
+        width, height = self.viewport["width"], self.viewport["height"]
+        return png.encode(
+            (bytes([(self.scroll_y + row) % 256, 0, 0, 255]) * width
+             for row in range(height)), width, height)
+
+
+class ScrollingBrowser(FakeBrowser):
+
+    async def newPage(self):
+        page = ScrollingPage(self)
+        self.pages.append(page)
+        return page
+
+
+def red_rows(image):
+    return [image.getpixel((0, row))[0] for row in range(image.height)]
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.browser = ScrollingBrowser()
+        self.page = ScrollingPage(self.browser)
+        self.page.viewport = dict(width=8, height=30, pathstr="8x30")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def screenshot(self):
+        return self.page.screenshot({"fullPage": False})
+
+    def test_plan_tiles(self):
+        self.assertEqual(tiles.plan_tiles(100, 30), (100, [0, 30, 60, 90]))
+        self.assertEqual(tiles.plan_tiles(100, 30, max_height=50),
+                         (50, [0, 30]))
+        self.assertEqual(tiles.plan_tiles(0, 30), (1, [0]))
+        self.assertEqual(
+            tiles.tile_name("a__8x30__full.png", 2),
+            "a__8x30__full__tile0002.png")
+
+    def test_stitch_tiles(self):
+        buffer = io.BytesIO()
+        manifest = sync(tiles.stitch_tiles(
+            self.page, self.screenshot, buffer))
+        self.assertEqual(manifest, dict(
+            mode="stitch", width=8, height=100, truncated=False, tiles=4))
+        image = Image.open(io.BytesIO(buffer.getvalue()))
+        self.assertEqual(image.size, (8, 100))
+        # the last tile (scrolled to 70, not 90) overlaps the third
+        self.assertEqual(red_rows(image), list(range(100)))
+        self.assertEqual(self.page.scroll_y, 0)
+
+        buffer = io.BytesIO()
+        manifest = sync(tiles.stitch_tiles(
+            self.page, self.screenshot, buffer, max_height=50))
+        self.assertTrue(manifest["truncated"])
+        image = Image.open(io.BytesIO(buffer.getvalue()))
+        self.assertEqual(red_rows(image), list(range(50)))
+
+    def test_write_tiles(self):
+        path = self.path / "a__8x30__full.png"
+        manifest = sync(tiles.write_tiles(
+            self.page, self.screenshot, str(path)))
+        self.assertEqual([tile["y"] for tile in manifest["tiles"]],
+                         [0, 30, 60, 70])
+        self.assertFalse(path.exists())
+        for tile in manifest["tiles"]:
+            image = Image.open(tile["path"])
+            self.assertEqual(red_rows(image)[0], tile["y"])
+            self.assertEqual(image.height, tile["height"])
+
+    def test_get_screenshots(self):
+        cache = capture_cache.CaptureCache(self.path / "cache")
+        context = sync(chutie.get_screenshots(
+            ["about:blank#a"], ["8x30"], self.path / "files", tiles="files",
+            cache=cache, browser=self.browser))
+        viewport, full = context["pages"]["about:blank#a"]
+        self.assertNotIn("tiled", viewport)
+        self.assertEqual(
+            full["filename"], full["tiled"]["tiles"][0]["filename"])
+        self.assertTrue(full["filename"].endswith("__full__tile0001.png"))
+        self.assertEqual(len(full["tiled"]["tiles"]), 4)
+        # no full page screenshot was taken
+        self.assertFalse(any(
+            call[2] for call in self.browser.calls
+            if call[0] == "screenshot"))
+
+        # the tiles are cached with the screenshot
+        context = sync(chutie.get_screenshots(
+            ["about:blank#a"], ["8x30"], self.path / "restored",
+            tiles="files", cache=cache, browser=self.browser))
+        viewport, full = context["pages"]["about:blank#a"]
+        self.assertTrue(full["cached"])
+        for tile in full["tiled"]["tiles"]:
+            self.assertTrue(Path(tile["path"]).exists())
+            self.assertIn("restored", tile["path"])
+
+        store = capture_store.ScreenshotStore(self.path / "shots.sqlite")
+        context = sync(chutie.get_screenshots(
+            ["about:blank#a"], ["8x30"], self.path, tiles="files",
+            max_height=45, store=store, browser=self.browser))
+        viewport, full = context["pages"]["about:blank#a"]
+        self.assertEqual(full["tiled"]["mode"], "stitch")
+        self.assertTrue(full["tiled"]["truncated"])
+        image = Image.open(io.BytesIO(store.read(full["filename"])))
+        self.assertEqual(red_rows(image), list(range(45)))
+        store.close()
+
+        with self.assertRaises(ValueError):
+            sync(chutie.get_screenshots(
+                ["about:blank#a"], ["8x30"], self.path, tiles="mosaic",
+                browser=self.browser))
+
+    def test_tiled_runs(self):
+        jsonpaths = []
+        for run in ("a", "b"):
+            dest = self.path / run
+            context = sync(chutie.get_screenshots(
+                ["about:blank#a"], ["8x30"], dest, tiles="files",
+                browser=self.browser))
+            viewport, full = context["pages"]["about:blank#a"]
+            self.assertEqual(
+                tiles.screenshot_files(full), full["tiled"]["tiles"])
+            self.assertEqual(tiles.screenshot_files(viewport), [viewport])
+            # every tile is hashed and thumbnailed, not only the first
+            hashindex.index_screenshots(context, dest, processes=1)
+            thumbnails.generate_thumbnails(context, dest, processes=1)
+            for tile in full["tiled"]["tiles"]:
+                self.assertIn("sha256", tile)
+                self.assertTrue(Path(tile["thumbnail"]).exists())
+            jsonpaths.append(str(dest / "chutie.json"))
+            with open(jsonpaths[-1], "w") as _file:
+                json.dump(context, _file)
+
+        result = diff.diff_runs(*jsonpaths, str(self.path / "diff"),
+                                processes=1)
+        self.assertEqual(
+            [(pair["fullPage"], pair.get("tile"), pair["different_pixels"])
+             for pair in result["pairs"]],
+            [(False, None, 0)] + [(True, n, 0) for n in range(1, 5)])
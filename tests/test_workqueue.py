@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `chutie.workqueue`."""
+
+
+import asyncio
+import json
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from click.testing import CliRunner
+from syncer import sync
+
+from chutie import chutie
+from chutie import cli
+from chutie import workqueue
+from tests.test_chutie import FakeBrowser
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.viewports = chutie._build_viewports(["64x48", "32x16"])
+        self.queue = workqueue.WorkQueue(self.path / "queue.sqlite", lease=60)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmpdir.cleanup()
+
+    def test_enqueue_and_claim(self):
+        added = self.queue.enqueue(
+            ["about:blank#a", {"url": "about:blank#b", "settle": 1}],
+            self.viewports, options={"image_format": "jpeg"})
+        self.assertEqual(added, 4)
+        self.assertEqual(
+            self.queue.enqueue(["about:blank#a"], self.viewports), 0)
+        self.assertEqual(self.queue.options, {"image_format": "jpeg"})
+        self.assertEqual(list(self.queue.viewports), ["64x48", "32x16"])
+        with self.assertRaises(ValueError):
+            self.queue.enqueue([], self.viewports, options={"bogus": 1})
+
+        # a second connection, as another worker would have
+        other = workqueue.WorkQueue(self.queue.path)
+        first = self.queue.claim("w1", limit=3)
+        second = other.claim("w2", limit=3)
+        other.close()
+        self.assertEqual(first, [
+            ("about:blank#a", "64x48", None),
+            ("about:blank#a", "32x16", None),
+            ("about:blank#b", "64x48", {"settle": 1}),
+        ])
+        self.assertEqual(second, [("about:blank#b", "32x16", {"settle": 1})])
+        self.assertEqual(self.queue.claim("w1"), [])
+        self.assertEqual(self.queue.counts()["leased"], 4)
+
+        self.queue.release("w2")
+        self.assertEqual(self.queue.claim("w1"),
+                         [("about:blank#b", "32x16", {"settle": 1})])
+
+    def test_expired_leases(self):
+        self.queue.enqueue(
+            ["about:blank"], {"64x48": self.viewports["64x48"]})
+        self.queue.lease = -1
+        for attempt in range(workqueue.DEFAULT_MAX_ATTEMPTS):
+            self.assertEqual(len(self.queue.claim(f"w{attempt}")), 1)
+        # claimed too many times by workers that went away
+        self.assertEqual(self.queue.claim("w"), [])
+        self.assertEqual(self.queue.counts()["failed"], 1)
+        datas = self.queue.assemble()["pages"]["about:blank"]
+        self.assertTrue(datas[0]["failed"])
+        self.assertIn("abandoned", datas[0]["error"])
+
+        self.queue.enqueue(["about:blank#2"], self.viewports)
+        self.queue.claim("w", limit=1)
+        time.sleep(0.01)
+        self.queue.lease = 60
+        self.assertEqual(self.queue.heartbeat("w"), 1)
+        self.assertEqual(len(self.queue.claim("v", limit=2)), 1)
+
+    def test_heartbeat_retries(self):
+        class LockedQueue(object):
+            lease = 0.03
+            beats = 0
+
+            def heartbeat(self, worker):
+                self.beats += 1
+                if self.beats == 1:
+                    raise sqlite3.OperationalError("database is locked")
+                return 1
+
+        queue = LockedQueue()
+
+        @sync
+        async def run():
+            heartbeat = asyncio.ensure_future(
+                workqueue._heartbeat(queue, "w"))
+            await asyncio.sleep(0.05)
+            heartbeat.cancel()
+
+        with self.assertLogs(level="WARNING"):
+            run()
+        # still beating after the failed one
+        self.assertGreaterEqual(queue.beats, 2)
+
+    def test_complete_and_assemble(self):
+        self.queue.enqueue(["about:blank#a", "about:blank#b"], self.viewports)
+        self.queue.claim("w", limit=4)
+
+        def datas(url, pathstr, **extra):
+            return [dict(url=url, pathstr=pathstr, fullPage=fullPage,
+                         filename=f"{pathstr}-{fullPage}.png", **extra)
+                    for fullPage in (False, True)]
+
+        self.queue.complete("w", "about:blank#b", datas(
+            "about:blank#b", "32x16") + [
+            dict(url="about:blank#b", pathstr="64x48", failed=True,
+                 error="timeout")])
+        self.queue.complete("w", "about:blank#a", datas(
+            "about:blank#a", "32x16") + datas("about:blank#a", "64x48"))
+        # a late duplicate does not replace screenshots
+        self.queue.complete("v", "about:blank#a", [
+            dict(url="about:blank#a", pathstr="64x48", failed=True,
+                 error="late")])
+
+        context = self.queue.assemble(dest_path="out")
+        self.assertEqual(context["urls"], ["about:blank#a", "about:blank#b"])
+        self.assertEqual(
+            [(data["pathstr"], data.get("fullPage"))
+             for data in context["pages"]["about:blank#a"]],
+            [("64x48", False), ("64x48", True),
+             ("32x16", False), ("32x16", True)])
+        self.assertEqual(context["pages"]["about:blank#a"][0]["path"],
+                         str(Path("out") / "64x48-False.png"))
+        self.assertTrue(context["pages"]["about:blank#b"][0]["failed"])
+        self.assertEqual(context["queue"]["done"], 3)
+        self.assertEqual(context["queue"]["failed"], 1)
+        self.assertFalse(self.queue.unfinished())
+
+    def test_run_worker(self):
+        self.queue.enqueue(
+            ["about:blank#a", "about:blank#b", "slow:c"], self.viewports,
+            options={"single_capture": True})
+        browser = FakeBrowser()
+        stats = sync(workqueue.run_worker(
+            self.queue, self.path, worker="w", concurrency=2,
+            browser=browser))
+        self.assertEqual(stats["urls"], 3)
+        self.assertEqual(stats["screenshots"], 8)
+        self.assertEqual(stats["failed"], 2)
+        self.assertEqual(
+            len([call for call in browser.calls if call[0] == "goto"]), 3)
+        # single_capture: one screenshot per viewport
+        self.assertEqual(
+            len([call for call in browser.calls
+                 if call[0] == "screenshot"]), 4)
+        context = self.queue.assemble()
+        self.assertEqual(self.queue.counts()["done"], 4)
+        for data in context["pages"]["about:blank#a"]:
+            self.assertTrue((self.path / data["filename"]).exists())
+
+    def test_cli(self):
+        runner = CliRunner()
+        queue_path = str(self.path / "cli.sqlite")
+        result = runner.invoke(cli.main, [
+            "enqueue", "-q", queue_path, "-u", "http://example.org/a",
+            "-u", "HTTP://example.org:80/a", "-r", "64x48",
+            "--format", "jpeg"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Added 1 tasks", result.output)
+
+        queue = workqueue.WorkQueue(queue_path)
+        queue.claim("w")
+        queue.complete("w", "http://example.org/a", [dict(
+            url="http://example.org/a", pathstr="64x48", fullPage=False,
+            filename="a.jpg")])
+        queue.close()
+        output = str(self.path / "chutie.json")
+        result = runner.invoke(
+            cli.main, ["assemble", "-q", queue_path, "-o", output])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(output) as _file:
+            context = json.load(_file)
+        self.assertEqual(list(context["pages"]), ["http://example.org/a"])
+        self.assertEqual(context["pages"]["http://example.org/a"][0]["path"],
+                         str(self.path / "a.jpg"))